@@ -3,14 +3,34 @@ ASGI config for backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+HTTP goes to Django; WebSocket connections to /ws/rides/<id>/ are served by
+the live ride tracking handler in drivo/realtime.py.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
 
 import os
+import re
 
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after get_asgi_application() so the app registry is ready
+from drivo.realtime import ride_websocket  # noqa: E402
+
+RIDE_WEBSOCKET_PATH = re.compile(r'^/ws/rides/(?P<ride_id>\d+)/?$')
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        match = RIDE_WEBSOCKET_PATH.match(scope['path'])
+        if match is None:
+            await send({'type': 'websocket.close', 'code': 4404})
+            return
+        await ride_websocket(scope, receive, send, int(match.group('ride_id')))
+        return
+    await django_application(scope, receive, send)
@@ -195,6 +195,142 @@ CACHES = {
 # Custom settings for the application
 API_BASE_URL = os.getenv('API_BASE_URL', 'http://192.168.100.7:8000')
 
+# In-memory grid index of available drivers (drivo/spatial_index.py)
+DRIVER_INDEX_CELL_SIZE_DEG = float(os.getenv('DRIVER_INDEX_CELL_SIZE_DEG', '0.01'))  # ~1.1 km
+DRIVER_INDEX_SYNC_SECONDS = int(os.getenv('DRIVER_INDEX_SYNC_SECONDS', '5'))
+
+# Write-behind buffering of driver positions (drivo/location_buffer.py)
+LOCATION_WRITE_BEHIND = os.getenv('LOCATION_WRITE_BEHIND', 'True').lower() in ['true', '1', 't']
+LOCATION_FLUSH_INTERVAL_SECONDS = float(os.getenv('LOCATION_FLUSH_INTERVAL_SECONDS', '2'))
+
+# Largest number of GPS fixes accepted by driver/locations/batch/, and how far
+# ahead of server time a fix may be stamped (anything closer is clamped to now)
+DRIVER_LOCATION_BATCH_MAX_FIXES = int(os.getenv('DRIVER_LOCATION_BATCH_MAX_FIXES', '500'))
+DRIVER_LOCATION_MAX_CLOCK_SKEW_SECONDS = int(os.getenv('DRIVER_LOCATION_MAX_CLOCK_SKEW_SECONDS', '30'))
+
+# GPS fixes per packed ride trail chunk while a ride is in progress (drivo/ride_trail.py)
+TRAIL_CHUNK_POINTS = int(os.getenv('TRAIL_CHUNK_POINTS', '300'))
+
+# Live ride tracking push channel (drivo/realtime.py). Set RIDE_BROKER_URL
+# (e.g. tcp://127.0.0.1:8765, served by `manage.py run_ride_broker`) when
+# running more than one ASGI worker.
+RIDE_BROKER_URL = os.getenv('RIDE_BROKER_URL') or None
+RIDE_EVENTS_HEARTBEAT_SECONDS = int(os.getenv('RIDE_EVENTS_HEARTBEAT_SECONDS', '20'))
+RIDE_EVENTS_QUEUE_SIZE = int(os.getenv('RIDE_EVENTS_QUEUE_SIZE', '64'))
+
+# Drivers still 'available' with no location update for this long are set
+# offline by `manage.py expire_stale_drivers`
+DRIVER_LOCATION_TTL_SECONDS = int(os.getenv('DRIVER_LOCATION_TTL_SECONDS', '300'))
+DRIVER_SWEEP_INTERVAL_SECONDS = int(os.getenv('DRIVER_SWEEP_INTERVAL_SECONDS', '30'))
+
+# Offline routing (drivo/routing.py). ROUTING_GRAPH_DIR holds nodes.csv and
+# edges.csv from an OSM extract; without it the app's own distance,
+# duration and fare are kept.
+ROUTING_GRAPH_DIR = os.getenv('ROUTING_GRAPH_DIR') or None
+ROUTING_DEFAULT_SPEED_KMH = float(os.getenv('ROUTING_DEFAULT_SPEED_KMH', '40'))
+ROUTING_MAX_SNAP_KM = float(os.getenv('ROUTING_MAX_SNAP_KM', '1.0'))
+FARE_PER_HOUR = float(os.getenv('FARE_PER_HOUR', '300'))
+FARE_NIGHT_FACTOR = float(os.getenv('FARE_NIGHT_FACTOR', '1.25'))
+# Where the night tariff (from 21:00) is judged; pickups are converted to
+# this zone whatever offset they were sent with
+FARE_TIME_ZONE = os.getenv('FARE_TIME_ZONE', 'Asia/Karachi')
+
+# Persistent geocoder cache (drivo/geocoding.py): table rows kept before LRU
+# eviction, entries held in each worker's memory, and how often hits served
+# from memory are written back to the table
+GEOCODE_CACHE_MAX_ENTRIES = int(os.getenv('GEOCODE_CACHE_MAX_ENTRIES', '50000'))
+GEOCODE_MEMORY_CACHE_SIZE = int(os.getenv('GEOCODE_MEMORY_CACHE_SIZE', '1024'))
+GEOCODE_CACHE_TOUCH_SECONDS = int(os.getenv('GEOCODE_CACHE_TOUCH_SECONDS', '30'))
+
+# Offline gazetteer for geocode/autocomplete/ (drivo/gazetteer.py). Defaults
+# to the bundled drivo/data/places.csv; shorter queries than
+# GEOCODE_AUTOCOMPLETE_UPSTREAM_MIN_CHARS never reach the upstream geocoder.
+GAZETTEER_PATH = os.getenv('GAZETTEER_PATH') or None
+GEOCODE_AUTOCOMPLETE_UPSTREAM_MIN_CHARS = int(os.getenv('GEOCODE_AUTOCOMPLETE_UPSTREAM_MIN_CHARS', '3'))
+
+# reverse-geocode/: answers are cached per REVERSE_GEOCODE_GRID_M cell; a
+# gazetteer place this close answers locally, and the nearest one within
+# REVERSE_GEOCODE_FALLBACK_KM stands in while the upstream service is down
+REVERSE_GEOCODE_GRID_M = float(os.getenv('REVERSE_GEOCODE_GRID_M', '20'))
+REVERSE_GEOCODE_LOCAL_RADIUS_M = float(os.getenv('REVERSE_GEOCODE_LOCAL_RADIUS_M', '150'))
+REVERSE_GEOCODE_FALLBACK_KM = float(os.getenv('REVERSE_GEOCODE_FALLBACK_KM', '5'))
+
+# Concurrent geocode misses for one query share a single upstream call. Set
+# GEOCODE_SINGLE_FLIGHT_SHARED when CACHES is shared between processes (Redis)
+# to coalesce across workers too.
+GEOCODE_SINGLE_FLIGHT_SHARED = os.getenv('GEOCODE_SINGLE_FLIGHT_SHARED', 'False').lower() in ['true', '1', 't']
+GEOCODE_SINGLE_FLIGHT_WAIT_SECONDS = float(os.getenv('GEOCODE_SINGLE_FLIGHT_WAIT_SECONDS', '6'))
+
+# Upstream geocoder, and the async geocode/async/ path (drivo/geocoding_async.py):
+# requests in flight at once (match the upstream's rate limit) and how long a
+# request may wait for a slot before it is answered from the local fallbacks
+NOMINATIM_URL = os.getenv('NOMINATIM_URL', 'https://nominatim.openstreetmap.org')
+GEOCODE_ASYNC_CONCURRENCY = int(os.getenv('GEOCODE_ASYNC_CONCURRENCY', '4'))
+GEOCODE_ASYNC_QUEUE_SECONDS = float(os.getenv('GEOCODE_ASYNC_QUEUE_SECONDS', '0.5'))
+
+# Batch geocoding (geocode/batch/ and the geocode_batch command): upstream
+# calls per second and burst shared by every batch in the process (Nominatim's
+# usage policy allows one per second), worker threads per batch, and the
+# largest batch the endpoint accepts
+GEOCODE_BATCH_RATE = float(os.getenv('GEOCODE_BATCH_RATE', '1'))
+GEOCODE_BATCH_BURST = int(os.getenv('GEOCODE_BATCH_BURST', '1'))
+GEOCODE_BATCH_WORKERS = int(os.getenv('GEOCODE_BATCH_WORKERS', '4'))
+GEOCODE_BATCH_MAX_QUERIES = int(os.getenv('GEOCODE_BATCH_MAX_QUERIES', '500'))
+
+# Ride dispatch (drivo/dispatch.py): drivers offered a new request per round,
+# how far from the pickup they may be, how long an offer stands, how many
+# rounds a request gets, and how long `manage.py run_dispatcher` keeps
+# retrying requests that found nobody
+DISPATCH_OFFER_COUNT = int(os.getenv('DISPATCH_OFFER_COUNT', '3'))
+DISPATCH_RADIUS_KM = float(os.getenv('DISPATCH_RADIUS_KM', '5'))
+DISPATCH_OFFER_SECONDS = int(os.getenv('DISPATCH_OFFER_SECONDS', '30'))
+DISPATCH_MAX_ROUNDS = int(os.getenv('DISPATCH_MAX_ROUNDS', '5'))
+DISPATCH_WINDOW_SECONDS = int(os.getenv('DISPATCH_WINDOW_SECONDS', '600'))
+DISPATCH_SWEEP_INTERVAL_SECONDS = int(os.getenv('DISPATCH_SWEEP_INTERVAL_SECONDS', '5'))
+
+# Batch assignment (drivo/assignment.py, `manage.py assign_rides`): zone size
+# as a geohash prefix length, the pair cost weights per km and per minute of
+# pickup, the furthest pickup allowed, the road-graph ETA cutoff, the
+# straight-line detour factor used without a graph, and the --loop interval
+ASSIGNMENT_ZONE_PRECISION = int(os.getenv('ASSIGNMENT_ZONE_PRECISION', '5'))
+ASSIGNMENT_DISTANCE_WEIGHT = float(os.getenv('ASSIGNMENT_DISTANCE_WEIGHT', '1'))
+ASSIGNMENT_ETA_WEIGHT = float(os.getenv('ASSIGNMENT_ETA_WEIGHT', '0.5'))
+ASSIGNMENT_MAX_PICKUP_KM = float(os.getenv('ASSIGNMENT_MAX_PICKUP_KM', '5'))
+ASSIGNMENT_MAX_ETA_MIN = float(os.getenv('ASSIGNMENT_MAX_ETA_MIN', '15'))
+ASSIGNMENT_DETOUR_FACTOR = float(os.getenv('ASSIGNMENT_DETOUR_FACTOR', '1.3'))
+ASSIGNMENT_INTERVAL_SECONDS = int(os.getenv('ASSIGNMENT_INTERVAL_SECONDS', '5'))
+
+# Ride scheduler (drivo/scheduler.py, `manage.py run_scheduler`): how long
+# before pickup a scheduled request is released to drivers, and the timing
+# wheel's tick (also the --loop interval)
+SCHEDULER_LEAD_MINUTES = int(os.getenv('SCHEDULER_LEAD_MINUTES', '15'))
+SCHEDULER_TICK_SECONDS = float(os.getenv('SCHEDULER_TICK_SECONDS', '1'))
+
+# Ride request expiry (`manage.py expire_ride_requests`): minutes a request
+# stays open after it was made (or after its scheduled pickup), rows expired
+# per transaction, and the --loop interval
+RIDE_REQUEST_TTL_MINUTES = int(os.getenv('RIDE_REQUEST_TTL_MINUTES', '30'))
+RIDE_REQUEST_SWEEP_CHUNK = int(os.getenv('RIDE_REQUEST_SWEEP_CHUNK', '500'))
+RIDE_REQUEST_SWEEP_INTERVAL_SECONDS = int(os.getenv('RIDE_REQUEST_SWEEP_INTERVAL_SECONDS', '60'))
+
+# Demand/supply heatmap (drivo/heatmap.py, heatmap/?bbox=): grid bounds as
+# min_lat,min_lon,max_lat,max_lon, cell size, the rolling window, its time
+# bucket and how often each process picks up the others' writes
+HEATMAP_BOUNDS = tuple(float(v) for v in os.getenv('HEATMAP_BOUNDS', '23.5,60.5,37.5,78.0').split(','))
+HEATMAP_CELL_SIZE_DEG = float(os.getenv('HEATMAP_CELL_SIZE_DEG', '0.05'))
+HEATMAP_WINDOW_MINUTES = int(os.getenv('HEATMAP_WINDOW_MINUTES', '30'))
+HEATMAP_BUCKET_SECONDS = int(os.getenv('HEATMAP_BUCKET_SECONDS', '60'))
+HEATMAP_SYNC_SECONDS = float(os.getenv('HEATMAP_SYNC_SECONDS', '5'))
+
+# Ride change long-poll (rides/<id>/changes/): longest a poll is held open,
+# and how often the waiting poll re-reads the ride's version
+RIDE_CHANGES_TIMEOUT_SECONDS = int(os.getenv('RIDE_CHANGES_TIMEOUT_SECONDS', '25'))
+RIDE_CHANGES_RECHECK_SECONDS = float(os.getenv('RIDE_CHANGES_RECHECK_SECONDS', '5'))
+
+# Seconds a driver's serialized current ride stays cached
+# (drivo/current_ride_cache.py); status changes invalidate it sooner. 0 disables
+CURRENT_RIDE_CACHE_SECONDS = int(os.getenv('CURRENT_RIDE_CACHE_SECONDS', '30'))
+
 # Security settings for production
 if not DEBUG:
     SECURE_BROWSER_XSS_FILTER = True
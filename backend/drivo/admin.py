@@ -4,11 +4,14 @@ from django import forms
 from decimal import Decimal
 from django.utils.html import format_html
 from django.utils import timezone
+from django.db.models import F
 from .models import (
     User, DriverProfile, ClientProfile, Ride, Payment, Review, 
     EmailOTP, NotificationPreference, PushNotificationToken, RideRequest,
-    Cancellation, Earning
+    Cancellation, Earning, DriverLocationFix, DriverLocation, RideOffer
 )
+from .spatial_index import driver_index
+from .current_ride_cache import current_ride_cache
 
 # Custom form for ClientProfile to handle DecimalField properly
 class ClientProfileAdminForm(forms.ModelForm):
@@ -42,14 +45,14 @@ class ClientProfileAdminForm(forms.ModelForm):
                 raise forms.ValidationError(f"Invalid longitude value: {e}")
         return longitude
 
-# Custom form for DriverProfile to handle DecimalField properly
-class DriverProfileAdminForm(forms.ModelForm):
+# Custom form for DriverLocation to handle DecimalField properly
+class DriverLocationAdminForm(forms.ModelForm):
     class Meta:
-        model = DriverProfile
+        model = DriverLocation
         fields = '__all__'
     
-    def clean_current_latitude(self):
-        latitude = self.cleaned_data.get('current_latitude')
+    def clean_latitude(self):
+        latitude = self.cleaned_data.get('latitude')
         if latitude is not None:
             try:
                 if isinstance(latitude, str):
@@ -63,8 +66,8 @@ class DriverProfileAdminForm(forms.ModelForm):
                 raise forms.ValidationError(f"Invalid latitude value: {e}")
         return latitude
     
-    def clean_current_longitude(self):
-        longitude = self.cleaned_data.get('current_longitude')
+    def clean_longitude(self):
+        longitude = self.cleaned_data.get('longitude')
         if longitude is not None:
             try:
                 if isinstance(longitude, str):
@@ -78,6 +81,12 @@ class DriverProfileAdminForm(forms.ModelForm):
                 raise forms.ValidationError(f"Invalid longitude value: {e}")
         return longitude
 
+class DriverLocationInline(admin.StackedInline):
+    model = DriverLocation
+    form = DriverLocationAdminForm
+    can_delete = False
+    verbose_name_plural = 'Location Information'
+
 @admin.register(User)
 class UserAdmin(BaseUserAdmin):
     list_display = ('email', 'is_driver', 'is_client', 'is_active', 'date_joined')
@@ -100,25 +109,21 @@ class UserAdmin(BaseUserAdmin):
 
 @admin.register(DriverProfile)
 class DriverProfileAdmin(admin.ModelAdmin):
-    form = DriverProfileAdminForm
     list_display = ('user', 'full_name', 'city', 'status', 'phone_number')
-    list_filter = ('status', 'city', 'bank_account_type')  
+    list_filter = ('status', 'vehicle_type', 'city', 'bank_account_type')  
     search_fields = ('user__email', 'full_name', 'phone_number', 'driving_license', 'cnic')
-    readonly_fields = ('last_location_update',)
+    inlines = [DriverLocationInline]
     
     fieldsets = (
         ('Basic Information', {
             'fields': ('user', 'full_name', 'age', 'cnic', 'phone_number', 'city', 'dp')
         }),
         ('Driver Details', {
-            'fields': ('driving_license', 'license_expiry', 'status')
+            'fields': ('driving_license', 'license_expiry', 'status', 'vehicle_type')
         }),
         ('Verification Status', {
             'fields': ('cnic_verified', 'phone_verified', 'license_verified', 'city_verified')
         }),
-        ('Location Information', {
-            'fields': ('current_latitude', 'current_longitude', 'last_location_update')
-        }),
         ('Bank Account Information', {
             'fields': (
                 'bank_account_type', 'bank_account_number', 'bank_account_holder', 
@@ -131,24 +136,38 @@ class DriverProfileAdmin(admin.ModelAdmin):
     
     def approve_drivers(self, request, queryset):
         updated = queryset.filter(status='pending').update(status='approved')
+        self._sync_driver_index(queryset)
         self.message_user(request, f"{updated} drivers have been approved.")
     approve_drivers.short_description = "Approve selected drivers"
     
     def reject_drivers(self, request, queryset):
         updated = queryset.filter(status='pending').update(status='rejected')
+        self._sync_driver_index(queryset)
         self.message_user(request, f"{updated} drivers have been rejected.")
     reject_drivers.short_description = "Reject selected drivers"
     
     def make_available(self, request, queryset):
         updated = queryset.filter(status__in=['approved', 'offline']).update(status='available')
+        self._sync_driver_index(queryset)
         self.message_user(request, f"{updated} drivers are now available.")
     make_available.short_description = "Mark selected drivers as available"
     
     def make_offline(self, request, queryset):
         updated = queryset.filter(status__in=['available', 'busy']).update(status='offline')
+        self._sync_driver_index(queryset)
         self.message_user(request, f"{updated} drivers are now offline.")
     make_offline.short_description = "Mark selected drivers as offline"
     
+    def _sync_driver_index(self, queryset):
+        # queryset.update() skips post_save, so push the new statuses to the index here
+        for row in queryset.values_list('id', 'status', 'full_name', 'location__latitude', 'location__longitude'):
+            driver_index.sync(*row)
+        current_ride_cache.invalidate_drivers(queryset)
+    
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        current_ride_cache.invalidate_driver(obj)
+    
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('user')
 
@@ -178,13 +197,13 @@ class ClientProfileAdmin(admin.ModelAdmin):
 
 @admin.register(RideRequest)
 class RideRequestAdmin(admin.ModelAdmin):
-    list_display = ('id', 'client', 'pickup_location', 'dropoff_location', 'scheduled_datetime', 'status', 'created_at')
+    list_display = ('id', 'client', 'pickup_location', 'dropoff_location', 'scheduled_datetime', 'status', 'expires_at', 'created_at')
     list_filter = ('status', 'fuel_type', 'vehicle_type', 'trip_type', 'created_at')
     search_fields = ('pickup_location', 'dropoff_location', 'client_user_email')
     readonly_fields = ('created_at', 'updated_at')
     
     fieldsets = (
-        ('Request Details', {'fields': ('client', 'status', 'created_at', 'updated_at')}),
+        ('Request Details', {'fields': ('client', 'status', 'expires_at', 'created_at', 'updated_at')}),
         ('Locations', {'fields': ('pickup_location', 'dropoff_location', 'pickup_latitude', 'pickup_longitude', 'dropoff_latitude', 'dropoff_longitude')}),
         ('Ride Details', {'fields': ('scheduled_datetime', 'vehicle_type', 'fuel_type', 'trip_type', 'estimated_fare')}),
     )
@@ -217,14 +236,29 @@ class RideAdmin(admin.ModelAdmin):
     actions = ['complete_rides', 'cancel_rides']
     
     def complete_rides(self, request, queryset):
-        queryset.update(status='completed')
+        self._set_status(queryset, 'completed')
         self.message_user(request, f"{queryset.count()} rides have been marked as completed.")
     complete_rides.short_description = "Mark selected rides as completed"
     
     def cancel_rides(self, request, queryset):
-        queryset.update(status='cancelled')
+        self._set_status(queryset, 'cancelled')
         self.message_user(request, f"{queryset.count()} rides have been cancelled.")
     cancel_rides.short_description = "Cancel selected rides"
+    
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # The form can change the driver too: forget the old and new driver's cached ride
+        current_ride_cache.invalidate_drivers(
+            DriverProfile.objects.filter(id__in=[obj.driver_id, form.initial.get('driver')])
+        )
+    
+    def _set_status(self, queryset, status):
+        # update() skips Ride.save(): bump the version for change long-polls
+        # and drop the drivers' cached current ride here
+        queryset.update(status=status, version=F('version') + 1, updated_at=timezone.now())
+        current_ride_cache.invalidate_drivers(
+            DriverProfile.objects.filter(id__in=queryset.exclude(driver=None).values('driver_id'))
+        )
 
 @admin.register(Payment)
 class PaymentAdmin(admin.ModelAdmin):
@@ -370,4 +404,20 @@ class EarningAdmin(admin.ModelAdmin):
     def mark_as_paid(self, request, queryset):
         queryset.update(payment_status='paid', paid_at=timezone.now())
         self.message_user(request, f"{queryset.count()} earnings have been marked as paid.")
-    mark_as_paid.short_description = "Mark selected earnings as paid"
\ No newline at end of file
+    mark_as_paid.short_description = "Mark selected earnings as paid"
+
+@admin.register(DriverLocationFix)
+class DriverLocationFixAdmin(admin.ModelAdmin):
+    list_display = ('id', 'driver', 'latitude', 'longitude', 'recorded_at', 'received_at')
+    list_filter = ('recorded_at',)
+    search_fields = ('driver__user__email',)
+    readonly_fields = ('received_at',)
+    list_select_related = ('driver',)
+
+@admin.register(RideOffer)
+class RideOfferAdmin(admin.ModelAdmin):
+    list_display = ('id', 'ride_request', 'driver', 'round', 'rank', 'distance_km', 'status', 'expires_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('driver__user__email',)
+    readonly_fields = ('created_at',)
+    list_select_related = ('ride_request', 'driver')
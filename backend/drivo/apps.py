@@ -1,6 +1,6 @@
 # apps.py
 from django.apps import AppConfig
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.contrib.auth import get_user_model
 
 class DrivoConfig(AppConfig):
@@ -11,6 +11,19 @@ class DrivoConfig(AppConfig):
         User = get_user_model()
         # Only connect the create_user_profile signal
         post_save.connect(create_user_profile, sender=User)
+        # Keep the in-memory available-driver index in step with profile writes
+        from .models import DriverProfile, DriverLocation
+        post_save.connect(sync_driver_index, sender=DriverProfile)
+        post_delete.connect(remove_from_driver_index, sender=DriverProfile)
+        post_save.connect(sync_driver_location_index, sender=DriverLocation)
+        # Store the last buffered fixes and compact the trail when a ride ends
+        from .models import Ride
+        post_save.connect(finish_ride_trail, sender=Ride)
+        # Push status changes to riders following the ride (realtime.py)
+        post_save.connect(publish_ride_update, sender=Ride)
+        # Withdraw dispatched offers once a request is no longer pending (dispatch.py)
+        from .models import RideRequest
+        post_save.connect(withdraw_ride_offers, sender=RideRequest)
         # Remove the save_user_profile signal as it's causing issues
         # post_save.connect(save_user_profile, sender=User)
 
@@ -42,4 +55,33 @@ def save_user_profile(sender, instance, **kwargs):
             if hasattr(instance, 'client_profile') and instance.client_profile:
                 instance.client_profile.save()
     except Exception as e:
-        print(f"Error saving user profile: {e}")
\ No newline at end of file
+        print(f"Error saving user profile: {e}")
+
+def sync_driver_index(sender, instance, **kwargs):
+    from .spatial_index import driver_index
+    driver_index.sync_profile(instance)
+
+def remove_from_driver_index(sender, instance, **kwargs):
+    from .spatial_index import driver_index
+    driver_index.remove(instance.id)
+
+def finish_ride_trail(sender, instance, **kwargs):
+    # Only on the transition: re-saving a finished ride must not move the
+    # driver's newer buffered fixes onto it
+    if instance.status_changed() and instance.status in ('completed', 'cancelled'):
+        from .ride_trail import finish_ride_trail as finish
+        finish(instance)
+
+def publish_ride_update(sender, instance, **kwargs):
+    from .realtime import publish_ride_status
+    publish_ride_status(instance)
+
+def withdraw_ride_offers(sender, instance, created, **kwargs):
+    if not created and instance.status != 'pending':
+        from .dispatch import withdraw_offers
+        withdraw_offers(instance)
+
+def sync_driver_location_index(sender, instance, **kwargs):
+    from .spatial_index import driver_index
+    driver = instance.driver
+    driver_index.sync(driver.id, driver.status, driver.full_name, instance.latitude, instance.longitude)
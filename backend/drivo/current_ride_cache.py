@@ -0,0 +1,98 @@
+# current_ride_cache.py
+"""
+Cache of each driver's serialized current ride (DriverCurrentRideView).
+
+The driver app polls that view constantly, and each call used to look up
+the profile, fetch the in-progress ride and serialize the nested client
+and driver graph. The finished payload is now kept in the default cache,
+keyed by the driver's user id, including the empty answer for drivers
+with no ride in progress.
+
+Nothing invalidates it implicitly. Every path that changes a ride's
+status or its driver's status must call invalidate_driver() or
+invalidate_drivers(): RideDetailView.patch, the respond and assign views
+(through dispatch.finish_accept), ResetDriverStatusView and the admin
+actions. CURRENT_RIDE_CACHE_SECONDS bounds the staleness of anything
+missed, and of other processes when the cache is per-process (LocMem).
+The driver's live position is laid over a hit from the location buffer,
+so the cached payload never freezes it.
+"""
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+class CurrentRideCache:
+    def __init__(self, timeout=30, key_prefix='drivo:current_ride'):
+        self.timeout = timeout
+        self.key_prefix = key_prefix
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def _key(self, user_id):
+        return f"{self.key_prefix}:{user_id}"
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.stats[name] += n
+
+    def get(self, user_id):
+        """The cached payload, or None on a miss"""
+        payload = cache.get(self._key(user_id)) if self.timeout else None
+        if payload is None:
+            self._count('misses')
+            return None
+        self._count('hits')
+        return _with_live_location(payload)
+
+    def set(self, user_id, payload):
+        if self.timeout:
+            cache.set(self._key(user_id), payload, self.timeout)
+
+    def invalidate_driver(self, driver_profile):
+        if driver_profile is not None:
+            self.invalidate_users([driver_profile.user_id])
+
+    def invalidate_drivers(self, driver_profiles):
+        """Invalidate every driver in a DriverProfile queryset"""
+        self.invalidate_users(list(driver_profiles.values_list('user_id', flat=True)))
+
+    def invalidate_users(self, user_ids):
+        user_ids = [user_id for user_id in user_ids if user_id is not None]
+        if not user_ids:
+            return
+        cache.delete_many([self._key(user_id) for user_id in user_ids])
+        self._count('invalidations', len(user_ids))
+
+    def summary(self):
+        with self._lock:
+            stats = dict(self.stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else None
+        stats['timeout'] = self.timeout
+        return stats
+
+
+def _with_live_location(payload):
+    # A fix still in the write-behind buffer is newer than the cached row
+    from rest_framework import serializers
+    from .location_buffer import location_buffer
+
+    driver = payload.get('driver')
+    if not driver or driver.get('id') is None:
+        return payload
+    buffered = location_buffer.get(driver['id'])
+    if buffered is None:
+        return payload
+    latitude, longitude, recorded_at = buffered
+    driver = dict(driver)
+    driver['current_latitude'] = f"{latitude:.6f}"
+    driver['current_longitude'] = f"{longitude:.6f}"
+    driver['last_location_update'] = serializers.DateTimeField().to_representation(recorded_at) if recorded_at else None
+    return dict(payload, driver=driver)
+
+
+current_ride_cache = CurrentRideCache(
+    timeout=getattr(settings, 'CURRENT_RIDE_CACHE_SECONDS', 30),
+)
@@ -0,0 +1,389 @@
+# dispatch.py
+"""
+Targeted ride offers instead of every driver polling every pending request.
+
+When a client creates a ride request, dispatch_ride_request() takes the
+drivers around the pickup from the in-memory driver index, ranks them by
+distance (ranking.rank), keeps those whose profile is still 'available'
+with the requested vehicle type, and offers the request to the best
+DISPATCH_OFFER_COUNT of them. Each offer is a RideOffer row, which feeds
+the driver's inbox (DriverRideRequestsView), and an 'offer' event on the
+driver's offers channel for apps holding the driver/offers/events/ stream.
+
+An offer lapses after DISPATCH_OFFER_SECONDS. Once every offer of a round
+has been declined or has lapsed, the request goes to the next-best drivers
+not asked yet, up to DISPATCH_MAX_ROUNDS rounds. Declines start the next
+round straight away; lapsed offers, and requests that found nobody, are
+picked up by `manage.py run_dispatcher` for DISPATCH_WINDOW_SECONDS after
+the request was made (or, for a scheduled ride, after its pickup time).
+When the request stops being pending, outstanding offers are withdrawn
+(the RideRequest post_save signal).
+
+A request nobody takes expires RIDE_REQUEST_TTL_MINUTES after it was made
+(or after its scheduled pickup): it can no longer be offered or accepted,
+and `manage.py expire_ride_requests` moves it to 'expired' in chunks.
+
+accept_ride_request() gives a request to exactly one driver however many
+accept at once (see claim_ride_request).
+"""
+import logging
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from .ranking import rank
+from .realtime import ride_events
+
+logger = logging.getLogger(__name__)
+
+
+def offers_channel(driver_id):
+    return f"offers:{driver_id}"
+
+
+def offer_event(offer, ride_request):
+    return {
+        'type': 'offer',
+        'offer_id': offer.id,
+        'ride_request_id': ride_request.id,
+        'pickup_location': ride_request.pickup_location,
+        'dropoff_location': ride_request.dropoff_location,
+        'pickup_latitude': float(ride_request.pickup_latitude),
+        'pickup_longitude': float(ride_request.pickup_longitude),
+        'vehicle_type': ride_request.vehicle_type,
+        'estimated_fare': str(ride_request.estimated_fare) if ride_request.estimated_fare is not None else None,
+        'distance_km': float(offer.distance_km) if offer.distance_km is not None else None,
+        'expires_at': offer.expires_at.isoformat(),
+    }
+
+
+def request_expires_at(scheduled_datetime=None, now=None):
+    """When a request made now (for pickup at scheduled_datetime) lapses"""
+    start = scheduled_datetime or now or timezone.now()
+    return start + timedelta(minutes=getattr(settings, 'RIDE_REQUEST_TTL_MINUTES', 30))
+
+
+def not_expired(now=None, prefix=''):
+    """Q for ride requests still inside their TTL (prefix e.g. 'ride_request__')"""
+    now = now or timezone.now()
+    return Q(**{f'{prefix}expires_at__isnull': True}) | Q(**{f'{prefix}expires_at__gt': now})
+
+
+def _publish(driver_id, event):
+    channel = offers_channel(driver_id)
+    # Without a broker nobody outside this process can be listening
+    if ride_events.broker is None and not ride_events.has_subscribers(channel):
+        return
+    ride_events.publish(channel, event)
+
+
+def select_drivers(ride_request, count, radius_km, exclude=()):
+    """
+    Up to count (driver_id, distance_km) pairs for the request's pickup,
+    closest first: available drivers with the requested vehicle type who
+    are not in exclude.
+    """
+    from .models import DriverProfile
+    from .spatial_index import driver_index
+
+    lat = float(ride_request.pickup_latitude)
+    lon = float(ride_request.pickup_longitude)
+    candidates = driver_index.candidates(lat, lon, radius_km)
+    if not len(candidates):
+        return []
+    ranked = [
+        (driver_id, distance) for driver_id, distance, _ in rank(candidates, lat, lon, len(candidates), radius_km)
+        if driver_id not in exclude
+    ]
+
+    # The index can be a few seconds behind; confirm status and vehicle in one query
+    chosen = []
+    for start in range(0, len(ranked), count * 4):
+        window = ranked[start:start + count * 4]
+        eligible = set(DriverProfile.objects.filter(
+            id__in=[driver_id for driver_id, _ in window],
+            status='available',
+            vehicle_type=ride_request.vehicle_type,
+        ).values_list('id', flat=True))
+        chosen.extend((driver_id, distance) for driver_id, distance in window if driver_id in eligible)
+        if len(chosen) >= count:
+            break
+    return chosen[:count]
+
+
+def dispatch_ride_request(ride_request):
+    """
+    Offer a pending request to the next round of drivers. Returns the new
+    offers; an empty list when nobody suitable is nearby, the request has
+    no pickup coordinates, or it has run out of rounds.
+    """
+    from .models import RideOffer
+
+    if ride_request.status != 'pending' or ride_request.pickup_latitude is None or ride_request.pickup_longitude is None:
+        return []
+    if ride_request.expires_at is not None and ride_request.expires_at <= timezone.now():
+        return []
+    count = getattr(settings, 'DISPATCH_OFFER_COUNT', 3)
+    radius_km = getattr(settings, 'DISPATCH_RADIUS_KM', 5.0)
+    offer_seconds = getattr(settings, 'DISPATCH_OFFER_SECONDS', 30)
+    max_rounds = getattr(settings, 'DISPATCH_MAX_ROUNDS', 5)
+
+    previous = RideOffer.objects.filter(ride_request=ride_request)
+    last_round = previous.aggregate(last=Max('round'))['last'] or 0
+    if last_round >= max_rounds:
+        return []
+    asked = set(previous.values_list('driver_id', flat=True))
+    drivers = select_drivers(ride_request, count, radius_km, exclude=asked)
+    if not drivers:
+        return []
+
+    expires_at = timezone.now() + timedelta(seconds=offer_seconds)
+    offers = [
+        RideOffer(
+            ride_request=ride_request,
+            driver_id=driver_id,
+            round=last_round + 1,
+            rank=position,
+            distance_km=Decimal(str(round(distance, 3))),
+            expires_at=expires_at,
+        )
+        for position, (driver_id, distance) in enumerate(drivers, start=1)
+    ]
+    try:
+        with transaction.atomic():
+            offers = RideOffer.objects.bulk_create(offers)
+    except IntegrityError:
+        # Another worker dispatched this request at the same moment
+        return []
+    # bulk_create only returns primary keys on some backends
+    if offers and offers[0].id is None:
+        offers = list(RideOffer.objects.filter(ride_request=ride_request, round=last_round + 1))
+
+    for offer in offers:
+        _publish(offer.driver_id, offer_event(offer, ride_request))
+    logger.info(
+        "Ride request %s round %s offered to drivers %s",
+        ride_request.id, last_round + 1, [offer.driver_id for offer in offers]
+    )
+    return offers
+
+
+def decline_offer(ride_request, driver_profile):
+    """
+    Record the driver's decline (even if they were never offered the
+    request, so they aren't offered it later) and start the next round
+    once no offer of the request is outstanding.
+    """
+    from .models import RideOffer
+
+    now = timezone.now()
+    updated = RideOffer.objects.filter(
+        ride_request=ride_request, driver=driver_profile, status='offered'
+    ).update(status='declined', responded_at=now)
+    if not updated:
+        RideOffer.objects.get_or_create(
+            ride_request=ride_request, driver=driver_profile,
+            defaults={'status': 'declined', 'round': 0, 'expires_at': now, 'responded_at': now}
+        )
+    if not RideOffer.objects.filter(ride_request=ride_request, status='offered', expires_at__gt=now).exists():
+        dispatch_ride_request(ride_request)
+
+
+def withdraw_offers(ride_request):
+    """Close a request's outstanding offers once it is no longer pending"""
+    return withdraw_request_offers([ride_request.id])
+
+
+def withdraw_request_offers(ride_request_ids):
+    """withdraw_offers() for many requests with one UPDATE"""
+    from .models import RideOffer
+
+    now = timezone.now()
+    outstanding = list(
+        RideOffer.objects.filter(ride_request_id__in=ride_request_ids, status='offered')
+        .values_list('id', 'driver_id', 'ride_request_id')
+    )
+    if not outstanding:
+        return 0
+    RideOffer.objects.filter(
+        id__in=[offer_id for offer_id, _, _ in outstanding], status='offered'
+    ).update(status='withdrawn', responded_at=now)
+    for _, driver_id, ride_request_id in outstanding:
+        _publish(driver_id, {'type': 'offer_withdrawn', 'ride_request_id': ride_request_id})
+    return len(outstanding)
+
+
+class AcceptConflict(Exception):
+    """The request or the driver was taken by a concurrent accept"""
+
+
+def ride_fields(ride_request):
+    """Ride columns copied from the request it was accepted from"""
+    return {
+        'client_id': ride_request.client_id,
+        'pickup_location': ride_request.pickup_location,
+        'dropoff_location': ride_request.dropoff_location,
+        'pickup_latitude': ride_request.pickup_latitude,
+        'pickup_longitude': ride_request.pickup_longitude,
+        'dropoff_latitude': ride_request.dropoff_latitude,
+        'dropoff_longitude': ride_request.dropoff_longitude,
+        'scheduled_datetime': ride_request.scheduled_datetime,
+        'vehicle_type': ride_request.vehicle_type,
+        'fuel_type': ride_request.fuel_type,
+        'trip_type': ride_request.trip_type,
+        'fare': ride_request.estimated_fare,
+        'distance': ride_request.distance,
+        'duration': ride_request.duration,
+    }
+
+
+def claim_ride_request(ride_request, driver_profile, driver_statuses=('available', 'offline'), ride_status='accepted'):
+    """
+    Give a pending request to one driver and return the new Ride; the
+    database side of accept_ride_request. Call finish_accept() once the
+    surrounding transaction has committed.
+
+    One transaction claims the request with UPDATE ... WHERE status='pending'
+    (and not expired),
+    flips the driver to 'busy' with UPDATE ... WHERE status IN driver_statuses
+    and inserts the ride. The database decides the race: the first claim
+    wins and every later one matches no row and raises AcceptConflict (as
+    does a driver who was taken meanwhile, which rolls the claim back).
+    Only the request row and the driver row are locked, and only until
+    the commit; requests and drivers are always locked in that order.
+    """
+    from .models import DriverProfile, Ride, RideOffer, RideRequest
+
+    now = timezone.now()
+    with transaction.atomic():
+        claimed = RideRequest.objects.filter(not_expired(now), pk=ride_request.pk, status='pending').update(
+            status='accepted', updated_at=now
+        )
+        if not claimed:
+            raise AcceptConflict("Ride request is no longer pending")
+        flipped = DriverProfile.objects.filter(pk=driver_profile.pk, status__in=driver_statuses).update(
+            status='busy', updated_at=now
+        )
+        if not flipped:
+            raise AcceptConflict("Driver is not available")
+        ride = Ride.objects.create(driver=driver_profile, status=ride_status, **ride_fields(ride_request))
+        RideOffer.objects.filter(ride_request=ride_request, driver=driver_profile, status='offered').update(
+            status='accepted', responded_at=now
+        )
+
+    ride_request.status = 'accepted'
+    ride_request.updated_at = now
+    driver_profile.status = 'busy'
+    driver_profile.updated_at = now
+    return ride
+
+
+def finish_accept(ride_request, driver_profile):
+    """
+    update() sends no post_save: drop the driver from the index, forget
+    their cached current ride and withdraw the request's other offers here
+    """
+    from .current_ride_cache import current_ride_cache
+    from .spatial_index import driver_index
+
+    driver_index.remove(driver_profile.id)
+    current_ride_cache.invalidate_driver(driver_profile)
+    withdraw_offers(ride_request)
+
+
+def accept_ride_request(ride_request, driver_profile, driver_statuses=('available', 'offline'), ride_status='accepted'):
+    """claim_ride_request followed by finish_accept; raises AcceptConflict when beaten to it"""
+    ride = claim_ride_request(ride_request, driver_profile, driver_statuses, ride_status)
+    finish_accept(ride_request, driver_profile)
+    return ride
+
+
+def redispatch_lapsed(limit=200):
+    """
+    Expire lapsed offers and start the next round for pending requests with
+    no outstanding offer. Returns (offers expired, requests dispatched).
+    """
+    from .models import RideOffer, RideRequest
+
+    now = timezone.now()
+    expired = RideOffer.objects.filter(status='offered', expires_at__lte=now).update(status='expired')
+    window = timedelta(seconds=getattr(settings, 'DISPATCH_WINDOW_SECONDS', 600))
+    waiting = RideRequest.objects.filter(
+        Q(created_at__gte=now - window) | Q(scheduled_datetime__gte=now - window),
+        not_expired(now), status='pending', pickup_latitude__isnull=False, pickup_longitude__isnull=False
+    ).exclude(
+        offers__status='offered'
+    ).annotate(
+        rounds=Max('offers__round')
+    ).filter(
+        Q(rounds__isnull=True) | Q(rounds__lt=getattr(settings, 'DISPATCH_MAX_ROUNDS', 5))
+    ).order_by('created_at')[:limit]
+
+    dispatched = 0
+    for ride_request in waiting:
+        if dispatch_ride_request(ride_request):
+            dispatched += 1
+    return expired, dispatched
+
+
+def expire_ride_requests(chunk_size=500, now=None):
+    """
+    Move pending and scheduled requests past expires_at to 'expired' and
+    withdraw their offers. Works through the (status, expires_at) index one
+    chunk per transaction so no long lock is held. Returns the number expired.
+    """
+    from .models import RideRequest
+
+    now = now or timezone.now()
+    total = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                RideRequest.objects.filter(status__in=['pending', 'scheduled'], expires_at__lte=now)
+                .order_by('expires_at').values_list('id', flat=True)[:chunk_size]
+            )
+            if not ids:
+                break
+            # Re-checked in the UPDATE: an accept may have won meanwhile
+            expired = RideRequest.objects.filter(
+                id__in=ids, status__in=['pending', 'scheduled']
+            ).update(status='expired', updated_at=now)
+        withdraw_request_offers(ids)
+        total += expired
+        if len(ids) < chunk_size:
+            break
+    return total
+
+
+# ---------- driver offer stream ----------
+def live_offer_events(driver_id):
+    """'offer' events for the driver's outstanding offers, newest first"""
+    from .models import RideOffer
+
+    offers = RideOffer.objects.filter(
+        not_expired(prefix='ride_request__'),
+        driver_id=driver_id, status='offered', expires_at__gt=timezone.now(), ride_request__status='pending'
+    ).select_related('ride_request').order_by('-created_at')
+    return [offer_event(offer, offer.ride_request) for offer in offers]
+
+
+async def driver_offer_stream(driver_id, heartbeat_seconds=None):
+    """
+    Yield the driver's outstanding offers, then every offer and withdrawal
+    as it is published. Yields None when heartbeat_seconds pass without one.
+    """
+    from asgiref.sync import sync_to_async
+
+    heartbeat_seconds = heartbeat_seconds or getattr(settings, 'RIDE_EVENTS_HEARTBEAT_SECONDS', 20)
+    subscription = ride_events.subscribe(offers_channel(driver_id))
+    try:
+        for event in await sync_to_async(live_offer_events)(driver_id):
+            yield event
+        while True:
+            yield await subscription.get(timeout=heartbeat_seconds)
+    finally:
+        subscription.close()
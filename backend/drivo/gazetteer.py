@@ -0,0 +1,244 @@
+# gazetteer.py
+"""
+Offline place lookup from the bundled gazetteer (data/places.csv).
+
+Names are normalized (lowercase, accents and punctuation stripped) and
+loaded into two in-memory indexes:
+
+- a prefix trie over each name, its aliases, the "name city" form and
+  every word suffix of the name, so "town" also finds "Model Town". Each
+  trie node keeps its best-ranked place ids, so a prefix lookup is a walk
+  of len(prefix) dict steps with no scan;
+- a trigram index for misspelt queries ("gulbrg"), scored by trigram
+  similarity.
+
+Exact matches rank first, then prefix matches, then fuzzy ones; ties go
+to the more important place.
+"""
+import csv
+import logging
+import os
+import re
+import threading
+import unicodedata
+
+import numpy as np
+from django.conf import settings
+
+from .ranking import haversine_km
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), 'data', 'places.csv')
+TOP_PER_NODE = 10
+MIN_SIMILARITY = 0.35
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(re.sub(r'[^0-9a-z]+', ' ', text.lower()).split())
+
+
+def trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class Place:
+    __slots__ = (
+        'id', 'name', 'aliases', 'kind', 'city', 'province', 'country', 'lat', 'lon', 'importance', 'display_name'
+    )
+
+    def __init__(self, id, name, kind, city, province, country, lat, lon, importance, aliases=()):
+        self.id = id
+        self.name = name
+        self.aliases = list(aliases)
+        self.kind = kind
+        self.city = city
+        self.province = province
+        self.country = country
+        self.lat = lat
+        self.lon = lon
+        self.importance = importance
+        self.display_name = ', '.join(part for part in (name, city, province, country) if part)
+
+    def as_result(self, match=None, score=None):
+        """Same shape as a Nominatim search result, plus how it matched"""
+        result = {
+            'lat': str(self.lat),
+            'lon': str(self.lon),
+            'display_name': self.display_name,
+            'name': self.name,
+            'type': self.kind,
+            'importance': self.importance,
+            'source': 'gazetteer',
+        }
+        if match is not None:
+            result['match'] = match
+        if score is not None:
+            result['score'] = round(score, 3)
+        return result
+
+
+class _TrieNode:
+    __slots__ = ('children', 'top')
+
+    def __init__(self):
+        self.children = {}
+        self.top = set()
+
+
+class Gazetteer:
+    def __init__(self, places):
+        self.places = list(places)
+        self._root = _TrieNode()
+        self._exact = {}  # normalized key -> [place id, ...]
+        self._trigrams = {}  # trigram -> [(place id, key trigram count), ...]
+
+        for place in self.places:
+            name = normalize(place.name)
+            keys = {name}
+            keys.update(normalize(alias) for alias in place.aliases if alias)
+            if place.city:
+                keys.update(f'{key} {normalize(place.city)}' for key in list(keys))
+            words = name.split()
+            keys.update(' '.join(words[i:]) for i in range(1, len(words)))
+            for key in keys:
+                if key:
+                    self._insert(key, place.id)
+            for key in {name, *(normalize(alias) for alias in place.aliases if alias)}:
+                self._exact.setdefault(key, []).append(place.id)
+                grams = trigrams(key)
+                for gram in grams:
+                    self._trigrams.setdefault(gram, []).append((place.id, len(grams)))
+
+        for key, ids in self._exact.items():
+            ids.sort(key=self._rank_key)
+        self._finalize(self._root)
+        self._lat = np.array([place.lat for place in self.places], dtype=np.float64)
+        self._lon = np.array([place.lon for place in self.places], dtype=np.float64)
+
+    def _rank_key(self, place_id):
+        return (-self.places[place_id].importance, place_id)
+
+    def _insert(self, key, place_id):
+        node = self._root
+        for ch in key:
+            node = node.children.setdefault(ch, _TrieNode())
+            node.top.add(place_id)
+
+    def _finalize(self, root):
+        # Keep only the best TOP_PER_NODE ids per node, ranked
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            node.top = tuple(sorted(node.top, key=self._rank_key)[:TOP_PER_NODE])
+            stack.extend(node.children.values())
+
+    def __len__(self):
+        return len(self.places)
+
+    def lookup(self, query):
+        """The best place whose name or alias is exactly the query, or None"""
+        ids = self._exact.get(normalize(query))
+        return self.places[ids[0]] if ids else None
+
+    def prefix(self, query):
+        node = self._root
+        for ch in query:
+            node = node.children.get(ch)
+            if node is None:
+                return ()
+        return node.top
+
+    def fuzzy(self, query, limit):
+        """(place id, similarity) pairs by trigram similarity, best first"""
+        grams = trigrams(query)
+        shared = {}
+        for gram in grams:
+            for place_id, size in self._trigrams.get(gram, ()):
+                key = (place_id, size)
+                shared[key] = shared.get(key, 0) + 1
+        best = {}
+        for (place_id, size), count in shared.items():
+            similarity = count / (len(grams) + size - count)
+            if similarity >= MIN_SIMILARITY and similarity > best.get(place_id, 0):
+                best[place_id] = similarity
+        ranked = sorted(best.items(), key=lambda item: (-item[1],) + self._rank_key(item[0]))
+        return ranked[:limit]
+
+    def nearest(self, lat, lon, kinds=None):
+        """(place, distance_km) of the closest place, optionally of the given kinds, or (None, None)"""
+        if not self.places:
+            return None, None
+        distances = haversine_km(lat, lon, self._lat, self._lon)
+        if kinds is not None:
+            allowed = np.array([place.kind in kinds for place in self.places])
+            if not allowed.any():
+                return None, None
+            distances = np.where(allowed, distances, np.inf)
+        best = int(np.argmin(distances))
+        return self.places[best], float(distances[best])
+
+    def search(self, query, limit=5):
+        """Ranked (place, match, score) tuples; match is 'exact', 'prefix' or 'fuzzy'"""
+        query = normalize(query)
+        if not query:
+            return []
+        limit = min(limit, TOP_PER_NODE)
+        results = []
+        seen = set()
+
+        def add(place_id, match, score):
+            if place_id not in seen and len(results) < limit:
+                seen.add(place_id)
+                results.append((self.places[place_id], match, score))
+
+        for place_id in self._exact.get(query, ()):
+            add(place_id, 'exact', 1.0)
+        for place_id in self.prefix(query):
+            add(place_id, 'prefix', None)
+        if len(results) < limit:
+            for place_id, similarity in self.fuzzy(query, limit):
+                add(place_id, 'fuzzy', similarity)
+        return results
+
+
+def load_places(path):
+    places = []
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            place = Place(
+                id=len(places),
+                name=row['name'].strip(),
+                kind=row.get('kind') or 'place',
+                city=(row.get('city') or '').strip(),
+                province=(row.get('province') or '').strip(),
+                country=(row.get('country') or '').strip(),
+                lat=float(row['lat']),
+                lon=float(row['lon']),
+                importance=float(row.get('importance') or 0),
+                aliases=[alias.strip() for alias in (row.get('alt_names') or '').split('|') if alias.strip()],
+            )
+            places.append(place)
+    return places
+
+
+_gazetteer = None
+_gazetteer_lock = threading.Lock()
+
+
+def gazetteer():
+    """The process-wide gazetteer, loaded from GAZETTEER_PATH on first use"""
+    global _gazetteer
+    if _gazetteer is None:
+        with _gazetteer_lock:
+            if _gazetteer is None:
+                path = getattr(settings, 'GAZETTEER_PATH', None) or DEFAULT_PATH
+                try:
+                    _gazetteer = Gazetteer(load_places(path))
+                except (OSError, KeyError, ValueError) as e:
+                    logger.error("Could not load gazetteer from %s: %s", path, e)
+                    _gazetteer = Gazetteer([])
+    return _gazetteer
@@ -0,0 +1,168 @@
+# geo.py
+import math
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.32
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+# 9 characters is a ~4.8 m x 4.8 m cell; shorter prefixes are the neighbourhoods
+GEOHASH_PRECISION = 9
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in kilometres"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (float(lat1), float(lon1), float(lat2), float(lon2)))
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def km_per_degree_lon(lat):
+    """Length of one degree of longitude at the given latitude"""
+    return max(KM_PER_DEGREE_LAT * math.cos(math.radians(float(lat))), 0.01)
+
+
+def parse_coordinates(lat, lon):
+    """Parse and validate a lat/lon pair, returning floats or raising ValueError"""
+    lat = float(lat)
+    lon = float(lon)
+    if math.isnan(lat) or math.isnan(lon):
+        raise ValueError("Coordinates must be numbers")
+    if lat < -90 or lat > 90:
+        raise ValueError("Latitude must be between -90 and 90")
+    if lon < -180 or lon > 180:
+        raise ValueError("Longitude must be between -180 and 180")
+    return lat, lon
+
+
+def bounding_box(lat, lon, radius_km):
+    """(min_lat, max_lat, min_lon, max_lon) enclosing a circle of radius_km"""
+    lat = float(lat)
+    lon = float(lon)
+    dlat = radius_km / KM_PER_DEGREE_LAT
+    dlon = min(radius_km / km_per_degree_lon(lat), 180.0)
+    return (
+        max(lat - dlat, -90.0), min(lat + dlat, 90.0),
+        max(lon - dlon, -180.0), min(lon + dlon, 180.0),
+    )
+
+
+def haversine_expression(lat_field, lon_field, lat, lon):
+    """ORM expression for the great-circle distance in km from (lat, lon) to the given columns"""
+    from django.db.models import FloatField, Value
+    from django.db.models.functions import ASin, Cast, Cos, Power, Radians, Sin, Sqrt
+
+    row_lat = Radians(Cast(lat_field, FloatField()))
+    row_lon = Radians(Cast(lon_field, FloatField()))
+    origin_lat = math.radians(float(lat))
+    origin_lon = math.radians(float(lon))
+    a = (
+        Power(Sin((row_lat - Value(origin_lat)) / Value(2.0)), 2)
+        + Value(math.cos(origin_lat)) * Cos(row_lat)
+        * Power(Sin((row_lon - Value(origin_lon)) / Value(2.0)), 2)
+    )
+    return Value(2 * EARTH_RADIUS_KM) * ASin(Sqrt(a))
+
+
+def nearest_by_sql(queryset, lat_field, lon_field, lat, lon, radius_km, k):
+    """
+    Prune with a lat/lon bounding box (servable by an index on the two columns),
+    then rank the survivors by haversine distance in SQL and keep the closest k.
+    Rows are annotated with distance_km.
+    """
+    min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+    return queryset.filter(**{
+        f'{lat_field}__range': (min_lat, max_lat),
+        f'{lon_field}__range': (min_lon, max_lon),
+    }).annotate(
+        distance_km=haversine_expression(lat_field, lon_field, lat, lon)
+    ).filter(
+        distance_km__lte=radius_km
+    ).order_by('distance_km')[:k]
+
+
+def geohash_encode(lat, lon, precision=GEOHASH_PRECISION):
+    """Standard base-32 geohash of a point"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    lat = float(lat)
+    lon = float(lon)
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True  # bits alternate longitude, latitude
+    while len(chars) < precision:
+        value, bounds = (lon, lon_range) if even else (lat, lat_range)
+        mid = (bounds[0] + bounds[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            bounds[0] = mid
+        else:
+            bits <<= 1
+            bounds[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def geohash_for(lat, lon, precision=GEOHASH_PRECISION):
+    """Geohash of a stored coordinate pair, or None if it is missing or invalid"""
+    if lat is None or lon is None:
+        return None
+    try:
+        lat, lon = parse_coordinates(lat, lon)
+    except (TypeError, ValueError, ArithmeticError):
+        return None
+    return geohash_encode(lat, lon, precision)
+
+
+def filter_geohash_prefix(queryset, field, query_params):
+    """
+    Apply ?geohash_prefix= as an indexed LIKE 'prefix%' scan on field.
+    Raises ValueError on a malformed prefix.
+    """
+    prefix = query_params.get('geohash_prefix')
+    if not prefix:
+        return queryset
+    prefix = prefix.strip().lower()
+    if len(prefix) > GEOHASH_PRECISION or any(char not in GEOHASH_ALPHABET for char in prefix):
+        raise ValueError(
+            f"'geohash_prefix' must be 1-{GEOHASH_PRECISION} geohash characters"
+        )
+    return queryset.filter(**{f'{field}__startswith': prefix})
+
+
+def parse_bbox(value):
+    """Parse 'min_lat,min_lon,max_lat,max_lon', returning floats or raising ValueError"""
+    parts = (value or '').split(',')
+    if len(parts) != 4:
+        raise ValueError("'bbox' must be in the form min_lat,min_lon,max_lat,max_lon")
+    min_lat, min_lon = parse_coordinates(parts[0], parts[1])
+    max_lat, max_lon = parse_coordinates(parts[2], parts[3])
+    if min_lat > max_lat or min_lon > max_lon:
+        raise ValueError("'bbox' minimums must not exceed its maximums")
+    return min_lat, min_lon, max_lat, max_lon
+
+
+def parse_near_params(query_params, default_radius_km=5.0, max_radius_km=50.0, default_k=20, max_k=100):
+    """
+    Read ?near=lat,lon&radius_km=&k= from a request's query params.
+    Returns None when 'near' is absent and raises ValueError on bad input.
+    """
+    near = query_params.get('near')
+    if not near:
+        return None
+    parts = near.split(',')
+    if len(parts) != 2:
+        raise ValueError("'near' must be in the form lat,lon")
+    lat, lon = parse_coordinates(parts[0], parts[1])
+    radius_km = float(query_params.get('radius_km', default_radius_km))
+    k = int(query_params.get('k', default_k))
+    if not math.isfinite(radius_km) or radius_km <= 0 or k < 1:
+        raise ValueError("'radius_km' and 'k' must be positive")
+    return lat, lon, min(radius_km, max_radius_km), min(k, max_k)
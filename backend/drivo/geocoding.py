@@ -0,0 +1,519 @@
+# geocoding.py
+"""
+Geocoder answer cache shared by all worker processes, plus the upstream
+calls behind it.
+
+Answers live in the GeocodeCacheEntry table, so they survive restarts
+and deploys and one worker's lookup serves every other worker. A small
+in-process LRU sits in front of it so hot queries cost no database round
+trip. Hits served from memory are counted locally and written back to
+hit_count / last_accessed_at in one pass every GEOCODE_CACHE_TOUCH_SECONDS.
+
+The table is bounded: every few writes, expired rows are removed and the
+least recently used rows beyond GEOCODE_CACHE_MAX_ENTRIES are deleted.
+
+Concurrent misses for the same query are coalesced by SingleFlight, so a
+burst of searches for one destination makes a single Nominatim request.
+"""
+import hashlib
+import logging
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import F
+from django.utils import timezone
+
+from .geo import KM_PER_DEGREE_LAT, km_per_degree_lon
+
+logger = logging.getLogger(__name__)
+
+KEY_MAX_LENGTH = 255
+NOMINATIM_URL = getattr(settings, 'NOMINATIM_URL', 'https://nominatim.openstreetmap.org').rstrip('/')
+NOMINATIM_SEARCH_URL = f'{NOMINATIM_URL}/search'
+NOMINATIM_REVERSE_URL = f'{NOMINATIM_URL}/reverse'
+NOMINATIM_HEADERS = {
+    'User-Agent': 'Drivo/1.0 (gdooduii@gmail.com)'
+}
+
+
+def nominatim_search(query, limit=1):
+    """Forward-geocode with Nominatim; raises requests.RequestException on failure"""
+    params = {
+        'q': query,
+        'format': 'json',
+        'limit': limit,
+        'addressdetails': 1,
+        'extratags': 1,
+        'namedetails': 1
+    }
+    response = requests.get(NOMINATIM_SEARCH_URL, params=params, headers=NOMINATIM_HEADERS, timeout=5)
+    response.raise_for_status()
+    return response.json()
+
+
+def nominatim_reverse(lat, lon):
+    """Reverse-geocode with Nominatim; None when there is no address there"""
+    params = {
+        'lat': f'{lat:.6f}',
+        'lon': f'{lon:.6f}',
+        'format': 'json',
+        'zoom': 18,
+        'addressdetails': 1
+    }
+    response = requests.get(NOMINATIM_REVERSE_URL, params=params, headers=NOMINATIM_HEADERS, timeout=5)
+    response.raise_for_status()
+    data = response.json()
+    return None if not data or 'error' in data else data
+
+
+def sanitize_cache_key(query):
+    return re.sub(r'[^A-Za-z0-9]', '_', query.strip().lower())
+
+
+def cache_key_for(prefix, sanitized):
+    """Table key for a sanitized query; long queries keep a prefix plus a digest"""
+    key = f'{prefix}_{sanitized}'
+    if len(key) > KEY_MAX_LENGTH:
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        key = f'{key[:KEY_MAX_LENGTH - len(digest) - 1]}_{digest}'
+    return key
+
+
+class GeocodeCache:
+    def __init__(self, memory_size=1024, max_entries=50000, touch_seconds=30, evict_every=100):
+        self.memory_size = memory_size
+        self.max_entries = max_entries
+        self.touch_seconds = touch_seconds
+        self.evict_every = evict_every
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (payload, expires_at)
+        self._touches = {}  # key -> (hits, last access) not yet written to the table
+        self._last_touch_flush = time.monotonic()
+        self._writes_since_evict = 0
+        self.stats = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'writes': 0, 'evicted': 0}
+
+    def _remember(self, key, payload, expires_at):
+        with self._lock:
+            self._memory[key] = (payload, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def get(self, key, record=True):
+        """Cached payload for key, or None. record=False leaves hit counts and stats alone."""
+        from .models import GeocodeCacheEntry
+
+        now = timezone.now()
+        flush = False
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[1] is not None and entry[1] <= now:
+                    del self._memory[key]
+                    entry = None
+                elif record:
+                    self._memory.move_to_end(key)
+                    hits = self._touches.get(key, (0, None))[0]
+                    self._touches[key] = (hits + 1, now)
+                    self.stats['memory_hits'] += 1
+                    flush = time.monotonic() - self._last_touch_flush >= self.touch_seconds
+        if entry is not None:
+            if flush:
+                self.flush_touches()
+            return entry[0]
+
+        try:
+            row = GeocodeCacheEntry.objects.filter(key=key).values_list('payload', 'expires_at').first()
+            if row is not None and (row[1] is None or row[1] > now):
+                if record:
+                    GeocodeCacheEntry.objects.filter(key=key).update(
+                        hit_count=F('hit_count') + 1, last_accessed_at=now
+                    )
+            else:
+                row = None
+        except DatabaseError as e:
+            logger.warning("Geocode cache read failed: %s", e)
+            row = None
+
+        if row is None:
+            if record:
+                with self._lock:
+                    self.stats['misses'] += 1
+            return None
+        if record:
+            with self._lock:
+                self.stats['db_hits'] += 1
+        self._remember(key, *row)
+        return row[0]
+
+    def set(self, key, payload, timeout=None):
+        """Store payload for timeout seconds (None: until evicted)"""
+        from .models import GeocodeCacheEntry
+
+        now = timezone.now()
+        expires_at = now + timedelta(seconds=timeout) if timeout else None
+        self._remember(key, payload, expires_at)
+        try:
+            GeocodeCacheEntry.objects.update_or_create(
+                key=key, defaults={'payload': payload, 'expires_at': expires_at, 'last_accessed_at': now}
+            )
+        except DatabaseError as e:
+            logger.warning("Geocode cache write failed: %s", e)
+            return
+        with self._lock:
+            self.stats['writes'] += 1
+            self._writes_since_evict += 1
+            evict = self._writes_since_evict >= self.evict_every
+            if evict:
+                self._writes_since_evict = 0
+        if evict:
+            self.evict()
+
+    def flush_touches(self):
+        """Write hits served from memory back to the table"""
+        from .models import GeocodeCacheEntry
+
+        with self._lock:
+            touches, self._touches = self._touches, {}
+            self._last_touch_flush = time.monotonic()
+        try:
+            for key, (hits, last_access) in touches.items():
+                GeocodeCacheEntry.objects.filter(key=key).update(
+                    hit_count=F('hit_count') + hits, last_accessed_at=last_access
+                )
+        except DatabaseError as e:
+            logger.warning("Geocode cache hit count update failed: %s", e)
+
+    def evict(self):
+        """Drop expired rows, then least recently used rows above max_entries"""
+        from .models import GeocodeCacheEntry
+
+        try:
+            removed, _ = GeocodeCacheEntry.objects.filter(expires_at__lte=timezone.now()).delete()
+            overflow = GeocodeCacheEntry.objects.count() - self.max_entries
+            if overflow > 0:
+                stale_ids = list(
+                    GeocodeCacheEntry.objects.order_by('last_accessed_at').values_list('id', flat=True)[:overflow]
+                )
+                for start in range(0, len(stale_ids), 1000):
+                    removed += GeocodeCacheEntry.objects.filter(pk__in=stale_ids[start:start + 1000]).delete()[0]
+        except DatabaseError as e:
+            logger.warning("Geocode cache eviction failed: %s", e)
+            return 0
+        with self._lock:
+            self.stats['evicted'] += removed
+        return removed
+
+    def clear_memory(self):
+        with self._lock:
+            self._memory.clear()
+
+    def summary(self):
+        from .models import GeocodeCacheEntry
+
+        with self._lock:
+            stats = dict(self.stats)
+            stats['memory_entries'] = len(self._memory)
+        lookups = stats['memory_hits'] + stats['db_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['db_hits']) / lookups, 4) if lookups else None
+        try:
+            stats['entries'] = GeocodeCacheEntry.objects.count()
+        except DatabaseError:
+            stats['entries'] = None
+        stats['max_entries'] = self.max_entries
+        return stats
+
+
+geocode_cache = GeocodeCache(
+    memory_size=getattr(settings, 'GEOCODE_MEMORY_CACHE_SIZE', 1024),
+    max_entries=getattr(settings, 'GEOCODE_CACHE_MAX_ENTRIES', 50000),
+    touch_seconds=getattr(settings, 'GEOCODE_CACHE_TOUCH_SECONDS', 30),
+)
+
+
+
+# ---------- coalescing ----------
+class _Flight:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key: the first caller runs the
+    function and later callers wait for it and share its result (or its
+    exception).
+
+    With shared=True the leader also takes a lock key in the default Django
+    cache (only useful when that cache is shared, e.g. Redis), so leaders in
+    other processes hold back and poll `peek` until the answer shows up in
+    the shared geocode table. Nobody waits longer than wait_seconds; after
+    that the caller runs the function itself.
+    """
+
+    def __init__(self, shared=False, wait_seconds=6.0, poll_seconds=0.05):
+        self.shared = shared
+        self.wait_seconds = wait_seconds
+        self.poll_seconds = poll_seconds
+        self._lock = threading.Lock()
+        self._flights = {}  # key -> _Flight
+        self.stats = {'leaders': 0, 'coalesced': 0, 'remote_waits': 0, 'timeouts': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def do(self, key, func, peek=None):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.stats['leaders'] += 1
+            else:
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            if not flight.done.wait(self.wait_seconds):
+                self._count('timeouts')
+                return func()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self._run(key, func, peek)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def _run(self, key, func, peek):
+        if not self.shared:
+            return func()
+
+        from django.core.cache import cache
+
+        lock_key = f'singleflight_{key}'
+        deadline = time.monotonic() + self.wait_seconds
+        waited = False
+        while True:
+            if cache.add(lock_key, 1, timeout=math.ceil(self.wait_seconds)):
+                try:
+                    return func()
+                finally:
+                    cache.delete(lock_key)
+            if not waited:
+                waited = True
+                self._count('remote_waits')
+            if time.monotonic() >= deadline:
+                self._count('timeouts')
+                return func()
+            time.sleep(self.poll_seconds)
+            if peek is not None:
+                result = peek()
+                if result is not None:
+                    return result
+
+    def summary(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['in_flight'] = len(self._flights)
+        stats['shared'] = self.shared
+        return stats
+
+
+geocode_flight = SingleFlight(
+    shared=getattr(settings, 'GEOCODE_SINGLE_FLIGHT_SHARED', False),
+    wait_seconds=getattr(settings, 'GEOCODE_SINGLE_FLIGHT_WAIT_SECONDS', 6.0),
+)
+
+
+# ---------- forward geocoding ----------
+# Last-resort answers when Nominatim has nothing or is unreachable
+DEFAULT_CITY_COORDINATES = {
+    'lahore': {'lat': '31.5204', 'lon': '74.3587', 'display_name': 'Lahore, Pakistan'},
+    'karachi': {'lat': '24.8607', 'lon': '67.0011', 'display_name': 'Karachi, Pakistan'},
+    'islamabad': {'lat': '33.6844', 'lon': '73.0479', 'display_name': 'Islamabad, Pakistan'},
+    'rawalpindi': {'lat': '33.6007', 'lon': '73.0679', 'display_name': 'Rawalpindi, Pakistan'},
+    'peshawar': {'lat': '34.0151', 'lon': '71.5249', 'display_name': 'Peshawar, Pakistan'},
+    'quetta': {'lat': '30.1798', 'lon': '66.9750', 'display_name': 'Quetta, Pakistan'},
+    'multan': {'lat': '30.1575', 'lon': '71.5249', 'display_name': 'Multan, Pakistan'},
+    'faisalabad': {'lat': '31.4187', 'lon': '73.0791', 'display_name': 'Faisalabad, Pakistan'},
+}
+
+
+def default_city(query):
+    query_lower = query.lower()
+    for city, coords in DEFAULT_CITY_COORDINATES.items():
+        if city in query_lower:
+            return [coords]
+    return None
+
+
+def geocode_outcome(query, cache_key, data=None, error=None):
+    """
+    Turn an upstream answer (data) or failure (error) into the
+    (payload, http_status) GeocodeView responds with, and cache it.
+    """
+    if error is None and data:
+        geocode_cache.set(cache_key, data, timeout=86400)
+        return data, 200
+
+    default_data = default_city(query)
+    if default_data is not None:
+        geocode_cache.set(cache_key, default_data, timeout=86400)
+        return default_data, 200
+
+    if error is not None:
+        geocode_cache.set(cache_key, {'error': str(error)}, timeout=300)
+        return {"error": "External API request failed", "details": str(error)}, 503
+    geocode_cache.set(cache_key, [], timeout=3600)
+    return {"error": "Location not found"}, 404
+
+
+def geocode_upstream(query, cache_key):
+    """Ask Nominatim for a normalized query; returns (payload, http_status)"""
+    try:
+        data = nominatim_search(query, limit=1)
+    except requests.RequestException as e:
+        logger.warning("Geocoding %r failed: %s", query, e)
+        return geocode_outcome(query, cache_key, error=e)
+    return geocode_outcome(query, cache_key, data=data)
+
+
+def geocode_coalesced(query, cache_key):
+    """
+    geocode_upstream, with concurrent misses for the same key sharing one
+    upstream call. Returns (payload, http_status).
+    """
+    def peek():
+        cached = geocode_cache.get(cache_key, record=False)
+        return None if cached is None else (cached, 200)
+
+    def fetch():
+        # A flight that just finished may already have cached the answer
+        return peek() or geocode_upstream(query, cache_key)
+
+    return geocode_flight.do(cache_key, fetch, peek=peek)
+
+# ---------- reverse geocoding ----------
+def quantize(lat, lon, grid_m):
+    """
+    Snap a point to a grid of roughly grid_m metre cells. Returns the cell
+    (row, col) and its centre; the column width follows the row's latitude
+    so cells stay close to square.
+    """
+    lat_step = grid_m / 1000 / KM_PER_DEGREE_LAT
+    row = math.floor(lat / lat_step)
+    center_lat = (row + 0.5) * lat_step
+    lon_step = grid_m / 1000 / km_per_degree_lon(center_lat)
+    col = math.floor(lon / lon_step)
+    return (row, col), (center_lat, (col + 0.5) * lon_step)
+
+
+class ReverseGeocoder:
+    """
+    Address for a point, cached per grid cell in the shared geocode cache so
+    taps a few metres apart reuse one answer. A gazetteer landmark or area
+    centre within local_radius_m answers without a network call; otherwise
+    Nominatim is asked, with the nearest gazetteer place as the fallback
+    while it is unreachable.
+    """
+
+    def __init__(self, grid_m=20, local_radius_m=150, fallback_km=5.0):
+        self.grid_m = grid_m
+        self.local_radius_m = local_radius_m
+        self.fallback_km = fallback_km
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'cache_hits': 0, 'gazetteer': 0, 'upstream': 0,
+                      'upstream_errors': 0, 'not_found': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def cache_key(self, cell):
+        row, col = cell
+        return f'reverse_{self.grid_m}_{row}_{col}'
+
+    def lookup(self, lat, lon):
+        """Address dict for the point, or None when nothing is known there"""
+        from .gazetteer import gazetteer
+
+        self._count('requests')
+        cell, (center_lat, center_lon) = quantize(lat, lon, self.grid_m)
+        key = self.cache_key(cell)
+        cached = geocode_cache.get(key)
+        if cached is not None:
+            self._count('cache_hits')
+            return cached or None
+
+        place, distance_km = gazetteer().nearest(center_lat, center_lon)
+        if place is not None and distance_km * 1000 <= self.local_radius_m:
+            self._count('gazetteer')
+            result = self._place_result(place, distance_km)
+            geocode_cache.set(key, result, timeout=86400)
+            return result
+
+        try:
+            data = nominatim_reverse(center_lat, center_lon)
+        except requests.RequestException as e:
+            logger.warning("Reverse geocoding failed: %s", e)
+            self._count('upstream_errors')
+            if place is None or distance_km > self.fallback_km:
+                return None
+            # Don't pin the approximate answer for long; retry upstream soon
+            result = self._place_result(place, distance_km)
+            geocode_cache.set(key, result, timeout=300)
+            return result
+
+        if data is None:
+            self._count('not_found')
+            geocode_cache.set(key, {}, timeout=3600)
+            return None
+        self._count('upstream')
+        result = {
+            'lat': data.get('lat'),
+            'lon': data.get('lon'),
+            'display_name': data.get('display_name'),
+            'address': data.get('address', {}),
+            'source': 'upstream',
+        }
+        geocode_cache.set(key, result, timeout=86400)
+        return result
+
+    @staticmethod
+    def _place_result(place, distance_km):
+        result = place.as_result()
+        result['distance_m'] = round(distance_km * 1000)
+        return result
+
+    def summary(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats['hit_rate'] = round(stats['cache_hits'] / stats['requests'], 4) if stats['requests'] else None
+        stats['grid_m'] = self.grid_m
+        return stats
+
+
+reverse_geocoder = ReverseGeocoder(
+    grid_m=getattr(settings, 'REVERSE_GEOCODE_GRID_M', 20),
+    local_radius_m=getattr(settings, 'REVERSE_GEOCODE_LOCAL_RADIUS_M', 150),
+    fallback_km=getattr(settings, 'REVERSE_GEOCODE_FALLBACK_KM', 5.0),
+)
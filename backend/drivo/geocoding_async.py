@@ -0,0 +1,183 @@
+# geocoding_async.py
+"""
+Async forward geocoding for the ASGI app (geocode/async/).
+
+One httpx.AsyncClient per event loop keeps a small pool of keep-alive
+connections to the upstream, so misses stop paying a TCP+TLS handshake
+each. A semaphore sized to the upstream's rate limit
+(GEOCODE_ASYNC_CONCURRENCY) caps requests in flight. A request that
+cannot get a slot within GEOCODE_ASYNC_QUEUE_SECONDS does not queue behind
+the others: it is answered from the gazetteer or default cities instead.
+
+Concurrent misses for the same key await one upstream call. Cache reads
+and writes go through the shared geocode cache via sync_to_async.
+
+Client, semaphore and in-flight table are kept per event loop (asyncio
+and httpx objects can't cross loops), so the concurrency cap applies per
+loop: per process under ASGI. Under WSGI each request runs on its own
+short-lived event loop, whose client the view closes with release() at
+the end of the request; serve with an ASGI server to get reuse.
+"""
+import asyncio
+import logging
+import threading
+import weakref
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .geocoding import NOMINATIM_HEADERS, NOMINATIM_URL, default_city, geocode_cache, geocode_outcome
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamBusy(Exception):
+    """No upstream slot became free in time"""
+
+
+class _LoopState:
+    """What one event loop uses to reach the upstream"""
+
+    def __init__(self, base_url, concurrency, timeout_seconds):
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            headers=NOMINATIM_HEADERS,
+            timeout=timeout_seconds,
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+        )
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.in_flight = {}  # cache key -> asyncio.Future
+
+
+class AsyncGeocoder:
+    def __init__(self, base_url, concurrency=4, queue_seconds=0.5, timeout_seconds=5.0):
+        self.base_url = base_url.rstrip('/')
+        self.concurrency = concurrency
+        self.queue_seconds = queue_seconds
+        self.timeout_seconds = timeout_seconds
+        self._lock = threading.Lock()
+        self._states = weakref.WeakKeyDictionary()  # event loop -> _LoopState
+        self.stats = {'upstream': 0, 'coalesced': 0, 'shed': 0, 'errors': 0}
+
+    def _state(self):
+        """The running loop's state; loops in other threads get their own"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            state = self._states.get(loop)
+            if state is None:
+                state = self._states[loop] = _LoopState(self.base_url, self.concurrency, self.timeout_seconds)
+        return state
+
+    async def release(self):
+        """Close the running loop's client, for a loop that ends with the request (WSGI)"""
+        with self._lock:
+            state = self._states.pop(asyncio.get_running_loop(), None)
+        if state is not None:
+            await state.client.aclose()
+
+    async def search(self, query, limit=1):
+        """
+        One upstream search. Raises UpstreamBusy when no slot frees up within
+        queue_seconds and httpx.HTTPError when the request fails.
+        """
+        state = self._state()
+        client, semaphore = state.client, state.semaphore
+        try:
+            await asyncio.wait_for(semaphore.acquire(), self.queue_seconds)
+        except asyncio.TimeoutError:
+            self.stats['shed'] += 1
+            raise UpstreamBusy()
+        try:
+            self.stats['upstream'] += 1
+            response = await client.get('/search', params={
+                'q': query,
+                'format': 'json',
+                'limit': limit,
+                'addressdetails': 1,
+                'extratags': 1,
+                'namedetails': 1
+            })
+            response.raise_for_status()
+            return response.json()
+        finally:
+            semaphore.release()
+
+    async def geocode(self, query, cache_key):
+        """
+        Same answers as GeocodeView: returns (payload, http_status). Cached
+        answers come first; concurrent misses share one search.
+        """
+        from .gazetteer import gazetteer
+
+        cached = await sync_to_async(geocode_cache.get)(cache_key)
+        if cached is not None:
+            return cached, 200
+        place = gazetteer().lookup(query)
+        if place is not None:
+            return [place.as_result()], 200
+
+        in_flight = self._state().in_flight
+        flight = in_flight.get(cache_key)
+        if flight is not None:
+            self.stats['coalesced'] += 1
+            return await asyncio.shield(flight)
+
+        flight = asyncio.get_running_loop().create_future()
+        in_flight[cache_key] = flight
+        try:
+            result = await self._resolve(query, cache_key)
+            flight.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except Exception as e:
+            flight.set_exception(e)
+            # Nobody may be waiting; don't warn about an unretrieved exception
+            flight.exception()
+            raise
+        finally:
+            in_flight.pop(cache_key, None)
+
+    async def _resolve(self, query, cache_key):
+        try:
+            data = await self.search(query, limit=1)
+        except UpstreamBusy:
+            return self.fallback(query)
+        except (httpx.HTTPError, ValueError) as e:
+            self.stats['errors'] += 1
+            logger.warning("Async geocoding %r failed: %s", query, e)
+            return await sync_to_async(geocode_outcome)(query, cache_key, error=e)
+        return await sync_to_async(geocode_outcome)(query, cache_key, data=data)
+
+    @staticmethod
+    def fallback(query):
+        """Answer without the upstream, and without caching it"""
+        from .gazetteer import gazetteer
+
+        # Exact and prefix matches only; a fuzzy guess is not an address
+        matches = gazetteer().search(query, limit=1)
+        if matches and matches[0][1] != 'fuzzy':
+            place, match, score = matches[0]
+            return [place.as_result(match, score)], 200
+        default_data = default_city(query)
+        if default_data is not None:
+            return default_data, 200
+        return {"error": "Geocoding is busy, try again shortly"}, 503
+
+    def summary(self):
+        stats = dict(self.stats)
+        stats['concurrency'] = self.concurrency
+        with self._lock:
+            states = list(self._states.values())
+        stats['loops'] = len(states)
+        stats['in_flight'] = sum(len(state.in_flight) for state in states)
+        return stats
+
+
+async_geocoder = AsyncGeocoder(
+    base_url=NOMINATIM_URL,
+    concurrency=getattr(settings, 'GEOCODE_ASYNC_CONCURRENCY', 4),
+    queue_seconds=getattr(settings, 'GEOCODE_ASYNC_QUEUE_SECONDS', 0.5),
+)
@@ -0,0 +1,130 @@
+# geocoding_batch.py
+"""
+Batch forward geocoding for bulk jobs (geocode/batch/ and the
+geocode_batch command).
+
+Queries are normalized and deduplicated first. Cached and gazetteer
+answers are yielded straight away; the remaining queries go to Nominatim
+from a small thread pool. Every upstream call first takes a token from
+upstream_bucket, which is shared by all batches in the process, so bulk
+jobs stay within the upstream's rate limit however many run at once.
+
+Results are yielded as they finish, not in input order. Each one lists
+the input positions it answers.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.db import connection
+
+from .geocoding import cache_key_for, geocode_cache, geocode_coalesced, sanitize_cache_key
+
+
+class TokenBucket:
+    """
+    rate tokens per second, up to burst banked. acquire() reserves the next
+    token and sleeps until it is due, so waiters are served in arrival order.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.stats = {'acquired': 0, 'waited_seconds': 0.0}
+
+    def acquire(self):
+        """Take one token, blocking until it is available. Returns the seconds waited."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self.stats['acquired'] += 1
+            self.stats['waited_seconds'] += wait
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def summary(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats['waited_seconds'] = round(stats['waited_seconds'], 3)
+        stats['rate'] = self.rate
+        stats['burst'] = self.burst
+        return stats
+
+
+upstream_bucket = TokenBucket(
+    rate=getattr(settings, 'GEOCODE_BATCH_RATE', 1.0),
+    burst=getattr(settings, 'GEOCODE_BATCH_BURST', 1),
+)
+
+
+def _cached_status(payload):
+    if isinstance(payload, dict) and 'error' in payload:
+        return 503
+    return 200 if payload else 404
+
+
+def _result(query, positions, status, source, payload):
+    return {'query': query, 'positions': positions, 'status': status, 'source': source, 'result': payload}
+
+
+def geocode_batch(queries, workers=None, bucket=None):
+    """
+    Geocode many queries. Yields one dict per distinct query with the
+    normalized query, the input positions it answers, the http status
+    GeocodeView would give, the source ('cache', 'gazetteer', 'upstream',
+    or 'input' for blank queries) and the payload.
+    """
+    from .gazetteer import gazetteer
+
+    workers = workers or getattr(settings, 'GEOCODE_BATCH_WORKERS', 4)
+    bucket = bucket or upstream_bucket
+
+    distinct = {}  # cache key -> (normalized query, [positions])
+    for position, query in enumerate(queries):
+        normalized = ' '.join(str(query).split())
+        if not normalized:
+            yield _result(query, [position], 400, 'input', {"error": "Empty query"})
+            continue
+        key = cache_key_for('geocode', sanitize_cache_key(normalized))
+        distinct.setdefault(key, (normalized, []))[1].append(position)
+
+    misses = []
+    for key, (query, positions) in distinct.items():
+        cached = geocode_cache.get(key)
+        if cached is not None:
+            yield _result(query, positions, _cached_status(cached), 'cache', cached)
+            continue
+        place = gazetteer().lookup(query)
+        if place is not None:
+            yield _result(query, positions, 200, 'gazetteer', [place.as_result()])
+            continue
+        misses.append((key, query, positions))
+    if not misses:
+        return
+
+    def fetch(key, query):
+        try:
+            bucket.acquire()
+            return geocode_coalesced(query, key)
+        finally:
+            # Pool threads are not request threads; don't leak their connections
+            connection.close()
+
+    pool = ThreadPoolExecutor(max_workers=min(workers, len(misses)))
+    try:
+        futures = {pool.submit(fetch, key, query): (query, positions) for key, query, positions in misses}
+        for future in as_completed(futures):
+            query, positions = futures[future]
+            payload, status_code = future.result()
+            yield _result(query, positions, status_code, 'upstream', payload)
+    finally:
+        # A client that hung up should not keep spending upstream tokens
+        pool.shutdown(wait=False, cancel_futures=True)
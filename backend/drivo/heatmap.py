@@ -0,0 +1,236 @@
+# heatmap.py
+"""
+Per-cell demand and supply counters for ops and surge pricing.
+
+A fixed lat/lon grid over HEATMAP_BOUNDS holds two numpy count arrays:
+pending ride requests and available drivers. Both cover a rolling window
+of HEATMAP_WINDOW_MINUTES. A request counts in the cell of its pickup
+from the time it became pending. A driver counts in the cell of their
+last position while they are available and have pinged within the
+window. Reading a cell is an array lookup. Reading a bbox is an array
+slice.
+
+Like the nearby-driver index, each process keeps its own copy. It is
+loaded from the database on first use and fed by the request-creation
+and location-update paths. Every few seconds it picks up what other
+processes wrote. Each request and driver is tracked by id, so an event
+seen both locally and in a resync is counted once.
+"""
+import math
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+REQUESTS = 0
+DRIVERS = 1
+
+
+class DemandSupplyHeatmap:
+    def __init__(self, bounds=(23.5, 60.5, 37.5, 78.0), cell_size_deg=0.05,
+                 window_seconds=1800, bucket_seconds=60, sync_seconds=5):
+        self.min_lat, self.min_lon, self.max_lat, self.max_lon = bounds
+        self.cell_size_deg = cell_size_deg
+        self.rows = int(math.ceil((self.max_lat - self.min_lat) / cell_size_deg))
+        self.cols = int(math.ceil((self.max_lon - self.min_lon) / cell_size_deg))
+        self.window_seconds = window_seconds
+        self.bucket_seconds = bucket_seconds
+        self.sync_seconds = sync_seconds
+        self._lock = threading.RLock()
+        self._reset()
+        self._loaded = False
+        self._last_sync = None
+        self._last_sync_monotonic = 0.0
+
+    def _reset(self):
+        self.counts = np.zeros((2, self.rows, self.cols), dtype=np.int32)  # [REQUESTS|DRIVERS, row, col]
+        self._tracked = ({}, {})  # per kind: id -> (flat cell, time bucket)
+        self._buckets = {}  # time bucket -> (request ids, driver ids) stamped in it
+
+    # ---------- writes ----------
+    def _cell_for(self, lat, lon):
+        """Flat index into a count array, or None outside the grid"""
+        if lat is None or lon is None:
+            return None
+        row = int(math.floor((float(lat) - self.min_lat) / self.cell_size_deg))
+        col = int(math.floor((float(lon) - self.min_lon) / self.cell_size_deg))
+        if not (0 <= row < self.rows and 0 <= col < self.cols):
+            return None
+        return row * self.cols + col
+
+    def _bucket_for(self, at):
+        return int(at.timestamp() // self.bucket_seconds)
+
+    def _horizon(self, now):
+        """Newest time bucket that has left the window"""
+        return self._bucket_for(now - timedelta(seconds=self.window_seconds))
+
+    def _untrack(self, kind, key):
+        entry = self._tracked[kind].pop(key, None)
+        if entry is not None:
+            self.counts[kind].flat[entry[0]] -= 1
+
+    def _track(self, kind, key, lat, lon, at):
+        cell = self._cell_for(lat, lon)
+        bucket = self._bucket_for(at or timezone.now())
+        with self._lock:
+            self._untrack(kind, key)
+            if cell is None or bucket <= self._horizon(timezone.now()):
+                return
+            self._tracked[kind][key] = (cell, bucket)
+            self.counts[kind].flat[cell] += 1
+            self._buckets.setdefault(bucket, (set(), set()))[kind].add(key)
+
+    def record_request(self, ride_request_id, lat, lon, at=None):
+        """Count a request that became pending at `at` (default now)"""
+        self._track(REQUESTS, ride_request_id, lat, lon, at)
+
+    def drop_request(self, ride_request_id):
+        with self._lock:
+            self._untrack(REQUESTS, ride_request_id)
+
+    def record_driver(self, driver_id, status, lat, lon, at=None):
+        """Count an available driver at their latest position; anything else drops them"""
+        if status != 'available':
+            with self._lock:
+                self._untrack(DRIVERS, driver_id)
+            return
+        self._track(DRIVERS, driver_id, lat, lon, at)
+
+    def _expire(self, now):
+        """Drop everything last stamped in a time bucket that has left the window"""
+        horizon = self._horizon(now)
+        with self._lock:
+            for bucket in [bucket for bucket in self._buckets if bucket <= horizon]:
+                for kind, keys in enumerate(self._buckets.pop(bucket)):
+                    tracked = self._tracked[kind]
+                    for key in keys:
+                        # Restamped later: its newer bucket owns it now
+                        if key in tracked and tracked[key][1] == bucket:
+                            self._untrack(kind, key)
+
+    # ---------- loading ----------
+    def rebuild(self):
+        """Reload both layers from the database"""
+        from .models import DriverProfile, RideRequest
+
+        started = timezone.now()
+        since = started - timedelta(seconds=self.window_seconds)
+        requests = RideRequest.objects.filter(
+            status='pending', updated_at__gte=since
+        ).values_list('id', 'pickup_latitude', 'pickup_longitude', 'updated_at').iterator(chunk_size=2000)
+        drivers = DriverProfile.objects.filter(
+            status='available', location__last_location_update__gte=since
+        ).values_list(
+            'id', 'location__latitude', 'location__longitude', 'location__last_location_update'
+        ).iterator(chunk_size=2000)
+        with self._lock:
+            self._reset()
+            for ride_request_id, lat, lon, at in requests:
+                self.record_request(ride_request_id, lat, lon, at)
+            for driver_id, lat, lon, at in drivers:
+                self.record_driver(driver_id, 'available', lat, lon, at)
+            self._loaded = True
+            self._last_sync = started
+            self._last_sync_monotonic = time.monotonic()
+
+    def refresh(self):
+        """Apply changes made since the last sync (possibly by other processes)"""
+        from django.db.models import Q
+        from .location_buffer import SYNC_OVERLAP
+        from .models import DriverProfile, RideRequest
+
+        started = timezone.now()
+        since = self._last_sync - SYNC_OVERLAP
+        # New arrivals come from the pending set (bounded by the request
+        # TTL); departures are checked by primary key for tracked ids only
+        for ride_request_id, lat, lon, at in RideRequest.objects.filter(
+            status='pending', updated_at__gte=since
+        ).values_list('id', 'pickup_latitude', 'pickup_longitude', 'updated_at'):
+            self.record_request(ride_request_id, lat, lon, at)
+        tracked = list(self._tracked[REQUESTS])
+        for start in range(0, len(tracked), 1000):
+            for ride_request_id in RideRequest.objects.filter(
+                id__in=tracked[start:start + 1000]
+            ).exclude(status='pending').values_list('id', flat=True):
+                self.drop_request(ride_request_id)
+        for driver_id, status, lat, lon, at in DriverProfile.objects.filter(
+            Q(updated_at__gte=since) | Q(location__updated_at__gte=since)
+        ).values_list(
+            'id', 'status', 'location__latitude', 'location__longitude', 'location__last_location_update'
+        ):
+            self.record_driver(driver_id, status, lat, lon, at)
+        self._expire(started)
+        with self._lock:
+            self._last_sync = started
+            self._last_sync_monotonic = time.monotonic()
+
+    def ensure_fresh(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.rebuild()
+            return
+        if self.sync_seconds and time.monotonic() - self._last_sync_monotonic >= self.sync_seconds:
+            self.refresh()
+
+    # ---------- queries ----------
+    def counts_at(self, lat, lon):
+        """(pending requests, available drivers) in the cell containing lat, lon"""
+        self.ensure_fresh()
+        cell = self._cell_for(lat, lon)
+        if cell is None:
+            return 0, 0
+        return int(self.counts[REQUESTS].flat[cell]), int(self.counts[DRIVERS].flat[cell])
+
+    def area(self, min_lat, min_lon, max_lat, max_lon):
+        """The non-empty cells overlapping a bbox, with the bbox totals"""
+        self.ensure_fresh()
+        row0 = max(0, int(math.floor((min_lat - self.min_lat) / self.cell_size_deg)))
+        col0 = max(0, int(math.floor((min_lon - self.min_lon) / self.cell_size_deg)))
+        row1 = min(self.rows, int(math.floor((max_lat - self.min_lat) / self.cell_size_deg)) + 1)
+        col1 = min(self.cols, int(math.floor((max_lon - self.min_lon) / self.cell_size_deg)) + 1)
+        with self._lock:
+            window = self.counts[:, row0:max(row0, row1), col0:max(col0, col1)].copy()
+        rows, cols = np.nonzero(window.any(axis=0))
+        cells = [
+            {
+                'lat': round(self.min_lat + (row0 + row + 0.5) * self.cell_size_deg, 6),
+                'lon': round(self.min_lon + (col0 + col + 0.5) * self.cell_size_deg, 6),
+                'requests': int(requests),
+                'drivers': int(drivers),
+            }
+            for row, col, requests, drivers in zip(
+                rows.tolist(), cols.tolist(),
+                window[REQUESTS, rows, cols].tolist(), window[DRIVERS, rows, cols].tolist(),
+            )
+        ]
+        return {
+            'cell_size_deg': self.cell_size_deg,
+            'window_minutes': self.window_seconds / 60,
+            'requests': int(window[REQUESTS].sum()),
+            'drivers': int(window[DRIVERS].sum()),
+            'cells': cells,
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                'loaded': self._loaded,
+                'grid': [self.rows, self.cols],
+                'requests': len(self._tracked[REQUESTS]),
+                'drivers': len(self._tracked[DRIVERS]),
+                'last_sync': self._last_sync.isoformat() if self._last_sync else None,
+            }
+
+
+heatmap = DemandSupplyHeatmap(
+    bounds=tuple(getattr(settings, 'HEATMAP_BOUNDS', (23.5, 60.5, 37.5, 78.0))),
+    cell_size_deg=getattr(settings, 'HEATMAP_CELL_SIZE_DEG', 0.05),
+    window_seconds=getattr(settings, 'HEATMAP_WINDOW_MINUTES', 30) * 60,
+    bucket_seconds=getattr(settings, 'HEATMAP_BUCKET_SECONDS', 60),
+    sync_seconds=getattr(settings, 'HEATMAP_SYNC_SECONDS', 5),
+)
@@ -0,0 +1,252 @@
+# location_buffer.py
+"""
+Write-behind buffer for driver positions.
+
+Location pings only update an in-process map of the latest position per
+driver. A background thread persists the dirty entries every few seconds
+with a bulk newest-wins upsert into the narrow DriverLocation table, so a
+driver pinging every 2 s costs one small row write per flush interval
+instead of one per request. Reads that need the live position
+(serializers, nearby search, dispatch) go through get()/live_location().
+
+A flushed fix can be older than the flush itself, so other processes
+pick up new rows by DriverLocation.updated_at (the server-side write
+time), not by last_location_update.
+"""
+import atexit
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections
+from django.utils import timezone
+
+from .geo import geohash_for
+
+logger = logging.getLogger(__name__)
+
+LOCATION_FIELDS = ['latitude', 'longitude', 'geohash', 'last_location_update']
+
+# Readers of DriverLocation.updated_at re-read this far behind their
+# watermark: rows are stamped before their transaction commits, and by
+# app servers whose clocks may drift apart slightly
+SYNC_OVERLAP = timedelta(seconds=2)
+
+
+class LocationBuffer:
+    def __init__(self, flush_interval=2.0, write_behind=True):
+        self.flush_interval = flush_interval
+        self.write_behind = write_behind
+        self._lock = threading.Lock()
+        self._latest = {}  # driver_id -> (latitude, longitude, recorded_at)
+        self._dirty = set()
+        self._flusher = None
+        self._stopped = threading.Event()
+        self.stats = {'recorded': 0, 'flushes': 0, 'rows_written': 0}
+
+    def record(self, driver_id, latitude, longitude, recorded_at=None):
+        """
+        Remember the newest position for a driver. Returns False if a newer
+        position is already buffered (out-of-order fix), True otherwise.
+        """
+        recorded_at = recorded_at or timezone.now()
+        with self._lock:
+            current = self._latest.get(driver_id)
+            if current is not None and current[2] > recorded_at:
+                return False
+            self._latest[driver_id] = (latitude, longitude, recorded_at)
+            self._dirty.add(driver_id)
+            self.stats['recorded'] += 1
+
+        if self.write_behind:
+            self._ensure_flusher()
+        else:
+            self.flush([driver_id])
+        return True
+
+    def get(self, driver_id):
+        """Buffered (latitude, longitude, recorded_at) for a driver, or None"""
+        with self._lock:
+            return self._latest.get(driver_id)
+
+    def live_location(self, profile):
+        """
+        The driver's DriverLocation with any newer buffered position applied
+        (in memory only), or None if the driver has never reported one.
+        """
+        from .models import DriverLocation
+
+        try:
+            location = profile.location
+        except DriverLocation.DoesNotExist:
+            location = None
+
+        buffered = self.get(profile.id)
+        if buffered is None:
+            return location
+        latitude, longitude, recorded_at = buffered
+        if location is None:
+            location = DriverLocation(driver_id=profile.id)
+            profile.location = location
+        elif location.last_location_update is not None and recorded_at < location.last_location_update:
+            return location
+        location.latitude = latitude
+        location.longitude = longitude
+        location.geohash = geohash_for(latitude, longitude)
+        location.last_location_update = recorded_at
+        return location
+
+    def last_update(self, driver_id):
+        """Timestamp of the newest known position, buffered or stored"""
+        from .models import DriverLocation
+
+        buffered = self.get(driver_id)
+        if buffered is not None:
+            return buffered[2]
+        return DriverLocation.objects.filter(driver_id=driver_id).values_list(
+            'last_location_update', flat=True
+        ).first()
+
+    def pending(self):
+        with self._lock:
+            return len(self._dirty)
+
+    def flush(self, driver_ids=None):
+        """Persist dirty positions with a bulk newest-wins upsert. Returns the number of rows sent."""
+        from .models import DriverLocation, DriverProfile
+
+        with self._lock:
+            if driver_ids is None:
+                ids = list(self._dirty)
+            else:
+                ids = [driver_id for driver_id in driver_ids if driver_id in self._dirty]
+            if not ids:
+                return 0
+            self._dirty.difference_update(ids)
+            snapshot = {driver_id: self._latest[driver_id] for driver_id in ids}
+
+        locations = [
+            DriverLocation(
+                driver_id=driver_id,
+                latitude=latitude,
+                longitude=longitude,
+                geohash=geohash_for(latitude, longitude),
+                last_location_update=recorded_at
+            )
+            for driver_id, (latitude, longitude, recorded_at) in snapshot.items()
+        ]
+        try:
+            try:
+                self._upsert(locations)
+            except IntegrityError:
+                # A driver was deleted after the ping was buffered; drop the orphans
+                existing = set(DriverProfile.objects.filter(
+                    id__in=snapshot.keys()
+                ).values_list('id', flat=True))
+                locations = [location for location in locations if location.driver_id in existing]
+                self._upsert(locations)
+        except Exception:
+            # Put the entries back so the next tick retries them
+            with self._lock:
+                self._dirty.update(snapshot.keys())
+            raise
+
+        with self._lock:
+            self.stats['flushes'] += 1
+            self.stats['rows_written'] += len(locations)
+        return len(locations)
+
+    @staticmethod
+    def _upsert(locations, batch_size=500):
+        """
+        Newest wins: every process flushes its own buffer, so a row may
+        already hold a fix newer than ours. Rows that don't exist yet are
+        inserted; existing rows are only moved forward, by one conditional
+        UPDATE per batch.
+        """
+        from django.db.models import Case, Q, Value, When
+        from .models import DriverLocation
+
+        if not locations:
+            return
+        # ON CONFLICT DO NOTHING / INSERT IGNORE: existing rows are left to the UPDATE
+        DriverLocation.objects.bulk_create(locations, ignore_conflicts=True, batch_size=batch_size)
+        for start in range(0, len(locations), batch_size):
+            batch = locations[start:start + batch_size]
+            older = Q()
+            for location in batch:
+                older |= Q(driver_id=location.driver_id, last_location_update__lt=location.last_location_update)
+            values = {
+                field: Case(
+                    *[When(driver_id=location.driver_id, then=Value(getattr(location, field))) for location in batch],
+                    output_field=DriverLocation._meta.get_field(field),
+                )
+                for field in LOCATION_FIELDS
+            }
+            DriverLocation.objects.filter(older).update(updated_at=timezone.now(), **values)
+
+    def _ensure_flusher(self):
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._lock:
+            if self._flusher is not None and self._flusher.is_alive():
+                return
+            self._flusher = threading.Thread(
+                target=self._run, name='drivo-location-flusher', daemon=True
+            )
+            self._flusher.start()
+
+    def _run(self):
+        from .ride_trail import trail_buffer
+
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+                trail_buffer.flush()
+            except Exception:
+                logger.exception("Failed to flush buffered driver locations")
+            finally:
+                close_old_connections()
+
+    def shutdown(self):
+        from .ride_trail import trail_buffer
+
+        self._stopped.set()
+        try:
+            self.flush()
+            trail_buffer.flush()
+        except Exception:
+            logger.exception("Failed to flush buffered driver locations on shutdown")
+
+
+location_buffer = LocationBuffer(
+    flush_interval=getattr(settings, 'LOCATION_FLUSH_INTERVAL_SECONDS', 2.0),
+    write_behind=getattr(settings, 'LOCATION_WRITE_BEHIND', True),
+)
+atexit.register(location_buffer.shutdown)
+
+
+def record_driver_location(profile, latitude, longitude, recorded_at=None, trail=True):
+    """
+    Entry point for every driver location write: buffer the position, move
+    the driver in the nearby-driver index and the supply heatmap, push it to riders following the
+    driver and queue the fix for the trail of their in-progress ride (pass
+    trail=False when the caller queues fixes itself).
+    """
+    from .heatmap import heatmap
+    from .realtime import publish_driver_location
+    from .ride_trail import trail_buffer
+    from .spatial_index import driver_index
+
+    recorded_at = recorded_at or timezone.now()
+    accepted = location_buffer.record(profile.id, latitude, longitude, recorded_at)
+    if accepted:
+        driver_index.sync(profile.id, profile.status, profile.full_name, latitude, longitude)
+        heatmap.record_driver(profile.id, profile.status, latitude, longitude, recorded_at)
+        publish_driver_location(profile.id, latitude, longitude, recorded_at)
+    if trail:
+        trail_buffer.add(profile.id, [(latitude, longitude, recorded_at)])
+        if not location_buffer.write_behind:
+            trail_buffer.flush([profile.id])
+    return accepted
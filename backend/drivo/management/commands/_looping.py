@@ -0,0 +1,44 @@
+# management/commands/_looping.py
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+
+class LoopingCommand(BaseCommand):
+    """
+    Base for maintenance commands that run once (cron) or forever with
+    --loop. Subclasses implement tick(options) and may set default_interval.
+    """
+    default_interval = 30
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help="Keep running, one tick every --interval seconds")
+        parser.add_argument('--interval', type=float, default=None,
+                            help=f"Seconds between ticks with --loop (default {self.default_interval})")
+
+    def handle(self, *args, **options):
+        interval = options['interval'] or self.get_default_interval()
+        if not options['loop']:
+            self.tick(options)
+            return
+        try:
+            while True:
+                started = time.monotonic()
+                try:
+                    self.tick(options)
+                except Exception as e:
+                    self.stderr.write(f"Tick failed: {e}")
+                finally:
+                    # Long-running process: don't hold a dead/stale connection
+                    close_old_connections()
+                time.sleep(max(0.0, interval - (time.monotonic() - started)))
+        except KeyboardInterrupt:
+            pass
+
+    def get_default_interval(self):
+        return self.default_interval
+
+    def tick(self, options):
+        raise NotImplementedError
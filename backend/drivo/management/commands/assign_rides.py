@@ -0,0 +1,51 @@
+# management/commands/assign_rides.py
+from django.conf import settings
+from django.utils import timezone
+
+from drivo.assignment import run_assignment
+from ._looping import LoopingCommand
+
+
+class Command(LoopingCommand):
+    help = (
+        "Match all pending ride requests to available drivers zone by zone "
+        "with a minimum-cost assignment over pickup distance and ETA, and "
+        "commit each zone's matches in one transaction. Reports the pickup "
+        "distance saved against first-come greedy matching. Run from cron, "
+        "or with --loop every few seconds at peak."
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--zone', help="Only this pickup geohash prefix")
+        parser.add_argument('--dry-run', action='store_true', help="Solve and report without assigning")
+
+    def get_default_interval(self):
+        return getattr(settings, 'ASSIGNMENT_INTERVAL_SECONDS', 5)
+
+    def tick(self, options):
+        reports = run_assignment(zone=options['zone'], dry_run=options['dry_run'])
+        now = timezone.now()
+        for report in reports:
+            self.stdout.write(
+                f"[{now:%Y-%m-%d %H:%M:%S}] zone={report['zone'] or '-'} requests={report['requests']} "
+                f"drivers={report['drivers']} matched={report['matched']} committed={report['committed']} "
+                f"pickup_km={report['pickup_km']:.2f} greedy_matched={report['greedy_matched']} "
+                f"greedy_pickup_km={report['greedy_pickup_km']:.2f}"
+            )
+
+        matched = sum(report['matched'] for report in reports)
+        greedy_matched = sum(report['greedy_matched'] for report in reports)
+        pickup_km = sum(report['pickup_km'] for report in reports)
+        greedy_km = sum(report['greedy_pickup_km'] for report in reports)
+        if not matched and not greedy_matched:
+            saving = "nothing to assign"
+        elif matched == greedy_matched:
+            saving = f"{greedy_km - pickup_km:.2f} km ({(greedy_km - pickup_km) / greedy_km:.1%}) less pickup distance than greedy"
+        else:
+            saving = f"{matched - greedy_matched} more requests matched than greedy"
+        self.stdout.write(
+            f"[{now:%Y-%m-%d %H:%M:%S}] {len(reports)} zones, {matched} matched, "
+            f"{sum(report['committed'] for report in reports)} committed: {saving}"
+        )
+        return matched
@@ -0,0 +1,52 @@
+# management/commands/backfill_geohash.py
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from drivo.geo import geohash_for
+from drivo.models import ClientProfile, DriverLocation, RideRequest
+
+# (model, geohash column, latitude column, longitude column)
+GEOHASH_COLUMNS = [
+    (DriverLocation, 'geohash', 'latitude', 'longitude'),
+    (ClientProfile, 'geohash', 'latitude', 'longitude'),
+    (RideRequest, 'pickup_geohash', 'pickup_latitude', 'pickup_longitude'),
+]
+
+
+class Command(BaseCommand):
+    help = "Fill the precomputed geohash columns for rows saved before they existed"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--all', action='store_true',
+                            help="Recompute every row, not just rows with an empty geohash")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for model, geohash_field, lat_field, lon_field in GEOHASH_COLUMNS:
+            queryset = model.objects.filter(**{
+                f'{lat_field}__isnull': False,
+                f'{lon_field}__isnull': False,
+            })
+            if not options['all']:
+                queryset = queryset.filter(**{f'{geohash_field}__isnull': True})
+
+            updated = 0
+            last_pk = None
+            while True:
+                # Keyset pagination keeps every batch an indexed range read
+                batch = queryset.order_by('pk')
+                if last_pk is not None:
+                    batch = batch.filter(pk__gt=last_pk)
+                rows = list(batch.only('pk', lat_field, lon_field)[:batch_size])
+                if not rows:
+                    break
+                for row in rows:
+                    setattr(row, geohash_field, geohash_for(getattr(row, lat_field), getattr(row, lon_field)))
+                with transaction.atomic():
+                    model.objects.bulk_update(rows, [geohash_field])
+                updated += len(rows)
+                last_pk = rows[-1].pk
+
+            self.stdout.write(f"{model.__name__}.{geohash_field}: {updated} rows updated")
+        self.stdout.write(self.style.SUCCESS("Geohash backfill complete"))
@@ -0,0 +1,112 @@
+# management/commands/bench_nearby_sql.py
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from drivo.geo import bounding_box, geohash_for, nearest_by_sql
+from drivo.models import User, DriverProfile, DriverLocation
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the SQL bounding-box + haversine nearest-driver query against "
+        "growing synthetic fleets. All rows are created inside a transaction that "
+        "is rolled back at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,50000',
+                            help="Comma-separated fleet sizes to measure")
+        parser.add_argument('--lat', type=float, default=31.5204)
+        parser.add_argument('--lon', type=float, default=74.3587)
+        parser.add_argument('--spread-km', type=float, default=25.0,
+                            help="Half-width of the square the fleet is scattered over")
+        parser.add_argument('--radius-km', type=float, default=3.0)
+        parser.add_argument('--k', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--explain', action='store_true',
+                            help="Print the database query plan for the largest fleet")
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        rng = random.Random(42)
+
+        self.stdout.write(
+            f"{'fleet':>8} {'bbox rows':>10} {'returned':>9} {'avg ms':>8} {'examined %':>11}"
+        )
+        with transaction.atomic():
+            created = 0
+            queryset = None
+            for size in sizes:
+                self._grow_fleet(size - created, created, rng, options)
+                created = size
+                queryset = self._candidates()
+
+                min_lat, max_lat, min_lon, max_lon = bounding_box(
+                    options['lat'], options['lon'], options['radius_km']
+                )
+                examined = queryset.filter(
+                    location__latitude__range=(min_lat, max_lat),
+                    location__longitude__range=(min_lon, max_lon),
+                ).count()
+
+                started = time.perf_counter()
+                for _ in range(options['repeat']):
+                    returned = len(list(self._nearest(queryset, options)))
+                avg_ms = (time.perf_counter() - started) * 1000 / options['repeat']
+
+                self.stdout.write(
+                    f"{size:>8} {examined:>10} {returned:>9} {avg_ms:>8.2f} {examined * 100 / size:>10.2f}%"
+                )
+
+            if options['explain'] and queryset is not None:
+                self.stdout.write(f"\nQuery plan ({connection.vendor}):")
+                self.stdout.write(self._nearest(queryset, options).explain())
+
+            transaction.set_rollback(True)
+
+    def _candidates(self):
+        return DriverProfile.objects.filter(status='available')
+
+    def _nearest(self, queryset, options):
+        return nearest_by_sql(
+            queryset, 'location__latitude', 'location__longitude',
+            options['lat'], options['lon'], options['radius_km'], options['k']
+        )
+
+    def _grow_fleet(self, count, offset, rng, options):
+        if count <= 0:
+            return
+        _, half_lat, _, half_lon = bounding_box(0, 0, options['spread_km'])
+        users = User.objects.bulk_create([
+            User(email=f"bench-driver-{offset + i}@example.invalid", is_driver=True)
+            for i in range(count)
+        ], batch_size=1000)
+        if users[0].pk is None:
+            # Backends without RETURNING (MySQL) don't set primary keys on bulk_create
+            users = list(User.objects.filter(
+                email__startswith='bench-driver-'
+            ).order_by('id')[offset:offset + count])
+        profiles = DriverProfile.objects.bulk_create([
+            DriverProfile(
+                user=user,
+                full_name=f"Bench Driver {offset + i}",
+                status='available' if rng.random() < 0.8 else 'offline',
+            )
+            for i, user in enumerate(users)
+        ], batch_size=1000)
+        if profiles[0].pk is None:
+            profiles = list(DriverProfile.objects.filter(
+                user__email__startswith='bench-driver-'
+            ).order_by('id')[offset:offset + count])
+        locations = []
+        for profile in profiles:
+            latitude = round(options['lat'] + rng.uniform(-half_lat, half_lat), 6)
+            longitude = round(options['lon'] + rng.uniform(-half_lon, half_lon), 6)
+            locations.append(DriverLocation(
+                driver=profile, latitude=latitude, longitude=longitude,
+                geohash=geohash_for(latitude, longitude)
+            ))
+        DriverLocation.objects.bulk_create(locations, batch_size=1000)
@@ -0,0 +1,84 @@
+# management/commands/bench_ranking.py
+import heapq
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from drivo.geo import bounding_box, haversine_km
+from drivo.ranking import Candidates, rank, rank_many
+from drivo.spatial_index import DriverGridIndex
+
+
+class Command(BaseCommand):
+    help = (
+        "Micro-benchmark driver-to-pickup ranking on synthetic fleets: a Python "
+        "loop over Decimal coordinates, the vectorised NumPy ranking (one pickup "
+        "and a batch of pickups) and the grid index ring search. No database access."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000',
+                            help="Comma-separated fleet sizes to measure")
+        parser.add_argument('--lat', type=float, default=31.5204)
+        parser.add_argument('--lon', type=float, default=74.3587)
+        parser.add_argument('--spread-km', type=float, default=25.0)
+        parser.add_argument('--k', type=int, default=10)
+        parser.add_argument('--pickups', type=int, default=50,
+                            help="Pickups ranked together in the batch measurement")
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        _, half_lat, _, half_lon = bounding_box(0, 0, options['spread_km'])
+        k = options['k']
+
+        def point():
+            return (
+                options['lat'] + rng.uniform(-half_lat, half_lat),
+                options['lon'] + rng.uniform(-half_lon, half_lon),
+            )
+
+        pickups = [point() for _ in range(options['pickups'])]
+        lat, lon = pickups[0]
+
+        self.stdout.write(
+            f"{'fleet':>8} {'python ms':>10} {'numpy ms':>9} "
+            f"{'batch ms/pickup':>16} {'grid ring ms':>13} {'speedup':>8}"
+        )
+        for size in sorted(int(value) for value in options['sizes'].split(',')):
+            drivers = [(driver_id,) + point() for driver_id in range(size)]
+            # What a loop over DriverProfile rows sees: Decimal columns
+            decimal_rows = [
+                (driver_id, Decimal(f"{d_lat:.6f}"), Decimal(f"{d_lon:.6f}"))
+                for driver_id, d_lat, d_lon in drivers
+            ]
+            candidates = Candidates.from_rows(drivers)
+            index = DriverGridIndex(sync_seconds=0)
+            index._loaded = True
+            for driver_id, d_lat, d_lon in drivers:
+                index.upsert(driver_id, d_lat, d_lon)
+
+            python_ms, expected = self._time(options['repeat'], lambda: heapq.nsmallest(
+                k, ((haversine_km(lat, lon, d_lat, d_lon), driver_id) for driver_id, d_lat, d_lon in decimal_rows)
+            ))
+            numpy_ms, ranked = self._time(options['repeat'], lambda: rank(candidates, lat, lon, k))
+            batch_ms, _ = self._time(options['repeat'], lambda: rank_many(candidates, pickups, k))
+            grid_ms, _ = self._time(options['repeat'], lambda: index.nearest(lat, lon, k=k, radius_km=options['spread_km'] * 2))
+
+            if [driver_id for _, driver_id in expected] != [driver_id for driver_id, _, _ in ranked]:
+                self.stderr.write(f"Ranking mismatch at fleet size {size}")
+
+            self.stdout.write(
+                f"{size:>8} {python_ms:>10.3f} {numpy_ms:>9.3f} "
+                f"{batch_ms / len(pickups):>16.3f} {grid_ms:>13.3f} {python_ms / numpy_ms:>7.1f}x"
+            )
+
+    @staticmethod
+    def _time(repeat, func):
+        result = func()
+        started = time.perf_counter()
+        for _ in range(repeat):
+            result = func()
+        return (time.perf_counter() - started) * 1000 / repeat, result
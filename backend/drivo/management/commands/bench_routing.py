@@ -0,0 +1,117 @@
+# management/commands/bench_routing.py
+import random
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from drivo.geo import KM_PER_DEGREE_LAT, km_per_degree_lon
+from drivo.ranking import haversine_km
+from drivo.routing import RoadGraph
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark point-to-point routing. Builds a synthetic city street grid "
+        "(arterials every tenth street, some one-way and missing segments) or "
+        "loads a real extract with --graph-dir, then times bidirectional A* "
+        "queries and checks a sample against plain Dijkstra. No database access."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--graph-dir', help="Directory with nodes.csv/edges.csv instead of the synthetic grid")
+        parser.add_argument('--grid', type=int, default=300, help="Synthetic grid is grid x grid intersections")
+        parser.add_argument('--spacing-m', type=float, default=120.0)
+        parser.add_argument('--lat', type=float, default=31.5204)
+        parser.add_argument('--lon', type=float, default=74.3587)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--verify', type=int, default=20, help="Queries also answered with plain Dijkstra")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        if options['graph_dir']:
+            try:
+                graph = RoadGraph.load(options['graph_dir'])
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError(f"Could not load graph: {e}")
+        else:
+            graph = self._synthetic_city(options)
+        self.stdout.write(
+            f"Graph: {graph.node_count} nodes, {graph.edge_count} directed edges, "
+            f"built in {time.perf_counter() - started:.2f}s"
+        )
+
+        rng = random.Random(7)
+        pairs = [(rng.randrange(graph.node_count), rng.randrange(graph.node_count)) for _ in range(options['queries'])]
+
+        settled = 0
+        unreachable = 0
+        started = time.perf_counter()
+        results = []
+        for source, target in pairs:
+            result = graph.shortest_path(source, target)
+            results.append(result)
+            if result is None:
+                unreachable += 1
+            else:
+                settled += result[2]
+        elapsed = time.perf_counter() - started
+        answered = len(pairs) - unreachable
+        self.stdout.write(
+            f"A*:       {len(pairs) / elapsed:8.1f} queries/s, "
+            f"{settled / max(answered, 1):9.0f} nodes settled/query, {unreachable} unreachable"
+        )
+
+        verify = min(options['verify'], len(pairs))
+        if not verify:
+            return
+        mismatches = 0
+        settled = 0
+        started = time.perf_counter()
+        for (source, target), result in zip(pairs[:verify], results):
+            expected = graph.dijkstra(source, target)
+            if expected is not None:
+                settled += expected[2]
+            if (expected is None) != (result is None) or (
+                expected is not None and abs(expected[0] - result[0]) > 1e-6 * max(expected[0], 1.0)
+            ):
+                mismatches += 1
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Dijkstra: {verify / elapsed:8.1f} queries/s, {settled / verify:9.0f} nodes settled/query"
+        )
+        if mismatches:
+            self.stderr.write(f"{mismatches} of {verify} routes differ from Dijkstra")
+        else:
+            self.stdout.write(f"All {verify} checked routes match Dijkstra")
+
+    @staticmethod
+    def _synthetic_city(options):
+        n = options['grid']
+        rng = np.random.default_rng(42)
+        spacing_lat = options['spacing_m'] / 1000 / KM_PER_DEGREE_LAT
+        spacing_lon = options['spacing_m'] / 1000 / km_per_degree_lon(options['lat'])
+
+        rows, cols = np.divmod(np.arange(n * n), n)
+        jitter = rng.uniform(-0.25, 0.25, size=(2, n * n))
+        lat = options['lat'] + (rows - n / 2 + jitter[0]) * spacing_lat
+        lon = options['lon'] + (cols - n / 2 + jitter[1]) * spacing_lon
+
+        node = np.arange(n * n).reshape(n, n)
+        horizontal = (node[:, :-1].ravel(), node[:, 1:].ravel(), np.repeat(np.arange(n), n - 1))
+        vertical = (node[:-1, :].ravel(), node[1:, :].ravel(), np.tile(np.arange(n), n - 1))
+        u = np.concatenate([horizontal[0], vertical[0]])
+        v = np.concatenate([horizontal[1], vertical[1]])
+        street = np.concatenate([horizontal[2], vertical[2]])
+
+        arterial = street % 10 == 0
+        keep = arterial | (rng.random(len(u)) > 0.08)
+        u, v, street, arterial = u[keep], v[keep], street[keep], arterial[keep]
+
+        length_m = haversine_km(lat[u], lon[u], lat[v], lon[v]) * 1000
+        speed_kmh = np.where(arterial, 60.0, 30.0)
+        oneway = ~arterial & (street % 4 == 1)
+        # Alternate one-way directions street by street
+        flip = oneway & (street % 8 == 5)
+        u, v = np.where(flip, v, u), np.where(flip, u, v)
+        return RoadGraph.from_edges(lat, lon, u, v, length_m, speed_kmh, oneway)
@@ -0,0 +1,38 @@
+# management/commands/expire_ride_requests.py
+import logging
+
+from django.conf import settings
+from django.utils import timezone
+
+from drivo.dispatch import expire_ride_requests
+from drivo.models import RideRequest
+from ._looping import LoopingCommand
+
+logger = logging.getLogger(__name__)
+
+
+class Command(LoopingCommand):
+    help = (
+        "Move pending and scheduled ride requests past their expires_at "
+        "(RIDE_REQUEST_TTL_MINUTES) to 'expired' and withdraw their offers, "
+        "a chunk of rows per transaction. Run from cron, or with --loop as a "
+        "long-running sweeper."
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--chunk-size', type=int, default=None,
+                            help="Requests expired per transaction")
+
+    def get_default_interval(self):
+        return getattr(settings, 'RIDE_REQUEST_SWEEP_INTERVAL_SECONDS', 60)
+
+    def tick(self, options):
+        chunk_size = options['chunk_size'] or getattr(settings, 'RIDE_REQUEST_SWEEP_CHUNK', 500)
+        now = timezone.now()
+        expired = expire_ride_requests(chunk_size=chunk_size, now=now)
+        pending = RideRequest.objects.filter(status='pending').count()
+
+        logger.info("Expired %d ride requests (%d still pending)", expired, pending)
+        self.stdout.write(f"[{now:%Y-%m-%d %H:%M:%S}] expired={expired} pending={pending}")
+        return expired
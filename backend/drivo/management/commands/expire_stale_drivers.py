@@ -0,0 +1,48 @@
+# management/commands/expire_stale_drivers.py
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from drivo.models import DriverProfile
+from ._looping import LoopingCommand
+
+logger = logging.getLogger(__name__)
+
+
+class Command(LoopingCommand):
+    help = (
+        "Mark 'available' drivers offline when their last location update is "
+        "older than DRIVER_LOCATION_TTL_SECONDS (drivers who killed the app). "
+        "Run from cron, or with --loop as a long-running sweeper."
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--ttl', type=int, default=None,
+                            help="Seconds without a location update before a driver expires")
+
+    def get_default_interval(self):
+        return getattr(settings, 'DRIVER_SWEEP_INTERVAL_SECONDS', 30)
+
+    def tick(self, options):
+        ttl = options['ttl'] or getattr(settings, 'DRIVER_LOCATION_TTL_SECONDS', 300)
+        now = timezone.now()
+        cutoff = now - timedelta(seconds=ttl)
+
+        # One set-based UPDATE. Drivers who never reported a position expire
+        # on the profile's own updated_at. Bumping updated_at lets the
+        # nearby-driver index in the web workers pick the change up.
+        expired = DriverProfile.objects.filter(status='available').filter(
+            Q(location__last_location_update__lt=cutoff) |
+            Q(location__isnull=True, updated_at__lt=cutoff)
+        ).update(status='offline', updated_at=now)
+        available = DriverProfile.objects.filter(status='available').count()
+
+        logger.info("Expired %d stale drivers (ttl=%ss, %d still available)", expired, ttl, available)
+        self.stdout.write(
+            f"[{now:%Y-%m-%d %H:%M:%S}] expired={expired} available={available} ttl={ttl}s"
+        )
+        return expired
@@ -0,0 +1,85 @@
+# management/commands/geocode_batch.py
+import json
+import sys
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from drivo.geo import geohash_for
+from drivo.geocoding_batch import TokenBucket, geocode_batch, upstream_bucket
+from drivo.models import RideRequest
+
+# (address column, latitude column, longitude column, geohash column or None)
+RIDE_REQUEST_POINTS = [
+    ('pickup_location', 'pickup_latitude', 'pickup_longitude', 'pickup_geohash'),
+    ('dropoff_location', 'dropoff_latitude', 'dropoff_longitude', None),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Geocode many addresses through the shared cache, rate limited like "
+        "geocode/batch/. Reads one query per line from FILE (or stdin) and "
+        "prints NDJSON results, or with --ride-requests fills missing "
+        "pickup/dropoff coordinates on ride requests from their addresses."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', nargs='?', help="One query per line; '-' or omitted reads stdin")
+        parser.add_argument('--ride-requests', action='store_true',
+                            help="Back-fill ride request coordinates instead of reading queries")
+        parser.add_argument('--workers', type=int, help="Upstream worker threads (GEOCODE_BATCH_WORKERS)")
+        parser.add_argument('--rate', type=float, help="Upstream calls per second (GEOCODE_BATCH_RATE)")
+
+    def handle(self, *args, **options):
+        bucket = upstream_bucket
+        if options['rate']:
+            bucket = TokenBucket(options['rate'], burst=max(1, int(options['rate'])))
+
+        if options['ride_requests']:
+            for columns in RIDE_REQUEST_POINTS:
+                self._backfill(columns, options['workers'], bucket)
+            return
+
+        if options['file'] and options['file'] != '-':
+            try:
+                with open(options['file'], encoding='utf-8') as f:
+                    queries = f.read().splitlines()
+            except OSError as e:
+                raise CommandError(f"Could not read {options['file']}: {e}")
+        else:
+            queries = sys.stdin.read().splitlines()
+        queries = [query for query in queries if query.strip()]
+
+        counts = {}
+        for result in geocode_batch(queries, workers=options['workers'], bucket=bucket):
+            counts[result['source']] = counts.get(result['source'], 0) + 1
+            self.stdout.write(json.dumps(result))
+        self.stderr.write(f"{len(queries)} queries, {sum(counts.values())} distinct: {counts}")
+
+    def _backfill(self, columns, workers, bucket):
+        address_field, lat_field, lon_field, geohash_field = columns
+        rows = list(
+            RideRequest.objects.filter(**{f'{lat_field}__isnull': True})
+            .exclude(**{address_field: ''})
+            .values_list('pk', address_field)
+        )
+        pks = [pk for pk, _ in rows]
+        updated = 0
+        unresolved = 0
+        for result in geocode_batch([address for _, address in rows], workers=workers, bucket=bucket):
+            payload = result['result']
+            if result['status'] != 200 or not isinstance(payload, list) or not payload:
+                unresolved += len(result['positions'])
+                continue
+            lat = Decimal(str(round(float(payload[0]['lat']), 6)))
+            lon = Decimal(str(round(float(payload[0]['lon']), 6)))
+            values = {lat_field: lat, lon_field: lon}
+            if geohash_field:
+                values[geohash_field] = geohash_for(lat, lon)
+            # Only rows still missing coordinates; a client may have set them meanwhile
+            updated += RideRequest.objects.filter(
+                pk__in=[pks[position] for position in result['positions']],
+                **{f'{lat_field}__isnull': True}
+            ).update(**values)
+        self.stdout.write(f"RideRequest.{lat_field}/{lon_field}: {updated} rows updated, {unresolved} unresolved")
@@ -0,0 +1,166 @@
+# management/commands/loadtest_geocode.py
+import asyncio
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand
+
+from drivo.geocoding import NOMINATIM_HEADERS
+from drivo.geocoding_async import AsyncGeocoder, UpstreamBusy
+
+
+class FakeGeocoder:
+    """
+    Minimal keep-alive HTTP/1.1 server answering /search like Nominatim
+    after a fixed latency. Answers 429 above rate_limit concurrent requests
+    and counts the TCP connections it accepts.
+    """
+
+    def __init__(self, latency, rate_limit):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.port = None
+        self.stats = {'connections': 0, 'requests': 0, 'rejected': 0, 'peak_concurrency': 0}
+        self._active = 0
+        self._ready = threading.Event()
+
+    def start(self):
+        threading.Thread(target=lambda: asyncio.run(self._serve()), daemon=True).start()
+        self._ready.wait()
+        return f'http://127.0.0.1:{self.port}'
+
+    def reset(self):
+        self.stats = dict.fromkeys(self.stats, 0)
+
+    async def _serve(self):
+        server = await asyncio.start_server(self._handle, '127.0.0.1', 0, backlog=1024)
+        self.port = server.sockets[0].getsockname()[1]
+        self._ready.set()
+        async with server:
+            await server.serve_forever()
+
+    async def _handle(self, reader, writer):
+        self.stats['connections'] += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                self.stats['requests'] += 1
+                self._active += 1
+                self.stats['peak_concurrency'] = max(self.stats['peak_concurrency'], self._active)
+                try:
+                    if self.rate_limit and self._active > self.rate_limit:
+                        self.stats['rejected'] += 1
+                        status, body = '429 Too Many Requests', b'[]'
+                    else:
+                        await asyncio.sleep(self.latency)
+                        status = '200 OK'
+                        body = json.dumps([{'lat': '31.5204', 'lon': '74.3587', 'display_name': 'Fake'}]).encode()
+                finally:
+                    self._active -= 1
+                writer.write(
+                    f'HTTP/1.1 {status}\r\nContent-Type: application/json\r\n'
+                    f'Content-Length: {len(body)}\r\nConnection: keep-alive\r\n\r\n'.encode() + body
+                )
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test upstream geocoding against a local fake geocoder: the sync "
+        "path (requests.get per call, one thread per concurrent request) versus "
+        "the async path (pooled keep-alive client behind the concurrency "
+        "semaphore, shedding to the local fallback when saturated)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=400)
+        parser.add_argument('--concurrency', type=int, default=50, help="Concurrent clients")
+        parser.add_argument('--latency-ms', type=float, default=50.0, help="Fake upstream response time")
+        parser.add_argument('--upstream-limit', type=int, default=8,
+                            help="Fake upstream answers 429 above this many concurrent requests (0: no limit)")
+        parser.add_argument('--slots', type=int, default=8, help="Async semaphore size")
+        parser.add_argument('--queue-seconds', type=float, default=0.5,
+                            help="How long an async request waits for a slot before falling back")
+
+    def handle(self, *args, **options):
+        # httpx logs every request at INFO
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+        fake = FakeGeocoder(options['latency_ms'] / 1000, options['upstream_limit'])
+        base_url = fake.start()
+        queries = [f'loadtest place {i}' for i in range(options['requests'])]
+
+        self.stdout.write(
+            f"{'path':<6} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'ok':>6} "
+            f"{'fallback':>9} {'errors':>7} {'upstream conns':>15} {'peak upstream':>14}"
+        )
+        fake.reset()
+        self._report('sync', fake, *self._run_sync(base_url, queries, options['concurrency']))
+        fake.reset()
+        self._report('async', fake, *asyncio.run(self._run_async(base_url, queries, options)))
+
+    @staticmethod
+    def _run_sync(base_url, queries, concurrency):
+        def one(query):
+            started = time.perf_counter()
+            try:
+                response = requests.get(f'{base_url}/search', params={'q': query, 'format': 'json', 'limit': 1},
+                                        headers=NOMINATIM_HEADERS, timeout=5)
+                response.raise_for_status()
+                outcome = 'ok'
+            except requests.RequestException:
+                outcome = 'error'
+            return outcome, time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(one, queries))
+        return results, time.perf_counter() - started
+
+    @staticmethod
+    async def _run_async(base_url, queries, options):
+        geocoder = AsyncGeocoder(base_url, concurrency=options['slots'], queue_seconds=options['queue_seconds'])
+        clients = asyncio.Semaphore(options['concurrency'])
+
+        async def one(query):
+            async with clients:
+                started = time.perf_counter()
+                try:
+                    await geocoder.search(query)
+                    outcome = 'ok'
+                except UpstreamBusy:
+                    # geocode() would answer from the gazetteer/default cities here
+                    outcome = 'fallback'
+                except Exception:
+                    outcome = 'error'
+                return outcome, time.perf_counter() - started
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(one(query) for query in queries))
+        elapsed = time.perf_counter() - started
+        await geocoder.release()
+        return results, elapsed
+
+    def _report(self, name, fake, results, elapsed):
+        latencies = sorted(latency for _, latency in results)
+        outcomes = [outcome for outcome, _ in results]
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+        self.stdout.write(
+            f"{name:<6} {len(results) / elapsed:>8.1f} {percentile(0.5):>8.1f} {percentile(0.99):>8.1f} "
+            f"{outcomes.count('ok'):>6} {outcomes.count('fallback'):>9} {outcomes.count('error'):>7} "
+            f"{fake.stats['connections']:>15} {fake.stats['peak_concurrency']:>14}"
+        )
@@ -0,0 +1,33 @@
+# management/commands/run_dispatcher.py
+import logging
+
+from django.conf import settings
+from django.utils import timezone
+
+from drivo.dispatch import redispatch_lapsed
+from ._looping import LoopingCommand
+
+logger = logging.getLogger(__name__)
+
+
+class Command(LoopingCommand):
+    help = (
+        "Expire ride offers nobody answered in time and offer their requests "
+        "to the next drivers, retrying requests that found nobody nearby. "
+        "Run from cron, or with --loop as a long-running dispatcher."
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--limit', type=int, default=200,
+                            help="Most requests dispatched per tick")
+
+    def get_default_interval(self):
+        return getattr(settings, 'DISPATCH_SWEEP_INTERVAL_SECONDS', 5)
+
+    def tick(self, options):
+        expired, dispatched = redispatch_lapsed(limit=options['limit'])
+        if expired or dispatched:
+            logger.info("Expired %d ride offers, dispatched %d requests", expired, dispatched)
+        self.stdout.write(f"[{timezone.now():%Y-%m-%d %H:%M:%S}] expired={expired} dispatched={dispatched}")
+        return dispatched
@@ -0,0 +1,60 @@
+# management/commands/run_ride_broker.py
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the local ride event broker: a TCP fan-out that relays every "
+        "newline-delimited event a worker publishes to all connected workers. "
+        "Point RIDE_BROKER_URL at it when serving with more than one ASGI worker."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--max-buffer-kb', type=int, default=1024,
+                            help="Disconnect a worker whose unsent backlog grows past this")
+
+    def handle(self, *args, **options):
+        try:
+            asyncio.run(self._serve(options))
+        except KeyboardInterrupt:
+            pass
+
+    async def _serve(self, options):
+        writers = set()
+        max_buffer = options['max_buffer_kb'] * 1024
+
+        async def relay(reader, writer):
+            peer = writer.get_extra_info('peername')
+            writers.add(writer)
+            self.stdout.write(f"Worker connected: {peer} ({len(writers)} total)")
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    for target in list(writers):
+                        if target.transport.get_write_buffer_size() > max_buffer:
+                            # A stuck worker must not make the broker buffer forever
+                            writers.discard(target)
+                            target.close()
+                            continue
+                        target.write(line)
+            except ConnectionError:
+                pass
+            finally:
+                writers.discard(writer)
+                writer.close()
+                self.stdout.write(f"Worker disconnected: {peer} ({len(writers)} total)")
+
+        server = await asyncio.start_server(
+            relay, options['host'], options['port'], limit=1024 * 1024
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Ride broker listening on {options['host']}:{options['port']}"
+        ))
+        async with server:
+            await server.serve_forever()
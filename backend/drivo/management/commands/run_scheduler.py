@@ -0,0 +1,40 @@
+# management/commands/run_scheduler.py
+from django.conf import settings
+from django.utils import timezone
+
+from drivo.scheduler import RideScheduler, lead_time, release_due
+from ._looping import LoopingCommand
+
+
+class Command(LoopingCommand):
+    help = (
+        "Release scheduled ride requests into dispatch SCHEDULER_LEAD_MINUTES "
+        "before pickup. With --loop, scheduled requests are loaded into an "
+        "in-memory timing wheel at startup and only changes are read after "
+        "that; a single run (cron) releases whatever is due with one index "
+        "range query."
+    )
+
+    def get_default_interval(self):
+        return getattr(settings, 'SCHEDULER_TICK_SECONDS', 1)
+
+    def handle(self, *args, **options):
+        self.scheduler = None
+        if options['loop']:
+            self.scheduler = RideScheduler(tick_seconds=options['interval'] or self.get_default_interval())
+            loaded = self.scheduler.rebuild()
+            self.stdout.write(
+                f"Loaded {loaded} scheduled ride requests, releasing {lead_time()} before pickup"
+            )
+        super().handle(*args, **options)
+
+    def tick(self, options):
+        if self.scheduler is None:
+            released = release_due()
+        else:
+            released = self.scheduler.tick()
+        if released or self.scheduler is None:
+            pending = f", {len(self.scheduler.wheel)} waiting" if self.scheduler is not None else ""
+            self.stdout.write(
+                f"[{timezone.now():%Y-%m-%d %H:%M:%S}] released {len(released)} scheduled ride requests{pending}"
+            )
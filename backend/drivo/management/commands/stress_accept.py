@@ -0,0 +1,130 @@
+# management/commands/stress_accept.py
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from drivo.dispatch import AcceptConflict, accept_ride_request, ride_fields
+from drivo.models import ClientProfile, DriverProfile, Ride, RideRequest, User
+
+EMAIL_DOMAIN = 'stress-accept.invalid'
+
+
+def naive_accept(ride_request, driver_profile):
+    """The old read-check-save path, for comparison"""
+    ride_request = RideRequest.objects.get(pk=ride_request.pk)
+    if ride_request.status != 'pending':
+        raise AcceptConflict("Ride request is no longer pending")
+    ride = Ride.objects.create(driver=driver_profile, status='accepted', **ride_fields(ride_request))
+    ride_request.status = 'accepted'
+    ride_request.save()
+    return ride
+
+
+class Command(BaseCommand):
+    help = (
+        "Race many drivers to accept the same ride request, one request per "
+        "round, and check exactly one wins each time. Reports accept "
+        "throughput and p50/p99 latency of each attempt. Creates throwaway "
+        f"users under @{EMAIL_DOMAIN} in the configured database and deletes "
+        "them afterwards. Use a database that handles concurrent writers "
+        "(MySQL, PostgreSQL); SQLite serializes them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drivers', type=int, default=32, help="Threads racing for each request")
+        parser.add_argument('--rounds', type=int, default=50, help="Requests raced for")
+        parser.add_argument('--naive', action='store_true', help="Race the old read-check-save path instead")
+        parser.add_argument('--keep', action='store_true', help="Keep the generated rows")
+
+    def handle(self, *args, **options):
+        if User.objects.filter(email__endswith=f'@{EMAIL_DOMAIN}').exists():
+            raise CommandError(f"Rows from an earlier run exist; delete users @{EMAIL_DOMAIN} first")
+        accept = naive_accept if options['naive'] else accept_ride_request
+        client, drivers = self._create_users(options['drivers'])
+        try:
+            self._race(accept, client, drivers, options['rounds'])
+        finally:
+            if not options['keep']:
+                User.objects.filter(email__endswith=f'@{EMAIL_DOMAIN}').delete()
+
+    @staticmethod
+    def _create_users(count):
+        with transaction.atomic():
+            client_user = User.objects.create(email=f'client@{EMAIL_DOMAIN}', is_client=True)
+            client = ClientProfile.objects.get_or_create(user=client_user)[0]
+            drivers = []
+            for i in range(count):
+                user = User.objects.create(email=f'driver{i}@{EMAIL_DOMAIN}', is_driver=True)
+                profile = DriverProfile.objects.get_or_create(user=user)[0]
+                profile.full_name = f'Stress driver {i}'
+                profile.status = 'available'
+                profile.save()
+                drivers.append(profile)
+        return client, drivers
+
+    def _race(self, accept, client, drivers, rounds):
+        latencies = []
+        outcomes = {'won': 0, 'conflict': 0, 'error': 0}
+        double_accepts = 0
+        lock = threading.Lock()
+        started = time.perf_counter()
+
+        for _ in range(rounds):
+            ride_request = RideRequest.objects.create(
+                client=client, pickup_location='Stress pickup', dropoff_location='Stress dropoff',
+                pickup_latitude=31.5204, pickup_longitude=74.3587,
+            )
+            barrier = threading.Barrier(len(drivers))
+
+            def attempt(driver):
+                try:
+                    barrier.wait()
+                    begun = time.perf_counter()
+                    try:
+                        accept(ride_request, driver)
+                        outcome = 'won'
+                    except AcceptConflict:
+                        outcome = 'conflict'
+                    except Exception as e:
+                        outcome = 'error'
+                        self.stderr.write(f"Attempt failed: {e}")
+                    with lock:
+                        latencies.append(time.perf_counter() - begun)
+                        outcomes[outcome] += 1
+                finally:
+                    connection.close()
+
+            threads = [threading.Thread(target=attempt, args=(driver,)) for driver in drivers]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            winners = Ride.objects.filter(client=client, pickup_location='Stress pickup').count()
+            if winners > 1:
+                double_accepts += 1
+            # Free the winner(s) for the next round
+            Ride.objects.filter(client=client).delete()
+            DriverProfile.objects.filter(id__in=[driver.id for driver in drivers]).update(status='available')
+
+        elapsed = time.perf_counter() - started
+        latencies.sort()
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+        self.stdout.write(
+            f"{rounds} rounds x {len(drivers)} drivers in {elapsed:.2f}s: "
+            f"{outcomes['won'] / elapsed:.1f} accepts/s, {len(latencies) / elapsed:.1f} attempts/s, "
+            f"p50 {percentile(0.5):.1f} ms, p99 {percentile(0.99):.1f} ms"
+        )
+        self.stdout.write(
+            f"won={outcomes['won']} conflict={outcomes['conflict']} error={outcomes['error']} "
+            f"rounds with more than one winner={double_accepts}"
+        )
+        if double_accepts:
+            self.stderr.write(self.style.ERROR(f"{double_accepts} requests were accepted by more than one driver"))
+        elif outcomes['won'] == rounds:
+            self.stdout.write(self.style.SUCCESS("Every request had exactly one winner"))
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drivo', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DriverLocationFix',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('latitude', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('longitude', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('recorded_at', models.DateTimeField()),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('driver', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='location_fixes', to='drivo.driverprofile')),
+            ],
+            options={
+                'db_table': 'drivo_driver_location_fix',
+                'indexes': [models.Index(fields=['driver', 'recorded_at'], name='drivo_drive_driver__ecf8be_idx')],
+            },
+        ),
+    ]
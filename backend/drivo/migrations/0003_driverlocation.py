@@ -0,0 +1,85 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:51
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def copy_locations_forward(apps, schema_editor):
+    DriverProfile = apps.get_model('drivo', 'DriverProfile')
+    DriverLocation = apps.get_model('drivo', 'DriverLocation')
+    rows = DriverProfile.objects.filter(
+        current_latitude__isnull=False,
+        current_longitude__isnull=False
+    ).values_list('id', 'current_latitude', 'current_longitude', 'last_location_update')
+    DriverLocation.objects.bulk_create([
+        DriverLocation(
+            driver_id=driver_id,
+            latitude=latitude,
+            longitude=longitude,
+            last_location_update=last_location_update or django.utils.timezone.now()
+        )
+        for driver_id, latitude, longitude, last_location_update in rows.iterator()
+    ], batch_size=1000)
+
+
+def copy_locations_backward(apps, schema_editor):
+    DriverProfile = apps.get_model('drivo', 'DriverProfile')
+    DriverLocation = apps.get_model('drivo', 'DriverLocation')
+    for location in DriverLocation.objects.iterator():
+        DriverProfile.objects.filter(id=location.driver_id).update(
+            current_latitude=location.latitude,
+            current_longitude=location.longitude,
+            last_location_update=location.last_location_update
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drivo', '0002_driverlocationfix'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DriverLocation',
+            fields=[
+                ('driver', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='location', serialize=False, to='drivo.driverprofile')),
+                ('latitude', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('longitude', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('last_location_update', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'drivo_driver_location',
+            },
+        ),
+        migrations.RunPython(copy_locations_forward, copy_locations_backward),
+        migrations.RemoveIndex(
+            model_name='driverprofile',
+            name='drivo_drive_current_7c13dd_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='driverprofile',
+            name='drivo_drive_status_b262ca_idx',
+        ),
+        migrations.RemoveField(
+            model_name='driverprofile',
+            name='current_latitude',
+        ),
+        migrations.RemoveField(
+            model_name='driverprofile',
+            name='current_longitude',
+        ),
+        migrations.RemoveField(
+            model_name='driverprofile',
+            name='last_location_update',
+        ),
+        migrations.AddIndex(
+            model_name='driverlocation',
+            index=models.Index(fields=['latitude', 'longitude'], name='drivo_drive_latitud_f1df64_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='driverlocation',
+            index=models.Index(fields=['last_location_update'], name='drivo_drive_last_lo_ae0bb2_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drivo', '0003_driverlocation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RideTrailChunk',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('seq', models.PositiveIntegerField()),
+                ('point_count', models.PositiveIntegerField()),
+                ('started_at', models.DateTimeField()),
+                ('ended_at', models.DateTimeField()),
+                ('data', models.BinaryField()),
+                ('ride', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trail_chunks', to='drivo.ride')),
+            ],
+            options={
+                'db_table': 'drivo_ride_trail_chunk',
+                'unique_together': {('ride', 'seq')},
+            },
+        ),
+    ]
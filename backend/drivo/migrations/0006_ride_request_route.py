@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-17 04:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drivo', '0005_geohash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='riderequest',
+            name='distance',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='riderequest',
+            name='duration',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.5 on 2026-10-17 04:07
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drivo', '0006_ride_request_route'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeocodeCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('key', models.CharField(max_length=255, unique=True)),
+                ('payload', models.JSONField()),
+                ('hit_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_accessed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'drivo_geocode_cache',
+                'indexes': [models.Index(fields=['last_accessed_at'], name='drivo_geoco_last_ac_59abdd_idx'), models.Index(fields=['expires_at'], name='drivo_geoco_expires_cbae33_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.5 on 2026-10-17 04:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drivo', '0007_geocode_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='driverprofile',
+            name='vehicle_type',
+            field=models.CharField(choices=[('car', 'Car'), ('bike', 'Bike'), ('van', 'Van'), ('truck', 'Truck'), ('suv', 'SUV')], default='car', max_length=50),
+        ),
+        migrations.CreateModel(
+            name='RideOffer',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('round', models.PositiveSmallIntegerField(default=1)),
+                ('rank', models.PositiveSmallIntegerField(default=1)),
+                ('distance_km', models.DecimalField(blank=True, decimal_places=3, max_digits=8, null=True)),
+                ('status', models.CharField(choices=[('offered', 'Offered'), ('accepted', 'Accepted'), ('declined', 'Declined'), ('expired', 'Expired'), ('withdrawn', 'Withdrawn')], default='offered', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField()),
+                ('responded_at', models.DateTimeField(blank=True, null=True)),
+                ('driver', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ride_offers', to='drivo.driverprofile')),
+                ('ride_request', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='offers', to='drivo.riderequest')),
+            ],
+            options={
+                'db_table': 'drivo_ride_offer',
+                'indexes': [models.Index(fields=['driver', 'status', 'expires_at'], name='drivo_ride__driver__869b23_idx'), models.Index(fields=['status', 'expires_at'], name='drivo_ride__status_c5e05c_idx')],
+                'constraints': [models.UniqueConstraint(fields=('ride_request', 'driver'), name='drivo_ride_offer_request_driver')],
+            },
+        ),
+    ]
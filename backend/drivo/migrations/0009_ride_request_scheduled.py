@@ -0,0 +1,22 @@
+# Generated by Django 5.2.5 on 2026-10-17 04:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drivo', '0008_dispatch'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='riderequest',
+            name='status',
+            field=models.CharField(choices=[('scheduled', 'Scheduled'), ('pending', 'Pending'), ('accepted', 'Accepted'), ('rejected', 'Rejected'), ('cancelled', 'Cancelled')], default='pending', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='riderequest',
+            index=models.Index(fields=['status', 'scheduled_datetime'], name='drivo_ride__status_d5340f_idx'),
+        ),
+    ]
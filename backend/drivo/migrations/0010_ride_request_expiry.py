@@ -0,0 +1,41 @@
+# Generated by Django 5.2.5 on 2026-10-17 04:28
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def set_expiry(apps, schema_editor):
+    # Open requests from before expiry get the same TTL as new ones
+    RideRequest = apps.get_model('drivo', 'RideRequest')
+    ttl = timedelta(minutes=getattr(settings, 'RIDE_REQUEST_TTL_MINUTES', 30))
+    RideRequest.objects.filter(status__in=['pending', 'scheduled'], expires_at__isnull=True).update(
+        expires_at=Coalesce('scheduled_datetime', 'created_at') + ttl
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drivo', '0009_ride_request_scheduled'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='riderequest',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='riderequest',
+            name='status',
+            field=models.CharField(choices=[('scheduled', 'Scheduled'), ('pending', 'Pending'), ('accepted', 'Accepted'), ('rejected', 'Rejected'), ('cancelled', 'Cancelled'), ('expired', 'Expired')], default='pending', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='riderequest',
+            index=models.Index(fields=['status', 'expires_at'], name='drivo_ride__status_358b19_idx'),
+        ),
+        migrations.RunPython(set_expiry, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 04:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drivo', '0010_ride_request_expiry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ride',
+            name='version',
+            field=models.PositiveBigIntegerField(default=1, editable=False),
+        ),
+    ]
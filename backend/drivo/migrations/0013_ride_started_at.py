@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 04:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drivo', '0012_driver_location_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ride',
+            name='started_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
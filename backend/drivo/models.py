@@ -3,9 +3,22 @@ from django.db import models
 from django.utils import timezone
 from django.core.validators import RegexValidator, MinValueValidator, MaxValueValidator
 
+from .geo import GEOHASH_PRECISION, geohash_for
+
 # Phone number validator
 phone_validator = RegexValidator(regex=r'^\+?\d{10,15}$', message="Enter a valid phone number")
 
+def sync_geohash(instance, geohash_field, lat_field, lon_field, save_kwargs):
+    """
+    Recompute a precomputed geohash column before save. Returns save kwargs
+    with the column added when the caller passed update_fields.
+    """
+    setattr(instance, geohash_field, geohash_for(getattr(instance, lat_field), getattr(instance, lon_field)))
+    update_fields = save_kwargs.get('update_fields')
+    if update_fields is not None and (lat_field in update_fields or lon_field in update_fields):
+        save_kwargs['update_fields'] = set(update_fields) | {geohash_field}
+    return save_kwargs
+
 # Custom User Manager
 class CustomUserManager(UserManager):
     def create_user(self, email, password=None, **extra_fields):
@@ -67,6 +80,7 @@ class ClientProfile(models.Model):
     address = models.CharField(max_length=255, blank=True, null=True)
     latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    geohash = models.CharField(max_length=GEOHASH_PRECISION, null=True, blank=True, editable=False)
     dp = models.ImageField(upload_to='profile_pics/', null=True, blank=True, default='profile_pics/default_client.png')
     last_location_update = models.DateTimeField(auto_now=True)
     
@@ -75,8 +89,12 @@ class ClientProfile(models.Model):
         indexes = [
             models.Index(fields=['user']),
             models.Index(fields=['latitude', 'longitude']),
+            models.Index(fields=['geohash']),
         ]
     
+    def save(self, *args, **kwargs):
+        super().save(*args, **sync_geohash(self, 'geohash', 'latitude', 'longitude', kwargs))
+    
     def _str_(self):
         return self.full_name or f"Client ({self.user.email})"
 
@@ -98,10 +116,16 @@ class DriverProfile(models.Model):
         ('busy', 'Busy'),
         ('offline', 'Offline')
     ])
+    # Matched against RideRequest.vehicle_type when dispatching offers
+    vehicle_type = models.CharField(max_length=50, default='car', choices=[
+        ('car', 'Car'),
+        ('bike', 'Bike'),
+        ('van', 'Van'),
+        ('truck', 'Truck'),
+        ('suv', 'SUV')
+    ])
     dp = models.ImageField(upload_to='profile_pics/', null=True, blank=True, default='profile_pics/default_driver.png')
-    current_latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
-    current_longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
-    last_location_update = models.DateTimeField(auto_now=True)
+    # Live position lives in DriverLocation (related_name='location')
     
     # New fields for validation
     cnic_verified = models.BooleanField(default=False)
@@ -131,13 +155,57 @@ class DriverProfile(models.Model):
         indexes = [
             models.Index(fields=['user']),
             models.Index(fields=['status']),
-            models.Index(fields=['current_latitude', 'current_longitude']),
-            models.Index(fields=['status', 'current_latitude', 'current_longitude']),
         ]
     
     def _str_(self):
         return self.full_name or f"Driver ({self.user.email})"
 
+class DriverLocation(models.Model):
+    """
+    Narrow, frequently written table holding a driver's live position.
+    Split out of DriverProfile so location pings rewrite a small row instead
+    of the wide profile row and its indexes.
+    """
+    driver = models.OneToOneField(DriverProfile, on_delete=models.CASCADE, primary_key=True, related_name='location')
+    latitude = models.DecimalField(max_digits=9, decimal_places=6)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6)
+    geohash = models.CharField(max_length=GEOHASH_PRECISION, null=True, blank=True, editable=False)
+    last_location_update = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)  # server write time; last_location_update is the device's
+    
+    class Meta:
+        db_table = 'drivo_driver_location'
+        indexes = [
+            models.Index(fields=['latitude', 'longitude']),
+            models.Index(fields=['geohash']),
+            models.Index(fields=['last_location_update']),
+            models.Index(fields=['updated_at']),
+        ]
+    
+    def save(self, *args, **kwargs):
+        super().save(*args, **sync_geohash(self, 'geohash', 'latitude', 'longitude', kwargs))
+    
+    def _str_(self):
+        return f"Location of driver {self.driver_id} ({self.latitude}, {self.longitude})"
+
+class DriverLocationFix(models.Model):
+    """Raw GPS trail: one row per fix reported by the driver app"""
+    id = models.BigAutoField(primary_key=True)
+    driver = models.ForeignKey(DriverProfile, on_delete=models.CASCADE, related_name='location_fixes')
+    latitude = models.DecimalField(max_digits=9, decimal_places=6)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6)
+    recorded_at = models.DateTimeField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'drivo_driver_location_fix'
+        indexes = [
+            models.Index(fields=['driver', 'recorded_at']),
+        ]
+    
+    def _str_(self):
+        return f"Fix for driver {self.driver_id} at {self.recorded_at}"
+
 class RideRequest(models.Model):
     id = models.BigAutoField(primary_key=True)
     client = models.ForeignKey(ClientProfile, on_delete=models.CASCADE, related_name='ride_requests')
@@ -147,6 +215,7 @@ class RideRequest(models.Model):
     pickup_longitude = models.DecimalField(max_digits=10, decimal_places=6, null=True, blank=True)
     dropoff_latitude = models.DecimalField(max_digits=10, decimal_places=6, null=True, blank=True)
     dropoff_longitude = models.DecimalField(max_digits=10, decimal_places=6, null=True, blank=True)
+    pickup_geohash = models.CharField(max_length=GEOHASH_PRECISION, null=True, blank=True, editable=False)
     scheduled_datetime = models.DateTimeField(null=True, blank=True)
     vehicle_type = models.CharField(max_length=50, default='car', choices=[
         ('car', 'Car'),
@@ -166,12 +235,18 @@ class RideRequest(models.Model):
         ('round_trip', 'Round Trip')
     ])
     estimated_fare = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    distance = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)  # km
+    duration = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)  # minutes
     status = models.CharField(max_length=20, default='pending', choices=[
+        ('scheduled', 'Scheduled'),
         ('pending', 'Pending'),
         ('accepted', 'Accepted'),
         ('rejected', 'Rejected'),
-        ('cancelled', 'Cancelled')
+        ('cancelled', 'Cancelled'),
+        ('expired', 'Expired')
     ])
+    # Unaccepted requests lapse here (RIDE_REQUEST_TTL_MINUTES); null never expires
+    expires_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -181,8 +256,17 @@ class RideRequest(models.Model):
             models.Index(fields=['client']),
             models.Index(fields=['status']),
             models.Index(fields=['created_at']),
+            # Pending requests around a driver: one prefix range scan
+            models.Index(fields=['status', 'pickup_geohash']),
+            # Scheduled requests by pickup time: the scheduler's rebuild and release scans
+            models.Index(fields=['status', 'scheduled_datetime']),
+            # Live vs. lapsed pending requests: the expiry sweep's range scan
+            models.Index(fields=['status', 'expires_at']),
         ]
     
+    def save(self, *args, **kwargs):
+        super().save(*args, **sync_geohash(self, 'pickup_geohash', 'pickup_latitude', 'pickup_longitude', kwargs))
+    
     def _str_(self):
         return f"Ride Request #{self.id} - {self.pickup_location} to {self.dropoff_location}"
 
@@ -228,6 +312,10 @@ class Ride(models.Model):
         ('completed', 'Completed'),
         ('cancelled', 'Cancelled')
     ])
+    # Bumped by every save; rides/<id>/changes/ waits for it to pass ?since_version=
+    version = models.PositiveBigIntegerField(default=1, editable=False)
+    # Set when the ride moves to in_progress; earlier driver fixes stay off its trail
+    started_at = models.DateTimeField(null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -242,9 +330,96 @@ class Ride(models.Model):
             models.Index(fields=['status', 'created_at']),
         ]
     
+    _loaded_status = None  # status as last read from / written to the database
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+    
+    def status_changed(self):
+        """True while saving a status that differs from the stored one (post_save handlers)"""
+        # A status deferred at load and never set is not written by save()
+        return 'status' in self.__dict__ and self.status != self._loaded_status
+    
+    def save(self, *args, **kwargs):
+        if self.status_changed() and self.status == 'in_progress' and self.started_at is None:
+            self.started_at = timezone.now()
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'started_at'}
+        if self._state.adding:
+            super().save(*args, **kwargs)
+            self._loaded_status = self.status
+            return
+        # Incremented in the UPDATE itself so concurrent saves never share a version
+        self.version = models.F('version') + 1
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'version', 'updated_at'}
+        super().save(*args, **kwargs)
+        # MySQL can't return the new value from the UPDATE, so leave version
+        # deferred: the SELECT that reloads it runs only if something reads it
+        del self.__dict__['version']
+        self._loaded_status = self.status
+    
     def _str_(self):
         return f"Ride #{self.id} - {self.pickup_location} to {self.dropoff_location}"
 
+class RideOffer(models.Model):
+    """A ride request offered to one driver by the dispatcher (dispatch.py)"""
+    id = models.BigAutoField(primary_key=True)
+    ride_request = models.ForeignKey(RideRequest, on_delete=models.CASCADE, related_name='offers')
+    driver = models.ForeignKey(DriverProfile, on_delete=models.CASCADE, related_name='ride_offers')
+    round = models.PositiveSmallIntegerField(default=1)
+    rank = models.PositiveSmallIntegerField(default=1)  # 1 = best candidate of its round
+    distance_km = models.DecimalField(max_digits=8, decimal_places=3, null=True, blank=True)
+    status = models.CharField(max_length=20, default='offered', choices=[
+        ('offered', 'Offered'),
+        ('accepted', 'Accepted'),
+        ('declined', 'Declined'),
+        ('expired', 'Expired'),
+        ('withdrawn', 'Withdrawn')
+    ])
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+    responded_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'drivo_ride_offer'
+        constraints = [
+            # A driver is offered a request at most once
+            models.UniqueConstraint(fields=['ride_request', 'driver'], name='drivo_ride_offer_request_driver'),
+        ]
+        indexes = [
+            # A driver's inbox
+            models.Index(fields=['driver', 'status', 'expires_at']),
+            # The dispatcher's sweep for lapsed offers
+            models.Index(fields=['status', 'expires_at']),
+        ]
+    
+    def _str_(self):
+        return f"Offer of request #{self.ride_request_id} to driver #{self.driver_id} ({self.status})"
+
+class RideTrailChunk(models.Model):
+    """
+    Packed slice of a ride's GPS trail (delta-encoded fixed-point columns,
+    see ride_trail.py). A finished ride is compacted into a single chunk.
+    """
+    id = models.BigAutoField(primary_key=True)
+    ride = models.ForeignKey(Ride, on_delete=models.CASCADE, related_name='trail_chunks')
+    seq = models.PositiveIntegerField()
+    point_count = models.PositiveIntegerField()
+    started_at = models.DateTimeField()
+    ended_at = models.DateTimeField()
+    data = models.BinaryField()
+    
+    class Meta:
+        db_table = 'drivo_ride_trail_chunk'
+        unique_together = ('ride', 'seq')
+    
+    def _str_(self):
+        return f"Trail chunk {self.seq} of ride {self.ride_id} ({self.point_count} points)"
+
 class Payment(models.Model):
     id = models.BigAutoField(primary_key=True)
     ride = models.ForeignKey(Ride, on_delete=models.CASCADE, related_name='payments')
@@ -409,4 +584,27 @@ class Earning(models.Model):
         ]
     
     def _str_(self):
-        return f"Earning of {self.amount} for {self.driver.user.email}"
\ No newline at end of file
+        return f"Earning of {self.amount} for {self.driver.user.email}"
+class GeocodeCacheEntry(models.Model):
+    """
+    Persistent geocoder answer shared by all workers (see geocoding.py).
+    Rows are evicted least-recently-used first once the table outgrows
+    GEOCODE_CACHE_MAX_ENTRIES.
+    """
+    id = models.BigAutoField(primary_key=True)
+    key = models.CharField(max_length=255, unique=True)
+    payload = models.JSONField()
+    hit_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_accessed_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'drivo_geocode_cache'
+        indexes = [
+            models.Index(fields=['last_accessed_at']),
+            models.Index(fields=['expires_at']),
+        ]
+    
+    def _str_(self):
+        return f"Geocode cache {self.key} ({self.hit_count} hits)"
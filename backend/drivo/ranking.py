@@ -0,0 +1,119 @@
+# ranking.py
+"""
+Vectorised ranking of candidate drivers against pickup points.
+
+Candidate coordinates are held in contiguous float64 arrays. Distances and
+initial bearings for every candidate against one pickup, or a whole matrix
+of pickups, are computed in a single NumPy pass. The k closest come from
+argpartition (linear time), and only those k are sorted.
+"""
+import numpy as np
+
+from .geo import EARTH_RADIUS_KM
+
+
+class Candidates:
+    """Driver ids with their coordinates as parallel arrays"""
+    __slots__ = ('ids', 'lat', 'lon')
+
+    def __init__(self, ids, lat, lon):
+        self.ids = np.ascontiguousarray(ids, dtype=np.int64)
+        self.lat = np.ascontiguousarray(lat, dtype=np.float64)
+        self.lon = np.ascontiguousarray(lon, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0), np.empty(0), np.empty(0))
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build from (id, latitude, longitude) tuples; Decimal coordinates are fine"""
+        rows = list(rows)
+        if not rows:
+            return cls.empty()
+        ids, lat, lon = zip(*rows)
+        return cls(ids, np.array(lat, dtype=np.float64), np.array(lon, dtype=np.float64))
+
+    @classmethod
+    def from_queryset(cls, queryset, lat_field='location__latitude', lon_field='location__longitude'):
+        """One values_list query; rows without a position are skipped"""
+        return cls.from_rows(
+            row for row in queryset.values_list('id', lat_field, lon_field).iterator(chunk_size=5000)
+            if row[1] is not None and row[2] is not None
+        )
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Broadcasting great-circle distance in km; inputs in degrees"""
+    lat1, lon1, lat2, lon2 = (np.radians(value) for value in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def bearing_deg(lat1, lon1, lat2, lon2):
+    """Broadcasting initial bearing from point 1 to point 2, 0-360 clockwise from north"""
+    lat1, lon1, lat2, lon2 = (np.radians(value) for value in (lat1, lon1, lat2, lon2))
+    dlon = lon2 - lon1
+    x = np.sin(dlon) * np.cos(lat2)
+    y = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(dlon)
+    return (np.degrees(np.arctan2(x, y)) + 360.0) % 360.0
+
+
+def distance_matrix(candidates, pickup_lats, pickup_lons):
+    """(pickups x candidates) distances in km"""
+    pickup_lats = np.asarray(pickup_lats, dtype=np.float64)[:, np.newaxis]
+    pickup_lons = np.asarray(pickup_lons, dtype=np.float64)[:, np.newaxis]
+    return haversine_km(pickup_lats, pickup_lons, candidates.lat[np.newaxis, :], candidates.lon[np.newaxis, :])
+
+
+def top_k(distances, k, radius_km=None):
+    """
+    Column indices of the k smallest values in each row of a 2-D array,
+    closest first. Entries beyond radius_km are dropped, so rows may be
+    shorter than k.
+    """
+    distances = np.atleast_2d(distances)
+    rows, count = distances.shape
+    if radius_km is not None:
+        distances = np.where(distances <= radius_km, distances, np.inf)
+    k = min(k, count)
+    if k <= 0:
+        return [np.empty(0, dtype=np.int64) for _ in range(rows)]
+
+    if k < count:
+        nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    else:
+        nearest = np.broadcast_to(np.arange(count), (rows, count))
+    nearest_distances = np.take_along_axis(distances, nearest, axis=1)
+    order = np.argsort(nearest_distances, axis=1, kind='stable')
+    nearest = np.take_along_axis(nearest, order, axis=1)
+    nearest_distances = np.take_along_axis(nearest_distances, order, axis=1)
+    return [row[np.isfinite(row_distances)] for row, row_distances in zip(nearest, nearest_distances)]
+
+
+def rank_many(candidates, pickups, k, radius_km=None):
+    """
+    For each (latitude, longitude) pickup, the k closest candidates as
+    (driver_id, distance_km, bearing_deg) tuples, closest first. The
+    bearing is from the driver towards the pickup.
+    """
+    pickups = np.asarray(pickups, dtype=np.float64).reshape(-1, 2)
+    if len(candidates) == 0 or len(pickups) == 0:
+        return [[] for _ in range(len(pickups))]
+
+    distances = distance_matrix(candidates, pickups[:, 0], pickups[:, 1])
+    results = []
+    for pickup, row, indices in zip(pickups, distances, top_k(distances, k, radius_km)):
+        bearings = bearing_deg(candidates.lat[indices], candidates.lon[indices], pickup[0], pickup[1])
+        results.append(list(zip(
+            candidates.ids[indices].tolist(), row[indices].tolist(), bearings.tolist()
+        )))
+    return results
+
+
+def rank(candidates, lat, lon, k, radius_km=None):
+    """rank_many for a single pickup"""
+    return rank_many(candidates, [(lat, lon)], k, radius_km)[0]
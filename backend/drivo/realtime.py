@@ -0,0 +1,447 @@
+# realtime.py
+"""
+Push channel for live ride tracking.
+
+RideEventHub is an in-process pub/sub. Location writes publish on
+'driver:<id>' and ride saves publish on 'ride:<id>'; the WebSocket handler
+(/ws/rides/<id>/, routed in backend/asgi.py) and the SSE view
+(rides/<id>/events/) subscribe with an asyncio queue per connection.
+
+A hub only reaches connections held by its own process. With
+RIDE_BROKER_URL set (tcp://127.0.0.1:8765, see the run_ride_broker command)
+every publish is sent to the broker instead, which echoes it to all
+connected workers, including the sender. If the broker is unreachable,
+events are delivered locally only.
+"""
+import asyncio
+import json
+import logging
+import queue
+import socket
+import threading
+import time
+from urllib.parse import urlparse
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_RIDE_STATUSES = ('completed', 'cancelled')
+
+
+def ride_channel(ride_id):
+    return f"ride:{ride_id}"
+
+
+def driver_channel(driver_id):
+    return f"driver:{driver_id}"
+
+
+class Subscription:
+    """One connection's view of the hub: a bounded queue bound to its event loop"""
+
+    def __init__(self, hub, loop, maxsize):
+        self.hub = hub
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize)
+        self.channels = set()
+        self.dropped = 0
+
+    def _deliver(self, event):
+        # Runs on the subscriber's loop. A slow client loses the oldest
+        # events; only the newest driver position is worth sending anyway.
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    def subscribe(self, channel):
+        self.hub._add(self, channel)
+
+    def unsubscribe(self, channel):
+        self.hub._discard(self, channel)
+
+    async def get(self, timeout=None):
+        """Next event, or None if nothing arrived within timeout seconds"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        for channel in list(self.channels):
+            self.hub._discard(self, channel)
+
+
+class BrokerClient:
+    """
+    Background thread holding one TCP connection to the ride broker.
+    Outgoing events are newline-delimited JSON; incoming lines are handed
+    to on_message.
+    """
+
+    def __init__(self, host, port, on_message, max_pending=10000):
+        self.host = host
+        self.port = port
+        self.on_message = on_message
+        self._outbox = queue.Queue(max_pending)
+        self._sock = None
+        self._connected = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def connected(self):
+        return self._connected.is_set()
+
+    def send(self, message):
+        self._ensure_thread()
+        if not self.connected:
+            return False
+        try:
+            self._outbox.put_nowait(json.dumps(message, default=str).encode() + b'\n')
+        except queue.Full:
+            return False
+        return True
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='drivo-ride-broker', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        backoff = 0.5
+        while True:
+            try:
+                sock = socket.create_connection((self.host, self.port), timeout=5)
+                sock.settimeout(None)
+            except OSError:
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 10)
+                continue
+            backoff = 0.5
+            self._sock = sock
+            self._connected.set()
+            reader = threading.Thread(target=self._read, args=(sock,), daemon=True)
+            reader.start()
+            try:
+                while reader.is_alive():
+                    try:
+                        line = self._outbox.get(timeout=1)
+                    except queue.Empty:
+                        continue
+                    sock.sendall(line)
+            except OSError:
+                logger.warning("Lost connection to ride broker at %s:%s", self.host, self.port)
+            finally:
+                self._connected.clear()
+                sock.close()
+
+    def _read(self, sock):
+        try:
+            for line in sock.makefile('rb'):
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    continue
+                self.on_message(message)
+        except OSError:
+            pass
+        finally:
+            self._connected.clear()
+
+
+class RideEventHub:
+    def __init__(self, broker_url=None, queue_size=64):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers = {}  # channel -> set(Subscription)
+        self.stats = {'published': 0, 'delivered': 0}
+        self.broker = None
+        if broker_url:
+            parsed = urlparse(broker_url)
+            self.broker = BrokerClient(
+                parsed.hostname or '127.0.0.1', parsed.port or 8765, self._on_broker_message
+            )
+
+    def subscribe(self, *channels):
+        """Open a subscription on the running event loop"""
+        if self.broker is not None:
+            self.broker._ensure_thread()
+        subscription = Subscription(self, asyncio.get_running_loop(), self.queue_size)
+        for channel in channels:
+            subscription.subscribe(channel)
+        return subscription
+
+    def _add(self, subscription, channel):
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscription)
+            subscription.channels.add(channel)
+
+    def _discard(self, subscription, channel):
+        with self._lock:
+            subscribers = self._subscribers.get(channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[channel]
+            subscription.channels.discard(channel)
+
+    def has_subscribers(self, channel):
+        with self._lock:
+            return channel in self._subscribers
+
+    def publish(self, channel, event):
+        """Publish from any thread, sync or async"""
+        self.stats['published'] += 1
+        if self.broker is not None and self.broker.send({'channel': channel, 'event': event}):
+            return
+        self.dispatch(channel, event)
+
+    def dispatch(self, channel, event):
+        """Hand an event to the subscribers held by this process"""
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._deliver, event)
+            except RuntimeError:
+                # Loop already closed; the connection is going away
+                continue
+            self.stats['delivered'] += 1
+
+    def _on_broker_message(self, message):
+        channel = message.get('channel')
+        if channel:
+            self.dispatch(channel, message.get('event'))
+
+    def connections(self):
+        with self._lock:
+            return len({subscription for subscribers in self._subscribers.values() for subscription in subscribers})
+
+
+ride_events = RideEventHub(
+    broker_url=getattr(settings, 'RIDE_BROKER_URL', None),
+    queue_size=getattr(settings, 'RIDE_EVENTS_QUEUE_SIZE', 64),
+)
+
+
+# ---------- publishers ----------
+def publish_driver_location(driver_id, latitude, longitude, recorded_at):
+    channel = driver_channel(driver_id)
+    # Without a broker nobody outside this process can be listening
+    if ride_events.broker is None and not ride_events.has_subscribers(channel):
+        return
+    ride_events.publish(channel, {
+        'type': 'location',
+        'driver_id': driver_id,
+        'latitude': float(latitude),
+        'longitude': float(longitude),
+        'recorded_at': recorded_at.isoformat() if recorded_at else None,
+    })
+
+
+def ride_status_event(ride):
+    return {
+        'type': 'status',
+        'ride_id': ride.id,
+        'status': ride.status,
+        'driver_id': ride.driver_id,
+        'updated_at': ride.updated_at.isoformat() if ride.updated_at else None,
+    }
+
+
+def publish_ride_status(ride):
+    ride_events.publish(ride_channel(ride.id), ride_status_event(ride))
+
+
+# ---------- subscribers ----------
+def authorize_ride_subscriber(token, ride_id):
+    """
+    Validate a JWT access token and check the user may follow the ride.
+    Returns (ride, None) or (None, (http_status, message)).
+    """
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+    from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+    from .models import Ride
+
+    if not token:
+        return None, (401, "Authentication token is required")
+    authentication = JWTAuthentication()
+    try:
+        user = authentication.get_user(authentication.get_validated_token(token))
+    except (InvalidToken, AuthenticationFailed) as e:
+        return None, (401, str(e))
+
+    try:
+        ride = Ride.objects.select_related('client', 'driver').get(pk=ride_id)
+    except Ride.DoesNotExist:
+        return None, (404, "Ride not found")
+    if not ((user.is_client and ride.client.user_id == user.id) or
+            (user.is_driver and ride.driver and ride.driver.user_id == user.id)):
+        return None, (403, "You don't have permission to view this ride")
+    return ride, None
+
+
+def authorize_driver_subscriber(token):
+    """
+    Validate a JWT access token for a driver's offer stream.
+    Returns (driver profile id, None) or (None, (http_status, message)).
+    """
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+    from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+    from .models import DriverProfile
+
+    if not token:
+        return None, (401, "Authentication token is required")
+    authentication = JWTAuthentication()
+    try:
+        user = authentication.get_user(authentication.get_validated_token(token))
+    except (InvalidToken, AuthenticationFailed) as e:
+        return None, (401, str(e))
+    driver_id = DriverProfile.objects.filter(user=user).values_list('id', flat=True).first()
+    if driver_id is None:
+        return None, (404, "Driver profile not found")
+    return driver_id, None
+
+
+def _driver_snapshot(driver_id):
+    from .location_buffer import location_buffer
+    from .models import DriverLocation
+
+    buffered = location_buffer.get(driver_id)
+    if buffered is None:
+        buffered = DriverLocation.objects.filter(driver_id=driver_id).values_list(
+            'latitude', 'longitude', 'last_location_update'
+        ).first()
+    if buffered is None:
+        return None
+    latitude, longitude, recorded_at = buffered
+    return {
+        'type': 'location',
+        'driver_id': driver_id,
+        'latitude': float(latitude),
+        'longitude': float(longitude),
+        'recorded_at': recorded_at.isoformat() if recorded_at else None,
+    }
+
+
+async def ride_event_stream(ride, heartbeat_seconds=None):
+    """
+    Yield the events a rider should see: the current status and driver
+    position first, then every change as it is published. Yields None when
+    heartbeat_seconds pass without an event and stops after a terminal status.
+    """
+    from asgiref.sync import sync_to_async
+
+    heartbeat_seconds = heartbeat_seconds or getattr(settings, 'RIDE_EVENTS_HEARTBEAT_SECONDS', 20)
+    driver_id = ride.driver_id
+    subscription = ride_events.subscribe(ride_channel(ride.id))
+    try:
+        if driver_id is not None:
+            subscription.subscribe(driver_channel(driver_id))
+
+        yield ride_status_event(ride)
+        if ride.status in TERMINAL_RIDE_STATUSES:
+            return
+        if driver_id is not None:
+            snapshot = await sync_to_async(_driver_snapshot)(driver_id)
+            if snapshot is not None:
+                yield snapshot
+
+        while True:
+            event = await subscription.get(timeout=heartbeat_seconds)
+            if event is None:
+                yield None
+                continue
+            if event.get('type') == 'status':
+                # Follow the newly assigned driver's position
+                new_driver_id = event.get('driver_id')
+                if new_driver_id != driver_id:
+                    if driver_id is not None:
+                        subscription.unsubscribe(driver_channel(driver_id))
+                    if new_driver_id is not None:
+                        subscription.subscribe(driver_channel(new_driver_id))
+                    driver_id = new_driver_id
+            yield event
+            if event.get('type') == 'status' and event.get('status') in TERMINAL_RIDE_STATUSES:
+                return
+    finally:
+        subscription.close()
+
+
+async def wait_for_ride_version(ride_id, since_version, timeout):
+    """
+    Wait until the ride's version is past since_version; returns the new
+    version, or None once timeout seconds pass without a change. Status
+    events on the ride's channel wake the wait early. The version row is
+    also re-read every RIDE_CHANGES_RECHECK_SECONDS, which catches saves
+    made in other processes when no broker is configured, and saves whose
+    event went out before their transaction committed.
+    """
+    from asgiref.sync import sync_to_async
+    from .models import Ride
+
+    def current_version():
+        return Ride.objects.filter(pk=ride_id).values_list('version', flat=True).first()
+
+    recheck_seconds = getattr(settings, 'RIDE_CHANGES_RECHECK_SECONDS', 5)
+    deadline = time.monotonic() + timeout
+    subscription = ride_events.subscribe(ride_channel(ride_id))
+    try:
+        while True:
+            # Subscribed before reading, so a save in between still wakes us
+            version = await sync_to_async(current_version)()
+            if version is None or version > since_version:
+                return version
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            await subscription.get(timeout=min(remaining, recheck_seconds))
+    finally:
+        subscription.close()
+
+
+async def ride_websocket(scope, receive, send, ride_id):
+    """ASGI WebSocket handler for /ws/rides/<id>/?token=<access token>"""
+    from urllib.parse import parse_qs
+    from asgiref.sync import sync_to_async
+
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+
+    params = parse_qs(scope.get('query_string', b'').decode())
+    token = (params.get('token') or [None])[0]
+    ride, error = await sync_to_async(authorize_ride_subscriber)(token, ride_id)
+    await send({'type': 'websocket.accept'})
+    if error:
+        # Accept first so the client sees the close code: 4000 + HTTP status
+        await send({'type': 'websocket.close', 'code': 4000 + error[0]})
+        return
+
+    async def pump():
+        async for event in ride_event_stream(ride):
+            await send({'type': 'websocket.send', 'text': json.dumps(event or {'type': 'ping'})})
+        await send({'type': 'websocket.close', 'code': 1000})
+
+    async def drain():
+        # Client messages are ignored; we only watch for the disconnect
+        while True:
+            message = await receive()
+            if message['type'] == 'websocket.disconnect':
+                return
+
+    tasks = [asyncio.ensure_future(pump()), asyncio.ensure_future(drain())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is not None:
+                logger.warning("Ride %s event stream ended with %r", ride_id, task.exception())
+    finally:
+        for task in tasks:
+            task.cancel()
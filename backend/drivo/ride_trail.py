@@ -0,0 +1,305 @@
+# ride_trail.py
+"""
+Compact storage for the GPS trail of a ride.
+
+Fixes are stored as fixed-point integers (1e-5 degrees, ~1.1 m, the same
+precision as an encoded polyline) and whole seconds from the start of the
+chunk. Each chunk row keeps three delta-encoded int32 columns (latitude,
+longitude, time), zlib-compressed: consecutive fixes differ by a few
+dozen units, so the high bytes are almost all zero and a trail costs
+roughly 2-3 bytes per point. Chunks are closed after TRAIL_CHUNK_POINTS
+fixes while the ride is running and merged into a single row when it ends.
+
+Driver fixes are buffered in memory per driver and appended to the ride
+that is in progress for that driver when the location buffer flushes.
+Fixes recorded before the ride started (Ride.started_at), such as the
+approach to the pickup or an offline batch uploaded late, are dropped.
+"""
+import array
+import logging
+import struct
+import sys
+import threading
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+COORD_SCALE = 100000
+FORMAT_VERSION = 1
+_HEADER = struct.Struct('<BI')  # version, point count
+
+
+def to_fixed(value):
+    return int(round(float(value) * COORD_SCALE))
+
+
+def _deltas(values):
+    previous = 0
+    out = array.array('i')
+    for value in values:
+        out.append(value - previous)
+        previous = value
+    return out
+
+
+def _undeltas(deltas):
+    total = 0
+    out = []
+    for delta in deltas:
+        total += delta
+        out.append(total)
+    return out
+
+
+def encode_chunk(lats, lons, offsets):
+    """
+    Pack parallel lists of fixed-point latitudes/longitudes and second
+    offsets into the binary chunk format.
+    """
+    count = len(lats)
+    columns = array.array('i')
+    for column in (lats, lons, offsets):
+        columns.extend(_deltas(column))
+    if sys.byteorder == 'big':
+        columns.byteswap()
+    return _HEADER.pack(FORMAT_VERSION, count) + zlib.compress(columns.tobytes())
+
+
+def decode_chunk(data):
+    """Inverse of encode_chunk: returns (lats, lons, offsets) lists"""
+    data = bytes(data)
+    version, count = _HEADER.unpack_from(data)
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported trail chunk version {version}")
+    columns = array.array('i')
+    columns.frombytes(zlib.decompress(data[_HEADER.size:]))
+    if sys.byteorder == 'big':
+        columns.byteswap()
+    return (
+        _undeltas(columns[:count]),
+        _undeltas(columns[count:2 * count]),
+        _undeltas(columns[2 * count:3 * count]),
+    )
+
+
+def encode_polyline(lats, lons):
+    """Google encoded polyline (precision 5) of fixed-point coordinates"""
+    out = []
+    prev_lat = prev_lon = 0
+    for lat, lon in zip(lats, lons):
+        for delta in (lat - prev_lat, lon - prev_lon):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                out.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            out.append(chr(value + 63))
+        prev_lat, prev_lon = lat, lon
+    return ''.join(out)
+
+
+class TrailPoints:
+    """Decoded trail: fixed-point coordinates plus absolute timestamps"""
+
+    def __init__(self):
+        self.lats = []
+        self.lons = []
+        self.times = []
+
+    def __len__(self):
+        return len(self.lats)
+
+    def extend_chunk(self, chunk):
+        lats, lons, offsets = decode_chunk(chunk.data)
+        self.lats.extend(lats)
+        self.lons.extend(lons)
+        self.times.extend(chunk.started_at + timedelta(seconds=offset) for offset in offsets)
+
+    def append(self, lat, lon, recorded_at):
+        self.lats.append(lat)
+        self.lons.append(lon)
+        self.times.append(recorded_at)
+
+    def to_chunk_fields(self, start=0, end=None):
+        lats = self.lats[start:end]
+        lons = self.lons[start:end]
+        times = self.times[start:end]
+        started_at = times[0].replace(microsecond=0)
+        offsets = [int((moment - started_at).total_seconds()) for moment in times]
+        return {
+            'point_count': len(lats),
+            'started_at': started_at,
+            'ended_at': times[-1],
+            'data': encode_chunk(lats, lons, offsets),
+        }
+
+
+def load_trail(ride_id):
+    """All points of a ride's trail, read with a single query"""
+    from .models import RideTrailChunk
+
+    points = TrailPoints()
+    for chunk in RideTrailChunk.objects.filter(ride_id=ride_id).order_by('seq'):
+        points.extend_chunk(chunk)
+    return points
+
+
+def append_points(ride_id, fixes, chunk_points=None):
+    """
+    Append (latitude, longitude, recorded_at) fixes, sorted by time, to a
+    ride's trail. Only the open (last) chunk is rewritten; fixes older than
+    the last stored one are dropped. Returns the number of points stored.
+    """
+    from .models import RideTrailChunk
+
+    chunk_points = chunk_points or getattr(settings, 'TRAIL_CHUNK_POINTS', 300)
+    with transaction.atomic():
+        # Lock the open chunk so two workers flushing the same ride don't interleave
+        open_chunk = RideTrailChunk.objects.select_for_update().filter(
+            ride_id=ride_id
+        ).order_by('-seq').first()
+
+        points = TrailPoints()
+        seq = 0
+        last_time = None
+        if open_chunk is not None:
+            seq = open_chunk.seq
+            last_time = open_chunk.ended_at
+            if open_chunk.point_count < chunk_points:
+                points.extend_chunk(open_chunk)
+            else:
+                open_chunk = None
+                seq += 1
+
+        added = 0
+        for latitude, longitude, recorded_at in fixes:
+            if last_time is not None and recorded_at < last_time:
+                continue
+            points.append(to_fixed(latitude), to_fixed(longitude), recorded_at)
+            last_time = recorded_at
+            added += 1
+        if not added:
+            return 0
+
+        for start in range(0, len(points), chunk_points):
+            fields = points.to_chunk_fields(start, start + chunk_points)
+            if start == 0 and open_chunk is not None:
+                for name, value in fields.items():
+                    setattr(open_chunk, name, value)
+                open_chunk.save(update_fields=list(fields))
+            else:
+                RideTrailChunk.objects.create(ride_id=ride_id, seq=seq, **fields)
+            seq += 1
+    return added
+
+
+def compact_trail(ride_id):
+    """Merge all chunks of a finished ride into one row so it loads in one read"""
+    from .models import RideTrailChunk
+
+    with transaction.atomic():
+        chunks = list(RideTrailChunk.objects.select_for_update().filter(ride_id=ride_id).order_by('seq'))
+        if len(chunks) < 2:
+            return
+        points = TrailPoints()
+        for chunk in chunks:
+            points.extend_chunk(chunk)
+        first = chunks[0]
+        for name, value in points.to_chunk_fields().items():
+            setattr(first, name, value)
+        first.save()
+        RideTrailChunk.objects.filter(pk__in=[chunk.pk for chunk in chunks[1:]]).delete()
+
+
+class TrailBuffer:
+    """Per-driver fixes waiting to be appended to their in-progress ride"""
+
+    def __init__(self, max_points_per_driver=2000):
+        self.max_points_per_driver = max_points_per_driver
+        self._lock = threading.Lock()
+        self._pending = {}  # driver_id -> [(latitude, longitude, recorded_at), ...]
+        self.stats = {'points': 0, 'stored': 0, 'dropped': 0}
+
+    def add(self, driver_id, fixes):
+        with self._lock:
+            pending = self._pending.setdefault(driver_id, [])
+            pending.extend(fixes)
+            self.stats['points'] += len(fixes)
+            overflow = len(pending) - self.max_points_per_driver
+            if overflow > 0:
+                del pending[:overflow]
+                self.stats['dropped'] += overflow
+
+    def flush(self, driver_ids=None, rides=None):
+        """
+        Append pending fixes to the in-progress ride of each driver. rides may
+        map driver_id -> ride_id to target a ride regardless of its status.
+        Fixes recorded before the target ride started are dropped.
+        """
+        from .models import Ride
+
+        with self._lock:
+            if driver_ids is None:
+                snapshot, self._pending = self._pending, {}
+            else:
+                snapshot = {
+                    driver_id: self._pending.pop(driver_id)
+                    for driver_id in driver_ids if driver_id in self._pending
+                }
+        if not snapshot:
+            return 0
+
+        rides = dict(rides or {})
+        started = {}  # ride_id -> started_at
+        missing = [driver_id for driver_id in snapshot if driver_id not in rides]
+        if missing:
+            for driver_id, ride_id, started_at in Ride.objects.filter(
+                driver_id__in=missing, status='in_progress'
+            ).values_list('driver_id', 'id', 'started_at'):
+                rides[driver_id] = ride_id
+                started[ride_id] = started_at
+        named = [ride_id for ride_id in rides.values() if ride_id not in started]
+        if named:
+            started.update(Ride.objects.filter(id__in=named).values_list('id', 'started_at'))
+
+        stored = dropped = 0
+        for driver_id, fixes in snapshot.items():
+            ride_id = rides.get(driver_id)
+            if ride_id is None:
+                dropped += len(fixes)
+                continue
+            # Rides started before started_at existed keep every fix
+            started_at = started.get(ride_id)
+            if started_at is not None:
+                during = [fix for fix in fixes if fix[2] >= started_at]
+                dropped += len(fixes) - len(during)
+                fixes = during
+                if not fixes:
+                    continue
+            fixes.sort(key=lambda fix: fix[2])
+            try:
+                added = append_points(ride_id, fixes)
+            except Exception:
+                logger.exception("Failed to append trail points for ride %s", ride_id)
+                dropped += len(fixes)
+                continue
+            stored += added
+            dropped += len(fixes) - added
+
+        with self._lock:
+            self.stats['stored'] += stored
+            self.stats['dropped'] += dropped
+        return stored
+
+
+trail_buffer = TrailBuffer()
+
+
+def finish_ride_trail(ride):
+    """Store the driver's last buffered fixes on the ride and compact its chunks"""
+    if ride.driver_id is not None:
+        trail_buffer.flush([ride.driver_id], rides={ride.driver_id: ride.id})
+    compact_trail(ride.id)
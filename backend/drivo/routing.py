@@ -0,0 +1,446 @@
+# routing.py
+"""
+Offline road-network routing.
+
+The graph is read from a local extract in ROUTING_GRAPH_DIR:
+
+    nodes.csv  id,lat,lon
+    edges.csv  u,v,length_m,speed_kmh,oneway   (speed_kmh may be empty)
+
+which is what an OSM export (e.g. osmnx nodes/edges tables) reduces to.
+It is compiled into forward and reverse CSR adjacency arrays (indptr /
+indices / travel time / length) and cached next to the CSVs as graph.npz,
+so later processes load it with one np.load.
+
+Queries snap both points to the nearest node and run a bidirectional A*
+on travel time. Potentials come from landmarks (ALT): travel times from
+and to a handful of nodes on the edge of the map are computed once when
+the graph is compiled, and the triangle inequality turns them into much
+tighter lower bounds than straight-line distance. A ride's distance (km)
+and duration (minutes) come from the fastest path.
+"""
+import array
+import csv
+import heapq
+import logging
+import math
+import os
+import threading
+from decimal import Decimal
+from zoneinfo import ZoneInfo
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .geo import KM_PER_DEGREE_LAT, haversine_km, km_per_degree_lon
+from .ranking import haversine_km as haversine_km_many
+
+logger = logging.getLogger(__name__)
+
+_INF = float('inf')
+# Seconds of slack on landmark bounds, covering float32 rounding of the stored times
+LANDMARK_MARGIN = 0.01
+
+
+_ARRAY_DTYPES = {'i': np.int32, 'q': np.int64, 'd': np.float64}
+
+
+def _to_array(typecode, values):
+    out = array.array(typecode)
+    out.frombytes(np.ascontiguousarray(values, dtype=_ARRAY_DTYPES[typecode]).tobytes())
+    return out
+
+
+def _csr(sources, targets, n, *weights):
+    order = np.argsort(sources, kind='stable')
+    indptr = np.searchsorted(sources[order], np.arange(n + 1)).astype(np.int64)
+    return (indptr, targets[order].astype(np.int32)) + tuple(weight[order] for weight in weights)
+
+
+class RoadGraph:
+    def __init__(self, lat, lon, indptr, indices, times, lengths, rindptr, rindices, rtimes, rlengths,
+                 landmark_from=None, landmark_to=None, landmarks=8, snap_cell_deg=0.01):
+        self.node_count = len(lat)
+        self.edge_count = len(indices)
+        self.lat = np.ascontiguousarray(lat, dtype=np.float64)
+        self.lon = np.ascontiguousarray(lon, dtype=np.float64)
+        self.arrays = {
+            'lat': self.lat, 'lon': self.lon,
+            'indptr': indptr, 'indices': indices, 'times': times, 'lengths': lengths,
+            'rindptr': rindptr, 'rindices': rindices, 'rtimes': rtimes, 'rlengths': rlengths,
+        }
+        # Searches walk the adjacency one element at a time, where array.array
+        # indexing is several times faster than indexing NumPy arrays
+        self._forward = (_to_array('q', indptr), _to_array('i', indices), _to_array('d', times), _to_array('d', lengths))
+        self._reverse = (_to_array('q', rindptr), _to_array('i', rindices), _to_array('d', rtimes), _to_array('d', rlengths))
+        # Fastest possible speed in m/s: keeps the straight-line bound admissible
+        speeds = np.asarray(lengths, dtype=np.float64) / np.maximum(np.asarray(times, dtype=np.float64), 1e-9)
+        self.max_speed = float(speeds.max()) if len(speeds) else 1.0
+
+        if landmark_from is None and landmarks and self.node_count:
+            landmark_from, landmark_to = self._build_landmarks(landmarks)
+        self.landmark_from = landmark_from
+        self.landmark_to = landmark_to
+        if landmark_from is not None:
+            self.arrays.update(landmark_from=landmark_from, landmark_to=landmark_to)
+        self._build_snap_grid(snap_cell_deg)
+
+    # ---------- landmarks ----------
+    def _one_to_all(self, adjacency, source):
+        """Travel time in seconds from source to every node (inf if unreachable)"""
+        indptr, indices, times, _ = adjacency
+        dist = [_INF] * self.node_count
+        dist[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            d, node = heapq.heappop(heap)
+            if d > dist[node]:
+                continue
+            for i in range(indptr[node], indptr[node + 1]):
+                neighbour = indices[i]
+                candidate = d + times[i]
+                if candidate < dist[neighbour]:
+                    dist[neighbour] = candidate
+                    heapq.heappush(heap, (candidate, neighbour))
+        return np.array(dist)
+
+    def _build_landmarks(self, count):
+        """
+        ALT preprocessing: exact travel times from and to a few landmarks
+        on the edge of the map, one per compass sector around the centre.
+        Stored as float32, so bounds are taken with LANDMARK_MARGIN slack.
+        """
+        angles = np.arctan2(self.lat - self.lat.mean(), self.lon - self.lon.mean())
+        radius = np.hypot(self.lat - self.lat.mean(), self.lon - self.lon.mean())
+        sectors = np.floor((angles + np.pi) / (2 * np.pi) * count).astype(np.int64) % count
+        chosen = []
+        for sector in range(count):
+            members = np.flatnonzero(sectors == sector)
+            if len(members):
+                chosen.append(int(members[np.argmax(radius[members])]))
+        landmark_from = np.vstack([self._one_to_all(self._forward, node) for node in chosen]).astype(np.float32)
+        landmark_to = np.vstack([self._one_to_all(self._reverse, node) for node in chosen]).astype(np.float32)
+        return landmark_from, landmark_to
+
+    def _potentials(self, source, target, active=4):
+        """
+        Averaged A* potentials for one query, as an array indexed by node.
+        Each side's lower bound comes from the triangle inequality over the
+        landmarks that bound this source-target pair most tightly, or from
+        straight-line time at top speed when the graph has no landmarks.
+        """
+        if self.landmark_from is None:
+            to_target = haversine_km_many(self.lat, self.lon, self.lat[target], self.lon[target]) * 1000 / self.max_speed
+            from_source = haversine_km_many(self.lat, self.lon, self.lat[source], self.lon[source]) * 1000 / self.max_speed
+            return _to_array('d', (to_target - from_source) / 2)
+
+        forward = self.landmark_from  # d(L, v)
+        backward = self.landmark_to   # d(v, L)
+        with np.errstate(invalid='ignore'):
+            pair_bounds = np.maximum(
+                backward[:, source] - backward[:, target], forward[:, target] - forward[:, source]
+            )
+            pair_bounds = np.where(np.isfinite(pair_bounds), pair_bounds, -_INF)
+            best = np.argsort(pair_bounds)[::-1][:active]
+            forward = forward[best]
+            backward = backward[best]
+            to_target = np.maximum(
+                backward - backward[:, target, np.newaxis], forward[:, target, np.newaxis] - forward
+            ).max(axis=0)
+            from_source = np.maximum(
+                forward - forward[:, source, np.newaxis], backward[:, source, np.newaxis] - backward
+            ).max(axis=0)
+        # Unreachable landmarks give inf/nan; 0 is always a valid bound
+        to_target = np.where(np.isfinite(to_target), np.maximum(to_target - LANDMARK_MARGIN, 0.0), 0.0)
+        from_source = np.where(np.isfinite(from_source), np.maximum(from_source - LANDMARK_MARGIN, 0.0), 0.0)
+        return _to_array('d', (to_target - from_source) / 2)
+
+    # ---------- construction ----------
+    @classmethod
+    def from_edges(cls, lat, lon, u, v, length_m, speed_kmh, oneway, **kwargs):
+        """Build from node coordinates (index = node) and per-edge arrays"""
+        lat = np.asarray(lat, dtype=np.float64)
+        u = np.asarray(u, dtype=np.int64)
+        v = np.asarray(v, dtype=np.int64)
+        length_m = np.asarray(length_m, dtype=np.float64)
+        times = length_m / (np.asarray(speed_kmh, dtype=np.float64) / 3.6)
+        twoway = ~np.asarray(oneway, dtype=bool)
+
+        sources = np.concatenate([u, v[twoway]])
+        targets = np.concatenate([v, u[twoway]])
+        times = np.concatenate([times, times[twoway]])
+        lengths = np.concatenate([length_m, length_m[twoway]])
+
+        n = len(lat)
+        forward = _csr(sources, targets, n, times, lengths)
+        reverse = _csr(targets, sources, n, times, lengths)
+        return cls(lat, lon, *forward, *reverse, **kwargs)
+
+    @classmethod
+    def from_csv(cls, directory, default_speed_kmh=40.0, **kwargs):
+        with open(os.path.join(directory, 'nodes.csv'), newline='') as f:
+            rows = list(csv.DictReader(f))
+        node_ids = np.array([int(row['id']) for row in rows], dtype=np.int64)
+        lat = np.array([float(row['lat']) for row in rows], dtype=np.float64)
+        lon = np.array([float(row['lon']) for row in rows], dtype=np.float64)
+        order = np.argsort(node_ids)
+        node_ids, lat, lon = node_ids[order], lat[order], lon[order]
+
+        with open(os.path.join(directory, 'edges.csv'), newline='') as f:
+            rows = list(csv.DictReader(f))
+        u = np.searchsorted(node_ids, np.array([int(row['u']) for row in rows], dtype=np.int64))
+        v = np.searchsorted(node_ids, np.array([int(row['v']) for row in rows], dtype=np.int64))
+        length_m = np.array([float(row['length_m']) for row in rows], dtype=np.float64)
+        speed_kmh = np.array([float(row.get('speed_kmh') or default_speed_kmh) for row in rows], dtype=np.float64)
+        oneway = np.array([row.get('oneway', '').strip().lower() in ('1', 'true', 'yes') for row in rows])
+        return cls.from_edges(lat, lon, u, v, length_m, speed_kmh, oneway, **kwargs)
+
+    @classmethod
+    def load(cls, directory, default_speed_kmh=40.0, **kwargs):
+        """Load the compiled graph.npz, compiling it from the CSVs when missing or stale"""
+        compiled = os.path.join(directory, 'graph.npz')
+        sources = [os.path.join(directory, name) for name in ('nodes.csv', 'edges.csv')]
+        if os.path.exists(compiled) and all(
+            os.path.getmtime(compiled) >= os.path.getmtime(source) for source in sources if os.path.exists(source)
+        ):
+            with np.load(compiled) as data:
+                return cls(**{name: data[name] for name in data.files}, **kwargs)
+
+        graph = cls.from_csv(directory, default_speed_kmh, **kwargs)
+        try:
+            np.savez(compiled, **graph.arrays)
+        except OSError:
+            logger.warning("Could not write compiled road graph to %s", compiled)
+        return graph
+
+    # ---------- snapping ----------
+    def _build_snap_grid(self, cell_deg):
+        self.snap_cell_deg = cell_deg
+        rows = np.floor(self.lat / cell_deg).astype(np.int64)
+        cols = np.floor(self.lon / cell_deg).astype(np.int64)
+        order = np.lexsort((cols, rows))
+        keys = list(zip(rows[order].tolist(), cols[order].tolist()))
+        self._snap_cells = {}
+        start = 0
+        for i in range(1, len(keys) + 1):
+            if i == len(keys) or keys[i] != keys[start]:
+                self._snap_cells[keys[start]] = order[start:i]
+                start = i
+
+    def snap(self, lat, lon, max_km=1.0):
+        """Index of the closest node within max_km, or None"""
+        row = int(math.floor(lat / self.snap_cell_deg))
+        col = int(math.floor(lon / self.snap_cell_deg))
+        cell_km = self.snap_cell_deg * min(KM_PER_DEGREE_LAT, km_per_degree_lon(lat))
+        max_ring = int(math.ceil(max_km / cell_km)) + 1
+        found = []
+        for ring in range(max_ring + 1):
+            for r in range(row - ring, row + ring + 1):
+                for c in range(col - ring, col + ring + 1):
+                    if max(abs(r - row), abs(c - col)) == ring and (r, c) in self._snap_cells:
+                        found.append(self._snap_cells[(r, c)])
+            # One more ring after the first hit covers nodes just across a cell edge
+            if found and ring >= 1:
+                break
+        if not found:
+            return None
+        candidates = np.concatenate(found)
+        distances = haversine_km_many(lat, lon, self.lat[candidates], self.lon[candidates])
+        best = int(np.argmin(distances))
+        if distances[best] > max_km:
+            return None
+        return int(candidates[best])
+
+    # ---------- queries ----------
+    def shortest_path(self, source, target):
+        """
+        Bidirectional A* between two node indices. Returns (seconds, metres,
+        settled node count), or None when target is unreachable.
+        """
+        if source == target:
+            return 0.0, 0.0, 0
+
+        # Averaged potentials are feasible for both directions, so the
+        # searches can stop as soon as top_f + top_r >= best path
+        potential = self._potentials(source, target)
+        dist = ({source: 0.0}, {target: 0.0})
+        length = ({source: 0.0}, {target: 0.0})
+        settled = (set(), set())
+        heaps = ([(potential[source], source)], [(-potential[target], target)])
+        graphs = (self._forward, self._reverse)
+        signs = (1.0, -1.0)
+        best = _INF
+        best_length = None
+        settled_count = 0
+
+        while heaps[0] and heaps[1]:
+            if heaps[0][0][0] + heaps[1][0][0] >= best:
+                break
+            side = 0 if len(heaps[0]) <= len(heaps[1]) else 1
+            key, node = heapq.heappop(heaps[side])
+            if node in settled[side]:
+                continue
+            settled[side].add(node)
+            settled_count += 1
+
+            indptr, indices, times, lengths = graphs[side]
+            my_dist = dist[side]
+            my_length = length[side]
+            other_dist = dist[1 - side]
+            other_length = length[1 - side]
+            base = my_dist[node]
+            base_length = my_length[node]
+            sign = signs[side]
+            for i in range(indptr[node], indptr[node + 1]):
+                neighbour = indices[i]
+                candidate = base + times[i]
+                if candidate < my_dist.get(neighbour, _INF):
+                    my_dist[neighbour] = candidate
+                    my_length[neighbour] = base_length + lengths[i]
+                    heapq.heappush(heaps[side], (candidate + sign * potential[neighbour], neighbour))
+                    if neighbour in other_dist:
+                        total = candidate + other_dist[neighbour]
+                        if total < best:
+                            best = total
+                            best_length = my_length[neighbour] + other_length[neighbour]
+
+        if best == _INF:
+            return None
+        return best, best_length, settled_count
+
+    def times_to(self, target, max_seconds):
+        """
+        {node: travel seconds to target} for every node that can reach the
+        target within max_seconds: Dijkstra on the reversed graph, stopped
+        at the cutoff so only the neighbourhood is searched.
+        """
+        indptr, indices, times, _ = self._reverse
+        dist = {target: 0.0}
+        heap = [(0.0, target)]
+        settled = {}
+        while heap:
+            d, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            if d > max_seconds:
+                break
+            settled[node] = d
+            for i in range(indptr[node], indptr[node + 1]):
+                neighbour = indices[i]
+                candidate = d + times[i]
+                if candidate < dist.get(neighbour, _INF):
+                    dist[neighbour] = candidate
+                    heapq.heappush(heap, (candidate, neighbour))
+        return settled
+
+    def dijkstra(self, source, target):
+        """Plain one-directional Dijkstra; the reference the benchmark checks A* against"""
+        indptr, indices, times, lengths = self._forward
+        dist = {source: 0.0}
+        length = {source: 0.0}
+        heap = [(0.0, source)]
+        settled = set()
+        while heap:
+            d, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            if node == target:
+                return d, length[node], len(settled)
+            settled.add(node)
+            for i in range(indptr[node], indptr[node + 1]):
+                neighbour = indices[i]
+                candidate = d + times[i]
+                if candidate < dist.get(neighbour, _INF):
+                    dist[neighbour] = candidate
+                    length[neighbour] = length[node] + lengths[i]
+                    heapq.heappush(heap, (candidate, neighbour))
+        return None
+
+    def route(self, from_lat, from_lon, to_lat, to_lon, max_snap_km=1.0):
+        """(distance_km, duration_min) between two points, or None"""
+        source = self.snap(float(from_lat), float(from_lon), max_snap_km)
+        target = self.snap(float(to_lat), float(to_lon), max_snap_km)
+        if source is None or target is None:
+            return None
+        result = self.shortest_path(source, target)
+        if result is None:
+            return None
+        seconds, metres, _ = result
+        # Add the straight hop from each point to its snapped node
+        snap_km = (
+            haversine_km(from_lat, from_lon, self.lat[source], self.lon[source])
+            + haversine_km(to_lat, to_lon, self.lat[target], self.lon[target])
+        )
+        return metres / 1000 + snap_km, seconds / 60 + snap_km / (self.max_speed * 3.6) * 60
+
+
+_graph = None
+_graph_lock = threading.Lock()
+_graph_failed = False
+
+
+def road_graph():
+    """The process-wide graph from ROUTING_GRAPH_DIR, loaded on first use; None when not configured"""
+    global _graph, _graph_failed
+    directory = getattr(settings, 'ROUTING_GRAPH_DIR', None)
+    if not directory:
+        return None
+    if _graph_failed:
+        return _graph
+    if _graph is None:
+        with _graph_lock:
+            if _graph is None and not _graph_failed:
+                try:
+                    _graph = RoadGraph.load(
+                        directory, default_speed_kmh=getattr(settings, 'ROUTING_DEFAULT_SPEED_KMH', 40.0)
+                    )
+                    logger.info("Loaded road graph: %d nodes, %d edges", _graph.node_count, _graph.edge_count)
+                except (OSError, ValueError, KeyError) as e:
+                    _graph_failed = True
+                    logger.error("Could not load road graph from %s: %s", directory, e)
+    return _graph
+
+
+def apply_route(instance):
+    """
+    Set distance (km) and duration (minutes) on a Ride or RideRequest from
+    its pickup/dropoff coordinates. Returns False, leaving the instance
+    untouched, when there is no graph, no coordinates or no route.
+    """
+    coordinates = (
+        instance.pickup_latitude, instance.pickup_longitude,
+        instance.dropoff_latitude, instance.dropoff_longitude,
+    )
+    graph = road_graph()
+    if graph is None or any(value is None for value in coordinates):
+        return False
+    result = graph.route(*coordinates, max_snap_km=getattr(settings, 'ROUTING_MAX_SNAP_KM', 1.0))
+    if result is None:
+        return False
+    distance_km, duration_min = result
+    instance.distance = Decimal(str(round(distance_km, 2)))
+    instance.duration = Decimal(str(round(duration_min, 2)))
+    return True
+
+
+def is_night(at):
+    """Night tariff from 21:00 on the service's clock (FARE_TIME_ZONE), whatever offset `at` carries"""
+    if timezone.is_naive(at):
+        at = timezone.make_aware(at)
+    local = timezone.localtime(at, ZoneInfo(getattr(settings, 'FARE_TIME_ZONE', 'Asia/Karachi')))
+    return local.hour >= 21
+
+
+def estimate_fare(duration_min, trip_type='one_way', scheduled_datetime=None, requested_at=None):
+    """
+    Same tariff as the app: a rate per hour, more at night and for two-way
+    trips. Night is judged at the scheduled pickup, or for an immediate
+    ride at requested_at (default now).
+    """
+    fare = float(duration_min) / 60 * getattr(settings, 'FARE_PER_HOUR', 300)
+    if is_night(scheduled_datetime or requested_at or timezone.now()):
+        fare *= getattr(settings, 'FARE_NIGHT_FACTOR', 1.25)
+    if trip_type == 'two_way':
+        fare *= 2
+    return Decimal(round(fare)).quantize(Decimal('0.01'))
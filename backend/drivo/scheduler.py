@@ -0,0 +1,226 @@
+# scheduler.py
+"""
+Releases scheduled ride requests into dispatch shortly before pickup.
+
+A request whose pickup is more than SCHEDULER_LEAD_MINUTES away is saved
+with status 'scheduled': drivers are not offered it and it does not show
+up in their inbox. RideScheduler (run by `manage.py run_scheduler --loop`)
+keeps every scheduled request in a hierarchical timing wheel keyed on its
+release time (pickup minus the lead). When the wheel reaches it, the
+request is flipped to 'pending' with a conditional UPDATE and dispatched.
+
+The wheel is rebuilt from the database at startup with one range read on
+the (status, scheduled_datetime) index. After that, only rows changed
+since the last sync are read, and each is a constant-time reschedule in
+the wheel. A release re-checks the row in the same UPDATE, so a request
+cancelled or moved later in the meantime is never released early.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+def lead_time():
+    return timedelta(minutes=getattr(settings, 'SCHEDULER_LEAD_MINUTES', 15))
+
+
+def schedule_status(scheduled_datetime, now=None):
+    """'scheduled' for a pickup far enough ahead to wait in the scheduler, else 'pending'"""
+    now = now or timezone.now()
+    if scheduled_datetime is not None and scheduled_datetime - lead_time() > now:
+        return 'scheduled'
+    return 'pending'
+
+
+class TimingWheel:
+    """
+    Hierarchical timing wheel. Level 0 has `slots` buckets of one tick
+    each; every level above covers `slots` times the span of the one
+    below, so four levels of 64 one-second slots reach 194 days. An entry
+    sits in the lowest level whose span still separates it from now, and
+    is cascaded one level down each time the level below wraps around.
+    add, cancel and reschedule are O(1); advancing a tick costs the
+    entries that fall due or cascade. Entries beyond the top level wait in
+    an overflow table until it turns.
+    """
+
+    def __init__(self, tick_seconds=1.0, slots=64, levels=4, now=0.0):
+        self.tick_seconds = tick_seconds
+        self.slots = slots
+        self.levels = levels
+        self._tick = int(now // tick_seconds)
+        self._wheels = [[{} for _ in range(slots)] for _ in range(levels)]
+        self._overflow = {}
+        self._where = {}  # key -> the bucket dict holding it
+        self._ready = {}  # entries already due, handed out by the next advance()
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, key):
+        return key in self._where
+
+    def _place(self, key, due_tick):
+        delta = due_tick - self._tick
+        if delta <= 0:
+            bucket = self._ready
+        else:
+            bucket = self._overflow
+            for level in range(self.levels):
+                span = self.slots ** (level + 1)
+                if due_tick // span == self._tick // span:
+                    bucket = self._wheels[level][(due_tick // self.slots ** level) % self.slots]
+                    break
+        bucket[key] = due_tick
+        self._where[key] = bucket
+
+    def add(self, key, due):
+        """Schedule key for the epoch second due; re-adding a key moves it"""
+        self.cancel(key)
+        self._place(key, int(-(-due // self.tick_seconds)))
+
+    def cancel(self, key):
+        bucket = self._where.pop(key, None)
+        if bucket is not None:
+            del bucket[key]
+            return True
+        return False
+
+    reschedule = add
+
+    def _step(self):
+        self._tick += 1
+        tick = self._tick
+        # Highest level whose lower levels all just wrapped around
+        top = 0
+        while top < self.levels and tick % self.slots ** (top + 1) == 0:
+            top += 1
+        if top == self.levels:
+            overflow, self._overflow = self._overflow, {}
+            for key, due_tick in overflow.items():
+                self._place(key, due_tick)
+            top -= 1
+        for level in range(top, 0, -1):
+            slot = (tick // self.slots ** level) % self.slots
+            bucket, self._wheels[level][slot] = self._wheels[level][slot], {}
+            for key, due_tick in bucket.items():
+                self._place(key, due_tick)
+        slot = tick % self.slots
+        bucket, self._wheels[0][slot] = self._wheels[0][slot], {}
+        for key, due_tick in bucket.items():
+            self._place(key, due_tick)
+
+    def advance(self, now):
+        """Move the wheel to epoch second now; returns the (key, due) pairs that fell due"""
+        target = int(now // self.tick_seconds)
+        while self._tick < target:
+            self._step()
+        due, self._ready = self._ready, {}
+        for key in due:
+            del self._where[key]
+        return [(key, due_tick * self.tick_seconds) for key, due_tick in due.items()]
+
+
+class RideScheduler:
+    def __init__(self, tick_seconds=1.0):
+        self.tick_seconds = tick_seconds
+        self.wheel = None
+        self._last_sync = None
+        self.stats = {'released': 0, 'rescheduled': 0, 'skipped': 0}
+
+    @staticmethod
+    def _release_at(scheduled_datetime):
+        return (scheduled_datetime - lead_time()).timestamp()
+
+    def rebuild(self):
+        """Load every scheduled request (one range read on the (status, scheduled_datetime) index)"""
+        from .models import RideRequest
+
+        started = timezone.now()
+        self.wheel = TimingWheel(tick_seconds=self.tick_seconds, now=started.timestamp())
+        rows = RideRequest.objects.filter(
+            status='scheduled', scheduled_datetime__isnull=False
+        ).order_by('scheduled_datetime').values_list('id', 'scheduled_datetime').iterator(chunk_size=5000)
+        for ride_request_id, scheduled_datetime in rows:
+            self.wheel.add(ride_request_id, self._release_at(scheduled_datetime))
+        self._last_sync = started
+        return len(self.wheel)
+
+    def refresh(self):
+        """Apply requests scheduled, moved or cancelled since the last sync"""
+        from .models import RideRequest
+
+        started = timezone.now()
+        rows = RideRequest.objects.filter(
+            status__in=['scheduled', 'pending', 'cancelled'], updated_at__gte=self._last_sync
+        ).values_list('id', 'status', 'scheduled_datetime')
+        for ride_request_id, status, scheduled_datetime in rows:
+            if status == 'scheduled' and scheduled_datetime is not None:
+                self.wheel.reschedule(ride_request_id, self._release_at(scheduled_datetime))
+                self.stats['rescheduled'] += 1
+            else:
+                self.wheel.cancel(ride_request_id)
+        self._last_sync = started
+
+    def tick(self):
+        """Release the requests that are due; returns their ids"""
+        if self.wheel is None:
+            self.rebuild()
+        else:
+            self.refresh()
+        due = [ride_request_id for ride_request_id, _ in self.wheel.advance(timezone.now().timestamp())]
+        return release(due, scheduler=self)
+
+
+def release(ride_request_ids, scheduler=None):
+    """
+    Flip due scheduled requests to 'pending' and dispatch them. The UPDATE
+    re-checks status and pickup time, so a request cancelled or moved
+    later since it was queued is left alone (and re-queued if moved).
+    """
+    from .dispatch import dispatch_ride_request
+    from .heatmap import heatmap
+    from .models import RideRequest
+
+    if not ride_request_ids:
+        return []
+    now = timezone.now()
+    with transaction.atomic():
+        due = RideRequest.objects.filter(
+            id__in=ride_request_ids, status='scheduled', scheduled_datetime__lte=now + lead_time()
+        )
+        released = list(due.values_list('id', flat=True))
+        due.filter(id__in=released).update(status='pending', updated_at=now)
+
+    if scheduler is not None:
+        scheduler.stats['released'] += len(released)
+        for ride_request_id, scheduled_datetime in RideRequest.objects.filter(
+            id__in=set(ride_request_ids) - set(released), status='scheduled', scheduled_datetime__isnull=False
+        ).values_list('id', 'scheduled_datetime'):
+            scheduler.wheel.add(ride_request_id, scheduler._release_at(scheduled_datetime))
+        scheduler.stats['skipped'] += len(ride_request_ids) - len(released)
+
+    for ride_request in RideRequest.objects.filter(id__in=released):
+        heatmap.record_request(ride_request.id, ride_request.pickup_latitude, ride_request.pickup_longitude, now)
+        try:
+            dispatch_ride_request(ride_request)
+        except Exception as e:
+            logger.exception("Dispatching scheduled ride request %s failed: %s", ride_request.id, e)
+    if released:
+        logger.info("Released %d scheduled ride requests: %s", len(released), released)
+    return released
+
+
+def release_due():
+    """Without a running wheel (cron): release everything due, via the (status, scheduled_datetime) index"""
+    from .models import RideRequest
+
+    due = RideRequest.objects.filter(
+        status='scheduled', scheduled_datetime__lte=timezone.now() + lead_time()
+    ).values_list('id', flat=True)
+    return release(list(due))
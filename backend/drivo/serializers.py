@@ -2,12 +2,15 @@ from rest_framework import serializers
 from .models import (
     User, DriverProfile, ClientProfile, Ride, Payment, Review, 
     NotificationPreference, PushNotificationToken, RideRequest, 
-    Cancellation, Earning
+    Cancellation, Earning, DriverLocationFix
 )
+from .location_buffer import location_buffer
 from decimal import Decimal, InvalidOperation
 import os
 import re
 from django.conf import settings
+from django.utils import timezone
+from datetime import timedelta
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -66,10 +69,10 @@ class ClientProfileSerializer(serializers.ModelSerializer):
         model = ClientProfile
         fields = [
             'id', 'user', 'full_name', 'cnic', 'age', 'phone_number',
-            'address', 'dp', 'latitude', 'longitude', 'last_location_update', 
+            'address', 'dp', 'latitude', 'longitude', 'geohash', 'last_location_update', 
             'dp_url', 'name', 'phone', 'phone_number_direct'
         ]
-        read_only_fields = ['id', 'user', 'last_location_update']
+        read_only_fields = ['id', 'user', 'geohash', 'last_location_update']
     
     def get_dp_url(self, obj):
         request = self.context.get('request')
@@ -151,19 +154,31 @@ class DriverProfileSerializer(serializers.ModelSerializer):
     # Custom field to return full URL for profile image
     dp_url = serializers.SerializerMethodField()
     
+    # Live position is stored in the DriverLocation table
+    current_latitude = serializers.DecimalField(
+        max_digits=9, decimal_places=6, source='location.latitude', read_only=True
+    )
+    current_longitude = serializers.DecimalField(
+        max_digits=9, decimal_places=6, source='location.longitude', read_only=True
+    )
+    last_location_update = serializers.DateTimeField(
+        source='location.last_location_update', read_only=True
+    )
+    geohash = serializers.CharField(source='location.geohash', read_only=True)
+    
     class Meta:
         model = DriverProfile
         fields = [
             'id', 'user', 'full_name', 'cnic', 'age', 'driving_license',
-            'license_expiry', 'phone_number', 'city', 'status', 'dp',
-            'current_latitude', 'current_longitude', 'last_location_update', 'dp_url',
+            'license_expiry', 'phone_number', 'city', 'status', 'vehicle_type', 'dp',
+            'current_latitude', 'current_longitude', 'last_location_update', 'geohash', 'dp_url',
             # Bank account fields
             'bank_account_type', 'bank_account_number', 'bank_account_holder', 
             'bank_name', 'bank_account_verified',
             # Verification fields
             'cnic_verified', 'phone_verified', 'license_verified', 'city_verified'
         ]
-        read_only_fields = ['id', 'user', 'last_location_update']
+        read_only_fields = ['id', 'user']
     
     def get_dp_url(self, obj):
         request = self.context.get('request')
@@ -181,6 +196,18 @@ class DriverProfileSerializer(serializers.ModelSerializer):
         # Return default image URL if no image is set
         return f"{settings.MEDIA_URL}profile_pics/default_driver.png"
     
+    def to_representation(self, instance):
+        # Show the live position even if it has not been flushed to the row yet
+        location_buffer.live_location(instance)
+        representation = super().to_representation(instance)
+        
+        # Present when the queryset was ranked by distance (AvailableDriversView ?near=)
+        distance_km = getattr(instance, 'distance_km', None)
+        if distance_km is not None:
+            representation['distance_km'] = round(float(distance_km), 3)
+        
+        return representation
+    
     def validate_age(self, value):
         if value is not None:
             if isinstance(value, str):
@@ -200,6 +227,31 @@ class DriverProfileSerializer(serializers.ModelSerializer):
                 raise serializers.ValidationError("License expiry date must be in the future")
         return value
 
+class LocationFixSerializer(serializers.Serializer):
+    """A single timestamped GPS fix from the driver app"""
+    latitude = serializers.FloatField(min_value=-90, max_value=90)
+    longitude = serializers.FloatField(min_value=-180, max_value=180)
+    recorded_at = serializers.DateTimeField()
+
+class LocationFixBatchSerializer(serializers.Serializer):
+    """Fixes buffered by the driver app, in any order"""
+    fixes = LocationFixSerializer(many=True, allow_empty=False)
+    
+    def validate_fixes(self, value):
+        max_fixes = getattr(settings, 'DRIVER_LOCATION_BATCH_MAX_FIXES', 500)
+        if len(value) > max_fixes:
+            raise serializers.ValidationError(f"At most {max_fixes} fixes can be sent per batch")
+        # A fix from the future would become the driver's newest position and
+        # block every later server-stamped ping: reject real skew, clamp jitter
+        now = timezone.now()
+        max_skew = timedelta(seconds=getattr(settings, 'DRIVER_LOCATION_MAX_CLOCK_SKEW_SECONDS', 30))
+        if any(fix['recorded_at'] > now + max_skew for fix in value):
+            raise serializers.ValidationError("recorded_at cannot be in the future; check the device clock")
+        fixes = sorted(value, key=lambda fix: fix['recorded_at'])
+        for fix in fixes:
+            fix['recorded_at'] = min(fix['recorded_at'], now)
+        return fixes
+
 class RideRequestSerializer(serializers.ModelSerializer):
     client = ClientProfileSerializer(read_only=True)
     
@@ -207,11 +259,11 @@ class RideRequestSerializer(serializers.ModelSerializer):
         model = RideRequest
         fields = [
             'id', 'client', 'pickup_location', 'dropoff_location',
-            'pickup_latitude', 'pickup_longitude', 'dropoff_latitude', 'dropoff_longitude',
+            'pickup_latitude', 'pickup_longitude', 'pickup_geohash', 'dropoff_latitude', 'dropoff_longitude',
             'scheduled_datetime', 'vehicle_type', 'fuel_type', 'trip_type', 
-            'estimated_fare', 'status', 'created_at', 'updated_at'
+            'estimated_fare', 'distance', 'duration', 'status', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'pickup_geohash', 'created_at', 'updated_at']
     
     def to_representation(self, instance):
         representation = super().to_representation(instance)
@@ -244,6 +296,21 @@ class RideRequestSerializer(serializers.ModelSerializer):
             
         return representation
 
+class RideOfferRequestSerializer(RideRequestSerializer):
+    """A ride request in a driver's inbox, with the offer made to that driver"""
+    offer = serializers.SerializerMethodField()
+    
+    class Meta(RideRequestSerializer.Meta):
+        fields = RideRequestSerializer.Meta.fields + ['offer']
+    
+    def get_offer(self, obj):
+        # Annotated by DriverRideRequestsView
+        return {
+            'id': obj.offer_id,
+            'distance_km': str(obj.offer_distance_km) if obj.offer_distance_km is not None else None,
+            'expires_at': obj.offer_expires_at.isoformat(),
+        }
+
 class RideSerializer(serializers.ModelSerializer):
     # Remove request_id and ride_id fields if they exist
     client = ClientProfileSerializer(read_only=True)
@@ -268,6 +335,7 @@ class RideSerializer(serializers.ModelSerializer):
             'trip_type', 
             'fare', 
             'status',
+            'version',
             'created_at', 
             'updated_at'
         ]
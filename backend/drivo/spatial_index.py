@@ -0,0 +1,272 @@
+# spatial_index.py
+"""
+In-memory uniform lat/lon grid of available drivers.
+
+Each process keeps its own copy. It is loaded from the database on first
+use, fed by the location-update views and the DriverProfile post_save
+signal, and re-synced from the database every few seconds so updates that
+landed on other worker processes are picked up.
+"""
+import heapq
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from .geo import haversine_km, km_per_degree_lon, KM_PER_DEGREE_LAT
+
+
+def is_indexable(status, full_name, lat, lon):
+    """Same eligibility rules as AvailableDriversView"""
+    return status == 'available' and bool(full_name) and lat is not None and lon is not None
+
+
+class DriverGridIndex:
+    def __init__(self, cell_size_deg=0.01, sync_seconds=5):
+        self.cell_size_deg = cell_size_deg
+        self.sync_seconds = sync_seconds
+        self._lock = threading.RLock()
+        self._cells = {}  # (row, col) -> {driver_id: (lat, lon)}
+        self._positions = {}  # driver_id -> (row, col)
+        self._loaded = False
+        self._last_sync = None
+        self._last_sync_monotonic = 0.0
+
+    # ---------- writes ----------
+    def _cell_for(self, lat, lon):
+        return (int(math.floor(lat / self.cell_size_deg)), int(math.floor(lon / self.cell_size_deg)))
+
+    def upsert(self, driver_id, lat, lon):
+        lat = float(lat)
+        lon = float(lon)
+        cell = self._cell_for(lat, lon)
+        with self._lock:
+            old_cell = self._positions.get(driver_id)
+            if old_cell is not None and old_cell != cell:
+                bucket = self._cells.get(old_cell)
+                if bucket is not None:
+                    bucket.pop(driver_id, None)
+                    if not bucket:
+                        del self._cells[old_cell]
+            self._cells.setdefault(cell, {})[driver_id] = (lat, lon)
+            self._positions[driver_id] = cell
+
+    def remove(self, driver_id):
+        with self._lock:
+            cell = self._positions.pop(driver_id, None)
+            if cell is None:
+                return
+            bucket = self._cells.get(cell)
+            if bucket is not None:
+                bucket.pop(driver_id, None)
+                if not bucket:
+                    del self._cells[cell]
+
+    def sync(self, driver_id, status, full_name, lat, lon):
+        """Insert or drop a driver depending on whether they are currently dispatchable"""
+        if is_indexable(status, full_name, lat, lon):
+            self.upsert(driver_id, lat, lon)
+        else:
+            self.remove(driver_id)
+
+    def sync_profile(self, profile):
+        from .location_buffer import location_buffer
+
+        location = location_buffer.live_location(profile)
+        if location is None:
+            self.remove(profile.id)
+        else:
+            self.sync(profile.id, profile.status, profile.full_name, location.latitude, location.longitude)
+
+    @staticmethod
+    def _live_position(driver_id, lat, lon, updated_at):
+        # A position still sitting in the write-behind buffer is newer than the row
+        from .location_buffer import location_buffer
+
+        buffered = location_buffer.get(driver_id)
+        if buffered is not None and (updated_at is None or buffered[2] >= updated_at):
+            return buffered[0], buffered[1]
+        return lat, lon
+
+    # ---------- loading ----------
+    def _profile_rows(self, since=None):
+        from django.db.models import Q
+        from .models import DriverProfile
+
+        queryset = DriverProfile.objects.all()
+        if since is None:
+            queryset = queryset.filter(
+                status='available',
+                location__isnull=False
+            ).exclude(full_name__isnull=True).exclude(full_name='')
+        else:
+            # Status changes bump the profile row, flushed pings bump the location row
+            queryset = queryset.filter(
+                Q(updated_at__gte=since) | Q(location__updated_at__gte=since)
+            )
+        return queryset.values_list(
+            'id', 'status', 'full_name', 'location__latitude', 'location__longitude',
+            'location__last_location_update'
+        ).iterator(chunk_size=2000)
+
+    def rebuild(self):
+        """Reload the whole index from the database"""
+        started = timezone.now()
+        cells = {}
+        positions = {}
+        for driver_id, status, full_name, lat, lon, updated_at in self._profile_rows():
+            lat, lon = self._live_position(driver_id, lat, lon, updated_at)
+            lat = float(lat)
+            lon = float(lon)
+            cell = self._cell_for(lat, lon)
+            cells.setdefault(cell, {})[driver_id] = (lat, lon)
+            positions[driver_id] = cell
+        with self._lock:
+            self._cells = cells
+            self._positions = positions
+            self._loaded = True
+            self._last_sync = started
+            self._last_sync_monotonic = time.monotonic()
+        return len(positions)
+
+    def refresh(self):
+        """Apply profile changes made since the last sync (possibly by other processes)"""
+        from .location_buffer import SYNC_OVERLAP
+
+        started = timezone.now()
+        # Re-reading the overlap is harmless: sync() is idempotent
+        since = self._last_sync - SYNC_OVERLAP
+        for driver_id, status, full_name, lat, lon, updated_at in self._profile_rows(since=since):
+            lat, lon = self._live_position(driver_id, lat, lon, updated_at)
+            self.sync(driver_id, status, full_name, lat, lon)
+        with self._lock:
+            self._last_sync = started
+            self._last_sync_monotonic = time.monotonic()
+
+    def ensure_fresh(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.rebuild()
+            return
+        if self.sync_seconds and time.monotonic() - self._last_sync_monotonic >= self.sync_seconds:
+            self.refresh()
+
+    # ---------- queries ----------
+    def nearest(self, lat, lon, k=10, radius_km=5.0):
+        """
+        Return up to k (distance_km, driver_id, lat, lon) tuples within radius_km,
+        closest first. Rings of cells are scanned outward from the query cell
+        and the scan stops as soon as the k-th best distance is inside the
+        area already covered. Rings never leave the radius's bounding box;
+        when the box holds more cells than are occupied (large radius, or
+        near a pole where a degree of longitude shrinks to nothing) the
+        occupied cells inside it are scanned instead.
+        """
+        from .geo import bounding_box
+
+        self.ensure_fresh()
+        lat = float(lat)
+        lon = float(lon)
+        center_row, center_col = self._cell_for(lat, lon)
+        cell_km = self.cell_size_deg * min(KM_PER_DEGREE_LAT, km_per_degree_lon(lat))
+        min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+        min_row, min_col = self._cell_for(min_lat, min_lon)
+        max_row, max_col = self._cell_for(max_lat, max_lon)
+        max_ring = max(center_row - min_row, max_row - center_row, center_col - min_col, max_col - center_col)
+
+        best = []  # max-heap of (-distance, driver_id, lat, lon)
+
+        def consider(bucket):
+            for driver_id, (d_lat, d_lon) in bucket.items():
+                distance = haversine_km(lat, lon, d_lat, d_lon)
+                if distance > radius_km:
+                    continue
+                if len(best) < k:
+                    heapq.heappush(best, (-distance, driver_id, d_lat, d_lon))
+                elif distance < -best[0][0]:
+                    heapq.heapreplace(best, (-distance, driver_id, d_lat, d_lon))
+
+        with self._lock:
+            if (max_row - min_row + 1) * (max_col - min_col + 1) > len(self._cells):
+                for (row, col), bucket in self._cells.items():
+                    if min_row <= row <= max_row and min_col <= col <= max_col:
+                        consider(bucket)
+            else:
+                for ring in range(max_ring + 1):
+                    for cell in self._ring_cells(center_row, center_col, ring):
+                        bucket = self._cells.get(cell)
+                        if bucket:
+                            consider(bucket)
+                    # Everything within ring * cell_km of the query point has now been seen
+                    if len(best) >= k and -best[0][0] <= ring * cell_km:
+                        break
+
+        return sorted((-neg_distance, driver_id, d_lat, d_lon) for neg_distance, driver_id, d_lat, d_lon in best)
+
+    def candidates(self, lat, lon, radius_km=5.0):
+        """
+        Every indexed driver in the cells overlapping the radius's bounding
+        box, as a ranking.Candidates array set (not yet filtered by distance).
+        """
+        from .geo import bounding_box
+        from .ranking import Candidates
+
+        self.ensure_fresh()
+        min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+        min_row, min_col = self._cell_for(min_lat, min_lon)
+        max_row, max_col = self._cell_for(max_lat, max_lon)
+        ids = []
+        lats = []
+        lons = []
+        with self._lock:
+            # Walk whichever is smaller: the cells in the box or the occupied cells
+            if (max_row - min_row + 1) * (max_col - min_col + 1) <= len(self._cells):
+                buckets = (
+                    self._cells.get((row, col))
+                    for row in range(min_row, max_row + 1)
+                    for col in range(min_col, max_col + 1)
+                )
+            else:
+                buckets = (
+                    bucket for (row, col), bucket in self._cells.items()
+                    if min_row <= row <= max_row and min_col <= col <= max_col
+                )
+            for bucket in buckets:
+                if not bucket:
+                    continue
+                ids.extend(bucket.keys())
+                for d_lat, d_lon in bucket.values():
+                    lats.append(d_lat)
+                    lons.append(d_lon)
+        return Candidates(ids, lats, lons)
+
+    @staticmethod
+    def _ring_cells(row, col, ring):
+        if ring == 0:
+            yield (row, col)
+            return
+        for c in range(col - ring, col + ring + 1):
+            yield (row - ring, c)
+            yield (row + ring, c)
+        for r in range(row - ring + 1, row + ring):
+            yield (r, col - ring)
+            yield (r, col + ring)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'loaded': self._loaded,
+                'drivers': len(self._positions),
+                'cells': len(self._cells),
+                'cell_size_deg': self.cell_size_deg,
+                'last_sync': self._last_sync.isoformat() if self._last_sync else None,
+            }
+
+
+driver_index = DriverGridIndex(
+    cell_size_deg=getattr(settings, 'DRIVER_INDEX_CELL_SIZE_DEG', 0.01),
+    sync_seconds=getattr(settings, 'DRIVER_INDEX_SYNC_SECONDS', 5),
+)
@@ -1,3 +1,80 @@
-from django.test import TestCase
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from .models import Ride, User
+from .ride_trail import TrailBuffer, load_trail, to_fixed
+from .routing import estimate_fare
+from .views.client_views import parse_scheduled_datetime
+
+
+@override_settings(FARE_PER_HOUR=300, FARE_NIGHT_FACTOR=1.25, FARE_TIME_ZONE='Asia/Karachi')
+class EstimateFareTests(SimpleTestCase):
+    def test_same_pickup_prices_the_same_whatever_its_offset(self):
+        # 22:00 in Karachi, sent with three different offsets
+        sent = [
+            parse_scheduled_datetime('2025-01-31T22:00:00+05:00'),
+            parse_scheduled_datetime('2025-01-31T17:00:00+00:00'),
+            parse_scheduled_datetime('2025-01-31T19:00:00+02:00'),
+        ]
+        # and as it comes back from the database on a later PATCH
+        loaded = sent[0].astimezone(dt_timezone.utc)
+        fares = {estimate_fare(60, scheduled_datetime=at) for at in sent + [loaded]}
+        self.assertEqual(fares, {Decimal('375.00')})
+
+    def test_daytime_pickup_has_no_night_factor(self):
+        at = parse_scheduled_datetime('2025-01-31T21:30:00+00:00')  # 02:30 next day in Karachi
+        self.assertEqual(estimate_fare(60, scheduled_datetime=at), Decimal('300.00'))
+        at = parse_scheduled_datetime('2025-01-31T15:00:00+00:00')  # 20:00 in Karachi
+        self.assertEqual(estimate_fare(60, scheduled_datetime=at), Decimal('300.00'))
+
+    def test_unscheduled_ride_at_night_uses_the_request_time(self):
+        requested_at = datetime(2025, 1, 31, 17, 30, tzinfo=dt_timezone.utc)  # 22:30 in Karachi
+        self.assertEqual(estimate_fare(60, requested_at=requested_at), Decimal('375.00'))
+        self.assertEqual(estimate_fare(60, 'two_way', requested_at=requested_at), Decimal('750.00'))
+
+    def test_scheduled_pickup_wins_over_the_request_time(self):
+        requested_at = datetime(2025, 1, 31, 17, 30, tzinfo=dt_timezone.utc)  # night when booked
+        pickup = datetime(2025, 2, 1, 5, 0, tzinfo=dt_timezone.utc)  # 10:00 in Karachi
+        self.assertEqual(
+            estimate_fare(60, scheduled_datetime=pickup, requested_at=requested_at), Decimal('300.00')
+        )
+
+
+class RideTrailTests(TestCase):
+    def setUp(self):
+        client = User.objects.create_user(email='client@example.com', password='x12345678', is_client=True)
+        driver = User.objects.create_user(email='driver@example.com', password='x12345678', is_driver=True)
+        self.driver = driver.driver_profile
+        self.ride = Ride.objects.create(
+            client=client.client_profile, driver=self.driver,
+            pickup_location='A', dropoff_location='B', status='accepted'
+        )
+
+    def test_fixes_recorded_before_the_ride_starts_are_not_stored(self):
+        buffer = TrailBuffer()
+        now = timezone.now()
+        # The drive to the pickup, and an offline batch uploaded late
+        buffer.add(self.driver.id, [(31.50, 74.30, now - timedelta(minutes=30)), (31.51, 74.31, now - timedelta(seconds=5))])
+        self.ride.status = 'in_progress'
+        self.ride.save()
+        self.assertIsNotNone(self.ride.started_at)
+        buffer.add(self.driver.id, [(31.52, 74.32, self.ride.started_at + timedelta(seconds=2))])
+        buffer.flush()
+
+        trail = load_trail(self.ride.id)
+        self.assertEqual(trail.lats, [to_fixed(31.52)])
+        self.assertEqual(buffer.stats['stored'], 1)
+        self.assertEqual(buffer.stats['dropped'], 2)
+
+    def test_started_at_is_kept_across_saves(self):
+        self.ride.status = 'in_progress'
+        self.ride.save(update_fields=['status'])
+        started_at = Ride.objects.get(pk=self.ride.pk).started_at
+        self.assertIsNotNone(started_at)
+        ride = Ride.objects.get(pk=self.ride.pk)
+        ride.fare = Decimal('100.00')
+        ride.save()
+        self.assertEqual(Ride.objects.get(pk=self.ride.pk).started_at, started_at)
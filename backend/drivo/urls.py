@@ -2,6 +2,8 @@ from django.urls import path
 from .views.user_views import *
 from .views.client_views import *
 from .views.driver_views import *  # This imports all views from driver_views.py
+from .views.realtime_views import driver_offers_view, ride_changes_view, ride_events_view
+from .views.async_geocode_views import geocode_async_view
 app_name = 'drivo'
 urlpatterns = [
     # ===== LEGACY URLS (without prefixes) =====
@@ -19,6 +21,11 @@ urlpatterns = [
     path('test-media/', test_media_view, name='test-media'),
     path('media/<path:path>', serve_media_view, name='serve-media'),
     path('geocode/', GeocodeView.as_view(), name='geocode'),
+    path('geocode/autocomplete/', GeocodeAutocompleteView.as_view(), name='geocode-autocomplete'),
+    path('geocode/async/', geocode_async_view, name='geocode-async'),
+    path('heatmap/', HeatmapView.as_view(), name='heatmap'),
+    path('geocode/batch/', GeocodeBatchView.as_view(), name='geocode-batch'),
+    path('reverse-geocode/', ReverseGeocodeView.as_view(), name='reverse-geocode'),
     path('cache-stats/', CacheStatsView.as_view(), name='cache-stats'),
     path('system-stats/', SystemStatisticsView.as_view(), name='system-stats'),
     
@@ -55,6 +62,10 @@ urlpatterns = [
     path('user/test-media/', test_media_view, name='user-test-media'),
     path('user/media/<path:path>', serve_media_view, name='user-serve-media'),
     path('user/geocode/', GeocodeView.as_view(), name='user-geocode'),
+    path('user/geocode/autocomplete/', GeocodeAutocompleteView.as_view(), name='user-geocode-autocomplete'),
+    path('user/geocode/async/', geocode_async_view, name='user-geocode-async'),
+    path('user/geocode/batch/', GeocodeBatchView.as_view(), name='user-geocode-batch'),
+    path('user/reverse-geocode/', ReverseGeocodeView.as_view(), name='user-reverse-geocode'),
     path('user/cache-stats/', CacheStatsView.as_view(), name='user-cache-stats'),
     path('user/system-stats/', SystemStatisticsView.as_view(), name='user-system-stats'),
     
@@ -71,7 +82,9 @@ urlpatterns = [
     path('driver/profile/', DriverProfileView.as_view(), name='driver-profile'),
     path('driver/driver-profile/', DriverProfileView.as_view(), name='driver-profile-hyphen'),
     path('driver/update-location/', UpdateDriverLocationView.as_view(), name='driver-update-location'),
+    path('driver/locations/batch/', DriverLocationBatchView.as_view(), name='driver-locations-batch'),
     path('driver/ride-requests/', DriverRideRequestsView.as_view(), name='driver-ride-requests'),
+    path('driver/offers/events/', driver_offers_view, name='driver-offers-events'),
     path('driver/current-ride/', DriverCurrentRideView.as_view(), name='driver-current-ride'),
     path('driver/ride-history/', DriverRideHistoryView.as_view(), name='driver-ride-history'),
     path('driver/earnings/', DriverEarningsView.as_view(), name='driver-earnings'),
@@ -82,6 +95,8 @@ urlpatterns = [
     # New endpoints for available drivers
     path('available-drivers/', AvailableDriversView.as_view(), name='available-drivers'),
     path('driver/available-drivers/', AvailableDriversView.as_view(), name='driver-available-drivers'),
+    path('nearby-drivers/', NearbyDriversView.as_view(), name='nearby-drivers'),
+    path('driver/nearby-drivers/', NearbyDriversView.as_view(), name='driver-nearby-drivers'),
     
     # New endpoint for all driver profiles
     path('driver/profiles/', DriverProfilesView.as_view(), name='driver-profiles'),
@@ -91,6 +106,9 @@ urlpatterns = [
     
     # New endpoint for ride details
     path('rides/<int:pk>/', RideDetailView.as_view(), name='ride-detail'),
+    path('rides/<int:pk>/trail/', RideTrailView.as_view(), name='ride-trail'),
+    path('rides/<int:pk>/events/', ride_events_view, name='ride-events'),
+    path('rides/<int:pk>/changes/', ride_changes_view, name='ride-changes'),
     
     # New endpoints for ride request management
     path('client/ride-request/<int:pk>/', UpdateRideRequestView.as_view(), name='client-update-ride-request'),
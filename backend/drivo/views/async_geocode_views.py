@@ -0,0 +1,27 @@
+# async_geocode_views.py
+from django.core.handlers.wsgi import WSGIRequest
+from django.http import JsonResponse
+
+from ..geocoding import cache_key_for, sanitize_cache_key
+from ..geocoding_async import async_geocoder
+
+
+# ------------------- ASYNC GEOCODE VIEW -------------------
+async def geocode_async_view(request):
+    """
+    GeocodeView for the ASGI app: same answers, but the upstream call holds
+    no worker thread, reuses pooled connections, and is answered from the
+    local fallbacks when the upstream concurrency limit is saturated.
+    """
+    query = ' '.join(request.GET.get('q', '').split())
+    if not query:
+        return JsonResponse({"error": "Query parameter 'q' is required"}, status=400)
+
+    cache_key = cache_key_for('geocode', sanitize_cache_key(query))
+    try:
+        data, status_code = await async_geocoder.geocode(query, cache_key)
+    finally:
+        if isinstance(request, WSGIRequest):
+            # This request's event loop ends with it: don't leave its client open
+            await async_geocoder.release()
+    return JsonResponse(data, status=status_code, safe=False)
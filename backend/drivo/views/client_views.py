@@ -4,16 +4,41 @@ from rest_framework.response import Response
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import ValidationError
 import re 
 from drivo.models import DriverProfile, ClientProfile, Ride, Payment, Review, RideRequest
 from drivo.serializers import (
     ClientProfileSerializer, DriverProfileSerializer, RideSerializer, PaymentSerializer, 
     PaymentCreateSerializer, ReviewSerializer, RideRequestSerializer
 )
+from drivo.geo import filter_geohash_prefix, parse_near_params, nearest_by_sql
+from drivo.location_buffer import location_buffer, record_driver_location
+from drivo.ride_trail import load_trail, encode_polyline
+from drivo.routing import apply_route, estimate_fare
+from drivo.dispatch import dispatch_ride_request, request_expires_at
+from drivo.scheduler import schedule_status
+from drivo.heatmap import heatmap
+from drivo.current_ride_cache import current_ride_cache
 from decimal import Decimal
 from datetime import datetime
 from django.utils import timezone
 
+def parse_scheduled_datetime(scheduled_datetime_str):
+    """Parse the app's pickup time ('2025-01-31T09:30:00[+05:00]' or '2025-01-31 09:30'); None if unparseable"""
+    if not scheduled_datetime_str:
+        return None
+    try:
+        if 'T' in scheduled_datetime_str:
+            if '+' in scheduled_datetime_str or '-' in scheduled_datetime_str[-6:]:
+                return datetime.fromisoformat(scheduled_datetime_str)
+            naive_datetime = datetime.strptime(scheduled_datetime_str.split('.')[0], '%Y-%m-%dT%H:%M:%S')
+            return timezone.make_aware(naive_datetime)
+        naive_datetime = datetime.strptime(scheduled_datetime_str, '%Y-%m-%d %H:%M')
+        return timezone.make_aware(naive_datetime)
+    except (ValueError, TypeError) as e:
+        print(f"Error parsing datetime: {e}")
+        return None
+
 # ------------------- CLIENT PROFILE VIEW -------------------
 class ClientProfileView(APIView):
     permission_classes = [IsAuthenticated]
@@ -149,12 +174,8 @@ class SaveLocationView(APIView):
                 
             elif getattr(user, 'is_driver', False):
                 profile, _ = DriverProfile.objects.get_or_create(user=user)
-                profile.current_latitude = lat_decimal
-                profile.current_longitude = lon_decimal
-                profile.save()
-                
-                profile.refresh_from_db()
-                print(f"Driver location saved - lat: {profile.current_latitude}, lon: {profile.current_longitude}")
+                # Buffered and written in bulk by the location flusher
+                record_driver_location(profile, round(lat_decimal, 6), round(lon_decimal, 6))
                 
             else:
                 return Response(
@@ -205,12 +226,13 @@ class GetCurrentLocationView(APIView):
                 )
         elif getattr(user, 'is_driver', False):
             try:
-                profile = DriverProfile.objects.get(user=user)
-                if profile.current_latitude is not None and profile.current_longitude is not None:
+                profile = DriverProfile.objects.select_related('location').get(user=user)
+                location = location_buffer.live_location(profile)
+                if location is not None:
                     return Response({
-                        "latitude": profile.current_latitude,
-                        "longitude": profile.current_longitude,
-                        "last_updated": profile.last_location_update
+                        "latitude": location.latitude,
+                        "longitude": location.longitude,
+                        "last_updated": location.last_location_update
                     }, status=status.HTTP_200_OK)
                 else:
                     return Response(
@@ -237,7 +259,9 @@ class ClientRideHistoryView(generics.ListAPIView):
     def get_queryset(self):
         try:
             client_profile = ClientProfile.objects.get(user=self.request.user)
-            return Ride.objects.filter(client=client_profile).order_by('-created_at')
+            return Ride.objects.filter(client=client_profile).select_related(
+                'client__user', 'driver__user', 'driver__location'
+            ).order_by('-created_at')
         except ClientProfile.DoesNotExist:
             return Ride.objects.none()
 
@@ -265,21 +289,7 @@ class RideRequestView(APIView):
                 full_name=request.user.email.split('@')[0]
             )
         
-        scheduled_datetime_str = request.data.get('scheduled_datetime')
-        scheduled_datetime = None
-        if scheduled_datetime_str:
-            try:
-                if 'T' in scheduled_datetime_str:
-                    if '+' in scheduled_datetime_str or '-' in scheduled_datetime_str[-6:]:
-                        scheduled_datetime = datetime.fromisoformat(scheduled_datetime_str)
-                    else:
-                        naive_datetime = datetime.strptime(scheduled_datetime_str.split('.')[0], '%Y-%m-%dT%H:%M:%S')
-                        scheduled_datetime = timezone.make_aware(naive_datetime)
-                else:
-                    naive_datetime = datetime.strptime(scheduled_datetime_str, '%Y-%m-%d %H:%M')
-                    scheduled_datetime = timezone.make_aware(naive_datetime)
-            except (ValueError, TypeError) as e:
-                print(f"Error parsing datetime: {e}")
+        scheduled_datetime = parse_scheduled_datetime(request.data.get('scheduled_datetime'))
         
         ride_request_data = {
             'client': client_profile,
@@ -329,10 +339,33 @@ class RideRequestView(APIView):
                 fuel_type=ride_request_data['fuel_type'],
                 trip_type=ride_request_data['trip_type'],
                 estimated_fare=ride_request_data.get('estimated_fare'),
+                # Pickups further out than the lead time wait for run_scheduler
+                status=schedule_status(ride_request_data.get('scheduled_datetime')),
+                # Nobody accepting by then moves it to 'expired' (expire_ride_requests)
+                expires_at=request_expires_at(ride_request_data.get('scheduled_datetime')),
             )
             
+            # Price the trip on the road graph when one is configured
+            if apply_route(ride_request):
+                ride_request.estimated_fare = estimate_fare(
+                    ride_request.duration, ride_request.trip_type, ride_request.scheduled_datetime,
+                    requested_at=ride_request.created_at
+                )
+            
             ride_request.save()
             ride_request.refresh_from_db()
+            if ride_request.status == 'pending':
+                heatmap.record_request(
+                    ride_request.id, ride_request.pickup_latitude, ride_request.pickup_longitude, ride_request.updated_at
+                )
+            
+            # Offer the request to the best nearby drivers; it stays pending
+            # either way, and run_dispatcher retries if nobody was found.
+            # Scheduled requests are offered once run_scheduler releases them.
+            try:
+                dispatch_ride_request(ride_request)
+            except Exception as e:
+                print(f"Error dispatching ride request {ride_request.id}: {e}")
             
             response_data = {
                 'id': ride_request.id,
@@ -355,6 +388,8 @@ class RideRequestView(APIView):
                 'fuel_type': ride_request.fuel_type or '',
                 'trip_type': ride_request.trip_type or '',
                 'estimated_fare': str(ride_request.estimated_fare) if ride_request.estimated_fare is not None else "0.00",
+                'distance': str(ride_request.distance) if ride_request.distance is not None else None,
+                'duration': str(ride_request.duration) if ride_request.duration is not None else None,
                 'status': ride_request.status or '',
                 'created_at': ride_request.created_at.isoformat() if ride_request.created_at is not None else None,
                 'updated_at': ride_request.updated_at.isoformat() if ride_request.updated_at is not None else None,
@@ -391,15 +426,45 @@ class UpdateRideRequestView(APIView):
                     status=status.HTTP_403_FORBIDDEN
                 )
             
-            # Update the ride request with route details
-            if 'distance' in request.data:
-                ride_request.distance = request.data['distance']
-            if 'duration' in request.data:
-                ride_request.duration = request.data['duration']
-            if 'fare' in request.data:
-                ride_request.estimated_fare = request.data['fare']
+            # Moving the pickup time re-queues a request that has not been taken yet
+            previous_status = ride_request.status
+            if 'scheduled_datetime' in request.data:
+                if ride_request.status not in ('pending', 'scheduled'):
+                    return Response(
+                        {"error": "Only pending or scheduled ride requests can be rescheduled"},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                scheduled_datetime = parse_scheduled_datetime(request.data['scheduled_datetime'])
+                if request.data['scheduled_datetime'] and scheduled_datetime is None:
+                    return Response(
+                        {"error": "Invalid scheduled_datetime"},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                ride_request.scheduled_datetime = scheduled_datetime
+                ride_request.status = schedule_status(scheduled_datetime)
+                ride_request.expires_at = request_expires_at(scheduled_datetime)
+            
+            # Update the ride request with route details. The server-side route
+            # wins; the app's values are only used when there is no road graph.
+            if apply_route(ride_request):
+                ride_request.estimated_fare = estimate_fare(
+                    ride_request.duration, ride_request.trip_type, ride_request.scheduled_datetime,
+                    requested_at=ride_request.created_at
+                )
+            else:
+                if 'distance' in request.data:
+                    ride_request.distance = request.data['distance']
+                if 'duration' in request.data:
+                    ride_request.duration = request.data['duration']
+                if 'fare' in request.data:
+                    ride_request.estimated_fare = request.data['fare']
                 
             ride_request.save()
+            if ride_request.status == 'pending' and previous_status == 'scheduled':
+                try:
+                    dispatch_ride_request(ride_request)
+                except Exception as e:
+                    print(f"Error dispatching ride request {ride_request.id}: {e}")
             
             serializer = RideRequestSerializer(ride_request)
             return Response(serializer.data)
@@ -472,8 +537,8 @@ class ConvertRideRequestToRideView(APIView):
             print(f"Pickup location: {ride_request.pickup_location}")
             print(f"Dropoff location: {ride_request.dropoff_location}")
             print(f"Estimated fare: {ride_request.estimated_fare}")
-            print(f"Distance: {getattr(ride_request, 'distance', 'Not available')}")
-            print(f"Duration: {getattr(ride_request, 'duration', 'Not available')}")
+            print(f"Distance: {ride_request.distance}")
+            print(f"Duration: {ride_request.duration}")
             
             # Create a new ride from the ride request
             ride_data = {
@@ -489,16 +554,11 @@ class ConvertRideRequestToRideView(APIView):
                 'fuel_type': ride_request.fuel_type,
                 'trip_type': ride_request.trip_type,
                 'fare': ride_request.estimated_fare,
+                'distance': ride_request.distance,
+                'duration': ride_request.duration,
                 'status': 'requested'
             }
             
-            # Add distance and duration if they exist on the ride request
-            if hasattr(ride_request, 'distance') and ride_request.distance is not None:
-                ride_data['distance'] = ride_request.distance
-            
-            if hasattr(ride_request, 'duration') and ride_request.duration is not None:
-                ride_data['duration'] = ride_request.duration
-            
             # Log the ride data for debugging
             print("=== RIDE DATA ===")
             print("Ride data:", ride_data)
@@ -683,6 +743,7 @@ class RideDetailView(APIView):
                     ride.driver.save()
             
             ride.save()
+            current_ride_cache.invalidate_driver(ride.driver)
             serializer = RideSerializer(ride)
             return Response(serializer.data)
             
@@ -692,6 +753,37 @@ class RideDetailView(APIView):
                 status=status.HTTP_404_NOT_FOUND
             )
 
+# ------------------- RIDE TRAIL VIEW -------------------
+class RideTrailView(APIView):
+    """The GPS trail recorded while the ride was in progress, as an encoded polyline"""
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [JWTAuthentication]
+    
+    def get(self, request, pk):
+        try:
+            ride = Ride.objects.select_related('client', 'driver').get(pk=pk)
+        except Ride.DoesNotExist:
+            return Response(
+                {"error": "Ride not found"}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        if not ((request.user.is_client and ride.client.user_id == request.user.id) or
+                (request.user.is_driver and ride.driver and ride.driver.user_id == request.user.id)):
+            return Response(
+                {"error": "You don't have permission to view this ride"}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        points = load_trail(ride.id)
+        return Response({
+            "ride_id": ride.id,
+            "point_count": len(points),
+            "started_at": points.times[0] if points.times else None,
+            "ended_at": points.times[-1] if points.times else None,
+            "polyline": encode_polyline(points.lats, points.lons),
+        }, status=status.HTTP_200_OK)
+
 # ------------------- AVAILABLE DRIVERS VIEW -------------------
 class AvailableDriversView(generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
@@ -700,11 +792,25 @@ class AvailableDriversView(generics.ListAPIView):
     
     def get_queryset(self):
         # Only return drivers that are available and have location data
-        return DriverProfile.objects.filter(
+        queryset = DriverProfile.objects.filter(
             status='available',
-            current_latitude__isnull=False,
-            current_longitude__isnull=False
-        ).exclude(full_name__isnull=True).exclude(full_name='').order_by('-created_at')
+            location__isnull=False
+        ).exclude(full_name__isnull=True).exclude(full_name='').select_related('location')
+        
+        # ?near=lat,lon&radius_km=&k= ranks the closest drivers in SQL;
+        # ?geohash_prefix= restricts to one geohash cell
+        try:
+            queryset = filter_geohash_prefix(queryset, 'location__geohash', self.request.query_params)
+            near = parse_near_params(self.request.query_params)
+        except (TypeError, ValueError) as e:
+            raise ValidationError({"error": str(e)})
+        if near:
+            lat, lon, radius_km, k = near
+            return nearest_by_sql(
+                queryset, 'location__latitude', 'location__longitude', lat, lon, radius_km, k
+            )
+        
+        return queryset.order_by('-created_at')
 
 # ------------------- PAYMENT VIEWS -------------------
 class PaymentView(APIView):
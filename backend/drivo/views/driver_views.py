@@ -4,16 +4,27 @@ from rest_framework.response import Response
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.exceptions import NotFound
+from rest_framework.exceptions import NotFound, ValidationError
+import math
 import re
 from datetime import datetime
 from decimal import Decimal
+from django.db.models import F
+from django.utils import timezone
 from ..models import (
-    User, DriverProfile, Ride, Payment, RideRequest
+    User, DriverProfile, Ride, Payment, RideRequest, DriverLocationFix
 )
 from ..serializers import (
-    DriverProfileSerializer, RideSerializer, PaymentSerializer, RideRequestSerializer
+    DriverProfileSerializer, RideSerializer, PaymentSerializer, RideRequestSerializer,
+    LocationFixBatchSerializer, RideOfferRequestSerializer
 )
+from ..geo import filter_geohash_prefix, parse_coordinates, parse_near_params, nearest_by_sql
+from ..spatial_index import driver_index
+from ..location_buffer import location_buffer, record_driver_location
+from ..ride_trail import trail_buffer
+from ..ranking import bearing_deg
+from ..dispatch import AcceptConflict, accept_ride_request, decline_offer, not_expired
+from ..current_ride_cache import current_ride_cache
 
 # ------------------- DRIVER PROFILE VIEW -------------------
 class DriverProfileView(APIView):
@@ -78,6 +89,14 @@ class DriverProfileView(APIView):
                 profile.phone_number = phone_number
         if 'address' in data:
             profile.address = data['address']
+        if 'vehicle_type' in data:
+            vehicle_types = dict(DriverProfile._meta.get_field('vehicle_type').choices)
+            if data['vehicle_type'] not in vehicle_types:
+                return Response(
+                    {"error": f"vehicle_type must be one of: {', '.join(vehicle_types)}"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            profile.vehicle_type = data['vehicle_type']
         
         # Driver license information
         if 'driving_license' in data:
@@ -126,28 +145,123 @@ class UpdateDriverLocationView(APIView):
     
     def patch(self, request):
         try:
-            profile = DriverProfile.objects.get(user=request.user)
-            profile.current_latitude = request.data.get('current_latitude')
-            profile.current_longitude = request.data.get('current_longitude')
-            profile.save()
+            profile = DriverProfile.objects.only('id', 'status', 'full_name').get(user=request.user)
+        except DriverProfile.DoesNotExist:
             return Response(
-                {"success": True, "message": "Location updated successfully"},
-                status=status.HTTP_200_OK
+                {"success": False, "error": "Driver profile not found"},
+                status=status.HTTP_404_NOT_FOUND
             )
+        
+        try:
+            lat, lon = parse_coordinates(
+                request.data.get('current_latitude'),
+                request.data.get('current_longitude')
+            )
+        except (TypeError, ValueError):
+            return Response(
+                {"success": False, "error": "Valid current_latitude and current_longitude are required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Buffered and written in bulk by the location flusher
+        record_driver_location(profile, round(Decimal(str(lat)), 6), round(Decimal(str(lon)), 6))
+        return Response(
+            {"success": True, "message": "Location updated successfully"},
+            status=status.HTTP_200_OK
+        )
+
+# ------------------- BATCH DRIVER LOCATION VIEW -------------------
+class DriverLocationBatchView(APIView):
+    """
+    Accepts many timestamped fixes in one request (including ones buffered
+    while the device was offline). Every fix is appended to the trail with a
+    single bulk INSERT and only the newest one goes to the location buffer.
+    """
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [JWTAuthentication]
+    
+    def post(self, request):
+        try:
+            profile = DriverProfile.objects.only(
+                'id', 'status', 'full_name'
+            ).get(user=request.user)
         except DriverProfile.DoesNotExist:
             return Response(
                 {"success": False, "error": "Driver profile not found"},
                 status=status.HTTP_404_NOT_FOUND
             )
+        
+        serializer = LocationFixBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        fixes = serializer.validated_data['fixes']
+        
+        DriverLocationFix.objects.bulk_create([
+            DriverLocationFix(
+                driver_id=profile.id,
+                latitude=round(Decimal(str(fix['latitude'])), 6),
+                longitude=round(Decimal(str(fix['longitude'])), 6),
+                recorded_at=fix['recorded_at'],
+            )
+            for fix in fixes
+        ])
+        
+        # Every fix belongs on the trail of an in-progress ride
+        trail_buffer.add(profile.id, [
+            (fix['latitude'], fix['longitude'], fix['recorded_at']) for fix in fixes
+        ])
+        if not location_buffer.write_behind:
+            trail_buffer.flush([profile.id])
+        
+        # Fixes arrive sorted by recorded_at; a late batch of old fixes must not
+        # overwrite a newer position the driver already holds
+        newest = fixes[-1]
+        last_update = location_buffer.last_update(profile.id)
+        updated_position = last_update is None or newest['recorded_at'] >= last_update
+        if updated_position:
+            updated_position = record_driver_location(
+                profile,
+                round(Decimal(str(newest['latitude'])), 6),
+                round(Decimal(str(newest['longitude'])), 6),
+                recorded_at=newest['recorded_at'],
+                trail=False
+            )
+        
+        return Response({
+            "success": True,
+            "accepted": len(fixes),
+            "position_updated": updated_position,
+            "latest_recorded_at": newest['recorded_at'].isoformat()
+        }, status=status.HTTP_200_OK)
 
 # ------------------- DRIVER RIDE REQUESTS VIEW -------------------
 class DriverRideRequestsView(generics.ListAPIView):
+    """
+    The calling driver's offer inbox: pending, unexpired requests the
+    dispatcher has offered to them and whose offer has not lapsed (dispatch.py).
+    """
     permission_classes = [IsAuthenticated]
     authentication_classes = [JWTAuthentication]
-    serializer_class = RideRequestSerializer
+    serializer_class = RideOfferRequestSerializer
     
     def get_queryset(self):
-        return RideRequest.objects.filter(status='pending').order_by('-created_at')
+        queryset = RideRequest.objects.filter(
+            not_expired(),
+            status='pending',
+            offers__driver__user=self.request.user,
+            offers__status='offered',
+            offers__expires_at__gt=timezone.now(),
+        ).annotate(
+            offer_id=F('offers__id'),
+            offer_distance_km=F('offers__distance_km'),
+            offer_expires_at=F('offers__expires_at'),
+        )
+        # ?geohash_prefix= narrows to pickups in one geohash cell
+        try:
+            queryset = filter_geohash_prefix(queryset, 'pickup_geohash', self.request.query_params)
+        except ValueError as e:
+            raise ValidationError({"error": str(e)})
+        return queryset.order_by('-created_at')
 
 # ------------------- DRIVER CURRENT RIDE VIEW -------------------
 class DriverCurrentRideView(generics.RetrieveAPIView):
@@ -157,10 +271,21 @@ class DriverCurrentRideView(generics.RetrieveAPIView):
     
     def get_object(self):
         try:
-            driver_profile = DriverProfile.objects.get(user=self.request.user)
-            return Ride.objects.get(driver=driver_profile, status='in_progress')
-        except (DriverProfile.DoesNotExist, Ride.DoesNotExist):
+            # One query: the ride, its client and its driver with their users and position
+            return Ride.objects.select_related(
+                'client__user', 'driver__user', 'driver__location'
+            ).get(driver__user=self.request.user, status='in_progress')
+        except Ride.DoesNotExist:
             return None
+    
+    def retrieve(self, request, *args, **kwargs):
+        # Serialized payloads are cached per driver until a status change
+        # invalidates them (current_ride_cache.py)
+        data = current_ride_cache.get(request.user.id)
+        if data is None:
+            data = self.get_serializer(self.get_object()).data
+            current_ride_cache.set(request.user.id, data)
+        return Response(data)
 
 # ------------------- DRIVER RIDE HISTORY VIEW -------------------
 class DriverRideHistoryView(generics.ListAPIView):
@@ -171,7 +296,9 @@ class DriverRideHistoryView(generics.ListAPIView):
     def get_queryset(self):
         try:
             driver_profile = DriverProfile.objects.get(user=self.request.user)
-            return Ride.objects.filter(driver=driver_profile).order_by('-created_at')
+            return Ride.objects.filter(driver=driver_profile).select_related(
+                'client__user', 'driver__user', 'driver__location'
+            ).order_by('-created_at')
         except DriverProfile.DoesNotExist:
             return Ride.objects.none()
 
@@ -274,46 +401,31 @@ class DriverRespondToRideView(APIView):
             )
         
         if is_accept:
-            ride_request.status = 'accepted'
-            
-            ride_data = {
-                'client': ride_request.client,
-                'driver': driver_profile,
-                'pickup_location': ride_request.pickup_location,
-                'dropoff_location': ride_request.dropoff_location,
-                'pickup_latitude': ride_request.pickup_latitude,
-                'pickup_longitude': ride_request.pickup_longitude,
-                'dropoff_latitude': ride_request.dropoff_latitude,
-                'dropoff_longitude': ride_request.dropoff_longitude,
-                'scheduled_datetime': ride_request.scheduled_datetime,
-                'vehicle_type': ride_request.vehicle_type,
-                'fuel_type': ride_request.fuel_type,
-                'trip_type': ride_request.trip_type,
-                'fare': ride_request.estimated_fare,
-                'status': 'accepted'
-            }
-            
-            ride = Ride.objects.create(**ride_data)
-            
-            # Set driver status to 'busy' only when accepting a ride
-            driver_profile.status = 'busy'
-            driver_profile.save()
+            # The conditional UPDATE, not the check above, decides who wins
+            try:
+                ride = accept_ride_request(ride_request, driver_profile)
+            except AcceptConflict as e:
+                return Response(
+                    {"error": str(e)}, 
+                    status=status.HTTP_409_CONFLICT
+                )
             
             message = "Ride request accepted successfully"
             ride_id = ride.id
         else:
-            ride_request.status = 'rejected'
+            # Declining only closes this driver's offer; the request stays
+            # pending and goes to the next drivers once no offer is outstanding
+            decline_offer(ride_request, driver_profile)
             # If driver was offline and rejected, keep them offline
             if driver_profile.status == 'offline':
                 driver_profile.status = 'offline'
             else:
                 driver_profile.status = 'available'
             driver_profile.save()
+            current_ride_cache.invalidate_driver(driver_profile)
             message = "Ride request rejected successfully"
             ride_id = None
         
-        ride_request.save()
-        
         serializer = RideRequestSerializer(ride_request)
         response_data = {
             'success': True,
@@ -367,31 +479,11 @@ class AssignDriverToRideView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        ride_data = {
-            'client': ride_request.client,
-            'driver': driver_profile,
-            'pickup_location': ride_request.pickup_location,
-            'dropoff_location': ride_request.dropoff_location,
-            'pickup_latitude': ride_request.pickup_latitude,
-            'pickup_longitude': ride_request.pickup_longitude,
-            'dropoff_latitude': ride_request.dropoff_latitude,
-            'dropoff_longitude': ride_request.dropoff_longitude,
-            'scheduled_datetime': ride_request.scheduled_datetime,
-            'vehicle_type': ride_request.vehicle_type,
-            'fuel_type': ride_request.fuel_type,
-            'trip_type': ride_request.trip_type,
-            'fare': ride_request.estimated_fare,
-            'status': 'in_progress'
-        }
-        
         try:
-            ride = Ride.objects.create(**ride_data)
-            
-            ride_request.status = 'accepted'
-            ride_request.save()
-            
-            driver_profile.status = 'busy'
-            driver_profile.save()
+            # The conditional UPDATE, not the checks above, decides who wins
+            ride = accept_ride_request(
+                ride_request, driver_profile, driver_statuses=('available',), ride_status='in_progress'
+            )
             
             serializer = RideSerializer(ride)
             return Response({
@@ -400,6 +492,11 @@ class AssignDriverToRideView(APIView):
                 'ride': serializer.data
             }, status=status.HTTP_200_OK)
             
+        except AcceptConflict as e:
+            return Response(
+                {"error": str(e)}, 
+                status=status.HTTP_409_CONFLICT
+            )
         except Exception as e:
             print(f"Error creating ride: {str(e)}")
             import traceback
@@ -427,6 +524,7 @@ class ResetDriverStatusView(APIView):
             
             driver_profile.status = status
             driver_profile.save()
+            current_ride_cache.invalidate_driver(driver_profile)
             
             return Response({
                 "success": True,
@@ -448,16 +546,94 @@ class AvailableDriversView(generics.ListAPIView):
     
     def get_queryset(self):
         # Only return drivers that are available and have complete profiles
-        return DriverProfile.objects.filter(
+        queryset = DriverProfile.objects.filter(
             status='available',
             user__is_driver=True,
             user__is_active=True
         ).exclude(
             full_name=''
         ).exclude(
-            current_latitude__isnull=True,
-            current_longitude__isnull=True
-        ).order_by('-created_at')
+            location__isnull=True
+        ).select_related('location')
+        
+        # ?near=lat,lon&radius_km=&k= ranks the closest drivers in SQL;
+        # ?geohash_prefix= restricts to one geohash cell
+        try:
+            queryset = filter_geohash_prefix(queryset, 'location__geohash', self.request.query_params)
+            near = parse_near_params(self.request.query_params)
+        except (TypeError, ValueError) as e:
+            raise ValidationError({"error": str(e)})
+        if near:
+            lat, lon, radius_km, k = near
+            return nearest_by_sql(
+                queryset, 'location__latitude', 'location__longitude', lat, lon, radius_km, k
+            )
+        
+        return queryset.order_by('-created_at')
+
+# ------------------- NEARBY DRIVERS VIEW -------------------
+class NearbyDriversView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    authentication_classes = [JWTAuthentication]
+    
+    MAX_K = 50
+    MAX_RADIUS_KM = 50.0
+    
+    def get(self, request):
+        try:
+            lat, lon = parse_coordinates(
+                request.query_params.get('lat'),
+                request.query_params.get('lon')
+            )
+        except (TypeError, ValueError):
+            return Response(
+                {"error": "Valid 'lat' and 'lon' query parameters are required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            k = min(int(request.query_params.get('k', 10)), self.MAX_K)
+            radius_km = min(float(request.query_params.get('radius', 5)), self.MAX_RADIUS_KM)
+        except (TypeError, ValueError):
+            return Response(
+                {"error": "'k' must be an integer and 'radius' a number of kilometres"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if k < 1 or not math.isfinite(radius_km) or radius_km <= 0:
+            return Response(
+                {"error": "'k' and 'radius' must be positive"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # The ring search stops as soon as k drivers are certain, which beats a
+        # full vectorised pass for one point; bearings are computed in one go
+        matches = driver_index.nearest(lat, lon, k=k, radius_km=radius_km)
+        bearings = bearing_deg([match[2] for match in matches], [match[3] for match in matches], lat, lon)
+        results = [
+            {
+                'id': driver_id,
+                'current_latitude': round(d_lat, 6),
+                'current_longitude': round(d_lon, 6),
+                'distance_km': round(distance, 3),
+                'bearing_deg': round(float(bearing), 1),
+            }
+            for (distance, driver_id, d_lat, d_lon), bearing in zip(matches, bearings)
+        ]
+        
+        # Optionally attach full profiles (one extra query for the whole page)
+        if request.query_params.get('expand') in ['1', 'true', 'True']:
+            profiles = DriverProfile.objects.select_related('user', 'location').in_bulk(
+                [result['id'] for result in results]
+            )
+            for result in results:
+                profile = profiles.get(result['id'])
+                if profile is not None:
+                    result['driver'] = DriverProfileSerializer(profile, context={'request': request}).data
+        
+        return Response({
+            'count': len(results),
+            'results': results
+        }, status=status.HTTP_200_OK)
 
 # ------------------- DRIVER PROFILES VIEW -------------------
 class DriverProfilesView(generics.ListAPIView):
@@ -467,12 +643,17 @@ class DriverProfilesView(generics.ListAPIView):
     
     def get_queryset(self):
         # Return all active drivers with complete profiles
-        return DriverProfile.objects.filter(
+        queryset = DriverProfile.objects.filter(
             user__is_driver=True,
             user__is_active=True
         ).exclude(
             full_name=''
-        ).order_by('-created_at')
+        ).select_related('location')
+        try:
+            queryset = filter_geohash_prefix(queryset, 'location__geohash', self.request.query_params)
+        except ValueError as e:
+            raise ValidationError({"error": str(e)})
+        return queryset.order_by('-created_at')
 
 # ------------------- DRIVER PROFILE DETAIL VIEW (FIXED) -------------------
 class DriverProfileDetailView(generics.RetrieveAPIView):
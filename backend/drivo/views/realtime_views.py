@@ -0,0 +1,120 @@
+# realtime_views.py
+import json
+import math
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+
+from ..dispatch import driver_offer_stream
+from ..models import Ride
+from ..realtime import (
+    authorize_driver_subscriber, authorize_ride_subscriber, ride_event_stream, wait_for_ride_version
+)
+from ..serializers import RideSerializer
+
+
+def _bearer_token(request):
+    token = request.GET.get('token')
+    header = request.headers.get('Authorization', '')
+    if not token and header.startswith('Bearer '):
+        token = header[len('Bearer '):]
+    return token
+
+
+# ------------------- RIDE EVENTS (SSE) VIEW -------------------
+async def ride_events_view(request, pk):
+    """
+    Server-Sent Events fallback for clients that can't open the
+    /ws/rides/<id>/ WebSocket. EventSource can't set headers, so the access
+    token may be passed as ?token=. Needs an ASGI server: under WSGI every
+    open stream would hold a worker thread.
+    """
+    token = _bearer_token(request)
+    ride, error = await sync_to_async(authorize_ride_subscriber)(token, pk)
+    if error:
+        return JsonResponse({"error": error[1]}, status=error[0])
+
+    async def events():
+        yield "retry: 3000\n\n"
+        async for event in ride_event_stream(ride):
+            if event is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+# ------------------- RIDE CHANGES (LONG-POLL) VIEW -------------------
+def _serialized_ride(pk):
+    ride = Ride.objects.select_related('client__user', 'driver__user').get(pk=pk)
+    return RideSerializer(ride).data
+
+
+async def ride_changes_view(request, pk):
+    """
+    Long-poll for clients that poll a ride's details. Returns the ride as
+    RideDetailView does once its version is past ?since_version=, holding
+    the request open for up to ?timeout= seconds (capped at
+    RIDE_CHANGES_TIMEOUT_SECONDS). If nothing changes by then it returns an
+    empty 304, so an idle poll serializes nothing. Without since_version it
+    answers at once. Same authentication and ASGI requirement as the ride
+    events stream.
+    """
+    ride, error = await sync_to_async(authorize_ride_subscriber)(_bearer_token(request), pk)
+    if error:
+        return JsonResponse({"error": error[1]}, status=error[0])
+
+    max_timeout = getattr(settings, 'RIDE_CHANGES_TIMEOUT_SECONDS', 25)
+    try:
+        since_version = request.GET.get('since_version')
+        since_version = int(since_version) if since_version not in (None, '') else None
+        timeout = float(request.GET.get('timeout', max_timeout))
+        if not math.isfinite(timeout):
+            raise ValueError
+    except ValueError:
+        return JsonResponse({"error": "'since_version' must be an integer and 'timeout' a number"}, status=400)
+    timeout = min(max(timeout, 0), max_timeout)
+
+    if since_version is not None and ride.version <= since_version:
+        version = await wait_for_ride_version(ride.id, since_version, timeout)
+        if version is None:
+            response = HttpResponse(status=304)
+            response['ETag'] = f'"{ride.version}"'
+            return response
+
+    try:
+        data = await sync_to_async(_serialized_ride)(pk)
+    except Ride.DoesNotExist:
+        return JsonResponse({"error": "Ride not found"}, status=404)
+    response = JsonResponse(data)
+    response['ETag'] = f'"{data["version"]}"'
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+# ------------------- DRIVER OFFERS (SSE) VIEW -------------------
+async def driver_offers_view(request):
+    """
+    Push channel for ride offers addressed to the calling driver: their
+    outstanding offers first, then each new offer or withdrawal. Same
+    authentication and ASGI requirement as the ride events stream.
+    """
+    driver_id, error = await sync_to_async(authorize_driver_subscriber)(_bearer_token(request))
+    if error:
+        return JsonResponse({"error": error[1]}, status=error[0])
+
+    async def events():
+        yield "retry: 3000\n\n"
+        async for event in driver_offer_stream(driver_id):
+            if event is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
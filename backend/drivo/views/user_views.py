@@ -15,10 +15,22 @@ from rest_framework.exceptions import ValidationError
 import random
 import requests
 from django.core.cache import cache
+from django.http import StreamingHttpResponse
+import json
 import re
 from datetime import datetime, timedelta, date
 from django.utils import timezone
 import os
+from ..gazetteer import gazetteer
+from ..heatmap import heatmap
+from ..current_ride_cache import current_ride_cache
+from ..geo import parse_bbox, parse_coordinates
+from ..geocoding_async import async_geocoder
+from ..geocoding import (
+    cache_key_for, geocode_cache, geocode_coalesced, geocode_flight, nominatim_search, reverse_geocoder,
+    sanitize_cache_key
+)
+from ..geocoding_batch import geocode_batch, upstream_bucket
 from ..models import (
     User, DriverProfile, ClientProfile, Ride, Payment, Review, EmailOTP, RideRequest
 )
@@ -383,9 +395,6 @@ def serve_media_view(request, path):
     return serve(request, path, document_root=settings.MEDIA_ROOT)
 
 # ------------------- GEOCODE VIEW -------------------
-def sanitize_cache_key(query):
-    return re.sub(r'[^A-Za-z0-9]', '_', query.strip().lower())
-
 class GeocodeView(APIView):
     permission_classes = [AllowAny]
     authentication_classes = []  # Disable authentication for this view
@@ -400,77 +409,137 @@ class GeocodeView(APIView):
             )
         
         normalized_query = ' '.join(query.split())
-        cache_key = f'geocode_{sanitize_cache_key(normalized_query)}'
+        cache_key = cache_key_for('geocode', sanitize_cache_key(normalized_query))
         
-        cached_response = cache.get(cache_key)
+        cached_response = geocode_cache.get(cache_key)
         if cached_response is not None:
             print(f"Cache hit for: {query}")
             return Response(cached_response, status=status.HTTP_200_OK)
         
+        # A place the bundled gazetteer knows by name needs no network call
+        place = gazetteer().lookup(normalized_query)
+        if place is not None:
+            return Response([place.as_result()], status=status.HTTP_200_OK)
+        
         print(f"Cache miss for: {query} - Making API request")
         
-        default_coordinates = {
-            'lahore': {'lat': '31.5204', 'lon': '74.3587', 'display_name': 'Lahore, Pakistan'},
-            'karachi': {'lat': '24.8607', 'lon': '67.0011', 'display_name': 'Karachi, Pakistan'},
-            'islamabad': {'lat': '33.6844', 'lon': '73.0479', 'display_name': 'Islamabad, Pakistan'},
-            'rawalpindi': {'lat': '33.6007', 'lon': '73.0679', 'display_name': 'Rawalpindi, Pakistan'},
-            'peshawar': {'lat': '34.0151', 'lon': '71.5249', 'display_name': 'Peshawar, Pakistan'},
-            'quetta': {'lat': '30.1798', 'lon': '66.9750', 'display_name': 'Quetta, Pakistan'},
-            'multan': {'lat': '30.1575', 'lon': '71.5249', 'display_name': 'Multan, Pakistan'},
-            'faisalabad': {'lat': '31.4187', 'lon': '73.0791', 'display_name': 'Faisalabad, Pakistan'},
-        }
-        
-        url = 'https://nominatim.openstreetmap.org/search'
-        params = {
-            'q': normalized_query,
-            'format': 'json',
-            'limit': 1,
-            'addressdetails': 1,
-            'extratags': 1,
-            'namedetails': 1
-        }
-        headers = {
-            'User-Agent': 'Drivo/1.0 (gdooduii@gmail.com)'
-        }
+        # Concurrent misses for the same query share one upstream request
+        data, status_code = geocode_coalesced(normalized_query, cache_key)
+        return Response(data, status=status_code)
+
+# ------------------- GEOCODE BATCH VIEW -------------------
+class GeocodeBatchView(APIView):
+    """
+    Geocode up to GEOCODE_BATCH_MAX_QUERIES queries in one request, e.g. when
+    importing saved places. Streams NDJSON: one line per distinct query as it
+    is answered (cached ones first), then a summary line.
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def post(self, request):
+        queries = request.data.get('queries')
+        if not isinstance(queries, list) or not queries:
+            return Response(
+                {"error": "'queries' must be a non-empty list"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        max_queries = getattr(settings, 'GEOCODE_BATCH_MAX_QUERIES', 500)
+        if len(queries) > max_queries:
+            return Response(
+                {"error": f"At most {max_queries} queries per batch"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not all(isinstance(query, str) for query in queries):
+            return Response(
+                {"error": "Every query must be a string"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        def lines():
+            counts = {}
+            for result in geocode_batch(queries):
+                counts[result['source']] = counts.get(result['source'], 0) + 1
+                yield json.dumps(result) + '\n'
+            yield json.dumps({'done': True, 'queries': len(queries), 'distinct': sum(counts.values()), **counts}) + '\n'
+        
+        response = StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+        # Let reverse proxies pass lines through as they are produced
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+# ------------------- GEOCODE AUTOCOMPLETE VIEW -------------------
+class GeocodeAutocompleteView(APIView):
+    permission_classes = [AllowAny]
+    authentication_classes = []  # Disable authentication for this view
+    
+    def get(self, request):
+        query = ' '.join(request.query_params.get('q', '').split())
+        
+        if not query:
+            return Response(
+                {"error": "Query parameter 'q' is required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
         try:
-            response = requests.get(url, params=params, headers=headers, timeout=5)
-            response.raise_for_status()
-            data = response.json()
-            
-            if data:
-                cache.set(cache_key, data, timeout=86400)
-                print(f"Cached response for: {query}")
-                return Response(data, status=status.HTTP_200_OK)
-            else:
-                query_lower = normalized_query.lower()
-                for city, coords in default_coordinates.items():
-                    if city in query_lower:
-                        print(f"Using default coordinates for {city}")
-                        default_data = [coords]
-                        cache.set(cache_key, default_data, timeout=86400)
-                        return Response(default_data, status=status.HTTP_200_OK)
-                
-                cache.set(cache_key, [], timeout=3600)
+            limit = max(1, min(int(request.query_params.get('limit', 5)), 10))
+        except ValueError:
+            return Response(
+                {"error": "limit must be an integer"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        matches = gazetteer().search(query, limit)
+        if matches:
+            return Response({
+                'query': query,
+                'source': 'gazetteer',
+                'results': [place.as_result(match, score) for place, match, score in matches]
+            }, status=status.HTTP_200_OK)
+        
+        # Only complete-looking queries fall through to the upstream geocoder,
+        # not every keystroke
+        if len(query) < getattr(settings, 'GEOCODE_AUTOCOMPLETE_UPSTREAM_MIN_CHARS', 3):
+            return Response({'query': query, 'source': 'gazetteer', 'results': []}, status=status.HTTP_200_OK)
+        
+        cache_key = cache_key_for('autocomplete', sanitize_cache_key(f'{query} {limit}'))
+        results = geocode_cache.get(cache_key)
+        if results is None:
+            try:
+                results = nominatim_search(query, limit=limit)
+            except requests.RequestException as e:
                 return Response(
-                    {"error": "Location not found"},
-                    status=status.HTTP_404_NOT_FOUND
+                    {"error": "External API request failed", "details": str(e)},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE
                 )
-                
-        except requests.RequestException as e:
-            query_lower = normalized_query.lower()
-            for city, coords in default_coordinates.items():
-                if city in query_lower:
-                    print(f"API failed, using default coordinates for {city}")
-                    default_data = [coords]
-                    cache.set(cache_key, default_data, timeout=86400)
-                    return Response(default_data, status=status.HTTP_200_OK)
-            
-            cache.set(cache_key, {'error': str(e)}, timeout=300)
+            geocode_cache.set(cache_key, results, timeout=86400 if results else 3600)
+        
+        return Response({'query': query, 'source': 'upstream', 'results': results}, status=status.HTTP_200_OK)
+
+# ------------------- REVERSE GEOCODE VIEW -------------------
+class ReverseGeocodeView(APIView):
+    permission_classes = [AllowAny]
+    authentication_classes = []  # Disable authentication for this view
+    
+    def get(self, request):
+        try:
+            lat, lon = parse_coordinates(
+                request.query_params.get('lat'),
+                request.query_params.get('lon')
+            )
+        except (TypeError, ValueError):
+            return Response(
+                {"error": "Valid 'lat' and 'lon' query parameters are required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        result = reverse_geocoder.lookup(lat, lon)
+        if result is None:
             return Response(
-                {"error": "External API request failed", "details": str(e)},
-                status=status.HTTP_503_SERVICE_UNAVAILABLE
+                {"error": "Location not found"},
+                status=status.HTTP_404_NOT_FOUND
             )
+        return Response(result, status=status.HTTP_200_OK)
 
 # ------------------- CACHE STATS VIEW -------------------
 class CacheStatsView(APIView):
@@ -478,20 +547,27 @@ class CacheStatsView(APIView):
     authentication_classes = []  # Disable authentication for this view
     
     def get(self, request):
-        from django.core.cache import cache
+        from django.core.cache import caches
+        cache = caches['default']
         
         try:
             if hasattr(cache, '_cache'):
-                geocode_keys = len([k for k in cache._cache.keys() if k.startswith('geocode')])
                 total_keys = len(cache._cache.keys())
             else:
-                geocode_keys = "N/A"
                 total_keys = "N/A"
-                
+            
+            # Geocoder answers live in the shared table, not the default cache
+            geocode_stats = geocode_cache.summary()
             stats = {
-                'backend': str(cache._class_),
-                'geocode_cache_entries': geocode_keys,
+                'backend': str(cache.__class__),
+                'geocode_cache_entries': geocode_stats['entries'],
                 'total_cache_entries': total_keys,
+                'geocode_cache': geocode_stats,
+                'reverse_geocode': reverse_geocoder.summary(),
+                'geocode_single_flight': geocode_flight.summary(),
+                'geocode_async': async_geocoder.summary(),
+                'geocode_batch_bucket': upstream_bucket.summary(),
+                'driver_current_ride': current_ride_cache.summary(),
                 'cache_config': {
                     'timeout_default': settings.CACHES.get('default', {}).get('TIMEOUT', 'N/A'),
                     'backend': settings.CACHES.get('default', {}).get('BACKEND', 'N/A')
@@ -500,7 +576,7 @@ class CacheStatsView(APIView):
         except Exception as e:
             stats = {
                 'error': str(e),
-                'backend': str(cache._class_)
+                'backend': str(cache.__class__)
             }
         
         return Response(stats, status=200)
@@ -526,6 +602,26 @@ class SystemStatisticsView(generics.GenericAPIView):
             "environment": "Development" if settings.DEBUG else "Production",
         })
 
+# ------------------- HEATMAP VIEW -------------------
+class HeatmapView(APIView):
+    """
+    Pending ride requests and available drivers per grid cell inside
+    ?bbox=min_lat,min_lon,max_lat,max_lon over the last
+    HEATMAP_WINDOW_MINUTES. Read from in-memory counters (heatmap.py).
+    """
+    permission_classes = [IsAdminUser]
+    authentication_classes = [JWTAuthentication]
+    
+    def get(self, request):
+        try:
+            min_lat, min_lon, max_lat, max_lon = parse_bbox(request.query_params.get('bbox'))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        result = heatmap.area(min_lat, min_lon, max_lat, max_lon)
+        result['bbox'] = [min_lat, min_lon, max_lat, max_lon]
+        return Response(result, status=status.HTTP_200_OK)
+
 # ------------------- LOGIN VIEW -------------------
 class LoginView(APIView):
     permission_classes = [AllowAny]